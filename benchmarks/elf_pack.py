@@ -0,0 +1,80 @@
+"""
+Measure Elf.pack against the number of sections, run as
+`python3 -m benchmarks.elf_pack`.
+
+Every function of the synthetic object gets a .text, .rel.text and .rodata section,
+like MWCC emits them. The time per section should stay flat as the object grows.
+"""
+
+import argparse
+import timeit
+
+from mwccgap.elf import Elf
+
+from .objects import (
+    R_MIPS_26,
+    SHF_ALLOC,
+    SHF_EXECINSTR,
+    STB_LOCAL,
+    STT_FUNC,
+    STT_OBJECT,
+    ObjRelocation,
+    ObjSection,
+    ObjSymbol,
+    write_object,
+)
+
+
+def make_object(function_count: int) -> bytes:
+    sections: list[ObjSection] = []
+    symbols: list[ObjSymbol] = []
+    for i in range(function_count):
+        text = ObjSection(".text", SHF_ALLOC | SHF_EXECINSTR, data=bytearray(64))
+        text.relocations.append(
+            ObjRelocation(0, R_MIPS_26, f"func_{(i + 1) % function_count}")
+        )
+        sections.append(text)
+        symbols.append(ObjSymbol(f"func_{i}", len(sections) - 1, 0, 64, type=STT_FUNC))
+
+        sections.append(ObjSection(".rodata", data=bytearray(16)))
+        symbols.append(
+            ObjSymbol(
+                f"D_{i}", len(sections) - 1, 0, 16, bind=STB_LOCAL, type=STT_OBJECT
+            )
+        )
+    return write_object(sections, symbols)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--functions", type=int, nargs="+", default=[250, 500, 1000, 2000, 4000]
+    )
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"{'sections':>10} {'pack (ms)':>10} {'us/section':>11}")
+    per_section = []
+    for function_count in args.functions:
+        elf = Elf(make_object(function_count))
+        # decode everything, as the transplant does, so that it is all repacked
+        for record in elf.get_relocations():
+            record.relocations
+        elf.symtab.symbols
+        elf.strtab.symbols
+
+        seconds = min(timeit.repeat(elf.pack, number=1, repeat=args.repeat))
+        section_count = len(elf.sections)
+        per_section.append(seconds / section_count)
+        print(
+            f"{section_count:>10} {seconds * 1000:>10.2f} "
+            f"{per_section[-1] * 1e6:>11.3f}"
+        )
+
+    print(
+        f"cost per section, largest vs smallest: {per_section[-1] / per_section[0]:.2f}x"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,203 @@
+"""
+Generate a synthetic translation unit: a C file of INCLUDE_ASM and INCLUDE_RODATA
+statements and C functions, and the spimdisasm-style assembly files they include.
+Run as `python3 -m benchmarks.generate OUT_DIR`.
+
+Every other INCLUDE_ASM function has jump tables in .rodata. Functions reference
+their jump tables with %hi/%lo, the small data area with %gp_rel and, every
+`call_interval` instructions, call another function.
+"""
+
+import argparse
+import random
+
+from pathlib import Path
+
+MACRO_INC = """\
+.macro glabel label, visibility=global
+    .\\visibility \\label
+    \\label:
+.endm
+.macro dlabel label, visibility=global
+    .\\visibility \\label
+    \\label:
+.endm
+.macro jlabel label
+    \\label:
+.endm
+"""
+
+
+def instruction(rng: random.Random, offset: int, text: str) -> str:
+    word = rng.getrandbits(32).to_bytes(4, "little").hex().upper()
+    return f"    /* {offset:X} {0x80000000 + offset:08X} {word} */  {text}"
+
+
+def write_function(
+    rng: random.Random,
+    path: Path,
+    name: str,
+    n_instructions: int,
+    n_rodata: int,
+    callees: list[str],
+    call_interval: int = 11,
+) -> None:
+    lines = [
+        ".set noat      /* allow manual use of $at */",
+        ".set noreorder /* don't insert nops after branches */",
+        "",
+    ]
+    rodata_names = [f"jtbl_{name}_{i}" for i in range(n_rodata)]
+    if n_rodata:
+        lines.append(".section .rodata")
+        for r, rodata_name in enumerate(rodata_names):
+            lines += [".align 3", f"dlabel {rodata_name}"]
+            for j in range(4):
+                lines.append(f"    /* {j * 4:X} */ .word .L{name}_{j}")
+            lines.append(f"    /* 10 */ .word 0x{rng.getrandbits(32):08X}")
+            lines.append(f".size {rodata_name}, . - {rodata_name}")
+        lines += ["", ".section .text"]
+
+    lines.append(f"glabel {name}")
+    labels = 0
+    for i in range(n_instructions):
+        offset = i * 4
+        if i % 7 == 3 and labels < 4:
+            lines.append(f"  .L{name}_{labels}:")
+            labels += 1
+        if call_interval and i % call_interval == call_interval // 2 and callees:
+            text = f"jal        {rng.choice(callees)}"
+        elif i % 13 == 6 and rodata_names:
+            rodata = rng.choice(rodata_names)
+            text = f"lui        $at, %hi({rodata})"
+        elif i % 13 == 7 and rodata_names:
+            rodata = rng.choice(rodata_names)
+            text = f"lw         $at, %lo({rodata})($at)"
+        elif i % 17 == 8:
+            text = f"lw         $v0, %gp_rel(D_gp_{i})($gp)"
+        else:
+            text = "addiu      $sp, $sp, -0x10"
+        lines.append(instruction(rng, offset, text))
+    while labels < 4 and n_rodata:
+        lines.append(f"  .L{name}_{labels}:")
+        lines.append(instruction(rng, n_instructions * 4, "nop"))
+        labels += 1
+    lines.append(f".size {name}, . - {name}")
+    path.write_text("\n".join(lines) + "\n")
+
+
+def write_rodata(rng: random.Random, path: Path, name: str, size: int) -> None:
+    lines = [".section .rodata", "", ".align 2", f"dlabel {name}"]
+    for i in range(size // 4):
+        lines.append(f"    /* {i * 4:X} */ .word 0x{rng.getrandbits(32):08X}")
+    lines.append(f'    /* {size:X} */ .asciz "mwccgap {name}"')
+    lines.append(f".size {name}, . - {name}")
+    path.write_text("\n".join(lines) + "\n")
+
+
+def generate(
+    out_dir: Path,
+    functions: int = 20,
+    c_functions: int = 5,
+    rodata_files: int = 5,
+    instructions: int = 40,
+    rodata_per_function: int = 1,
+    rodata_size: int = 64,
+    call_interval: int = 11,
+    seed: int = 0,
+) -> Path:
+    """
+    Write the translation unit to `out_dir`, returns the path of its C file
+    """
+    rng = random.Random(seed)
+    asm_dir = out_dir / "asm" / "nonmatchings"
+    asm_dir.mkdir(parents=True, exist_ok=True)
+    (out_dir / "include").mkdir(exist_ok=True)
+    (out_dir / "include" / "macro.inc").write_text(MACRO_INC)
+    (out_dir / "include" / "common.h").write_text(
+        "#define INCLUDE_ASM(FOLDER, NAME)\n#define INCLUDE_RODATA(FOLDER, NAME)\n"
+    )
+
+    asm_names = [f"func_{i:08X}" for i in range(functions)]
+    c_names = [f"c_func_{i}" for i in range(c_functions)]
+
+    c_lines = ['#include "common.h"', ""]
+    for i in range(rodata_files):
+        name = f"D_rodata_{i:08X}"
+        write_rodata(rng, asm_dir / f"{name}.s", name, rodata_size)
+        c_lines.append(f'INCLUDE_RODATA("asm/nonmatchings", {name});')
+        c_lines.append("")
+
+    for i, name in enumerate(asm_names):
+        write_function(
+            rng,
+            asm_dir / f"{name}.s",
+            name,
+            instructions,
+            rodata_per_function if i % 2 == 0 else 0,
+            asm_names + c_names,
+            call_interval,
+        )
+        c_lines.append(f'INCLUDE_ASM("asm/nonmatchings", {name});')
+        c_lines.append("")
+        if i < c_functions:
+            callee = rng.choice(asm_names)
+            c_lines += [f"void {c_names[i]}(void) {{", f"    {callee}();", "}", ""]
+
+    c_file = out_dir / "tu.c"
+    c_file.write_text("\n".join(c_lines))
+    return c_file
+
+
+def add_arguments(parser: argparse.ArgumentParser) -> None:
+    group = parser.add_argument_group("translation unit")
+    group.add_argument("--functions", type=int, default=20, help="INCLUDE_ASM count")
+    group.add_argument("--c-functions", type=int, default=5)
+    group.add_argument(
+        "--rodata-files", type=int, default=5, help="INCLUDE_RODATA count"
+    )
+    group.add_argument(
+        "--instructions", type=int, default=40, help="instructions per function"
+    )
+    group.add_argument(
+        "--rodata-per-function",
+        type=int,
+        default=1,
+        help="jump tables per function with .rodata",
+    )
+    group.add_argument(
+        "--rodata-size", type=int, default=64, help="bytes per INCLUDE_RODATA"
+    )
+    group.add_argument(
+        "--call-interval",
+        type=int,
+        default=11,
+        help="instructions per call (0 for none)",
+    )
+    group.add_argument("--seed", type=int, default=0)
+
+
+def generate_from_args(out_dir: Path, args: argparse.Namespace) -> Path:
+    return generate(
+        out_dir,
+        functions=args.functions,
+        c_functions=args.c_functions,
+        rodata_files=args.rodata_files,
+        instructions=args.instructions,
+        rodata_per_function=args.rodata_per_function,
+        rodata_size=args.rodata_size,
+        call_interval=args.call_interval,
+        seed=args.seed,
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("out_dir", type=Path)
+    add_arguments(parser)
+    args = parser.parse_args()
+    print(generate_from_args(args.out_dir, args))
+
+
+if __name__ == "__main__":
+    main()
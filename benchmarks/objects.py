@@ -0,0 +1,205 @@
+"""
+Minimal ELF32 (little-endian, MIPS, relocatable) object writer for benchmarks.
+"""
+
+import struct
+
+from dataclasses import dataclass, field
+from typing import Optional, Union
+
+SHT_PROGBITS = 1
+SHT_SYMTAB = 2
+SHT_STRTAB = 3
+SHT_REL = 9
+
+SHF_ALLOC = 0x2
+SHF_EXECINSTR = 0x4
+
+STB_LOCAL = 0
+STB_GLOBAL = 1
+
+STT_NOTYPE = 0
+STT_OBJECT = 1
+STT_FUNC = 2
+STT_SECTION = 3
+STT_FILE = 4
+
+SHN_ABS = 0xFFF1
+
+R_MIPS_32 = 2
+R_MIPS_26 = 4
+R_MIPS_HI16 = 5
+R_MIPS_LO16 = 6
+
+
+@dataclass
+class ObjRelocation:
+    offset: int
+    reloc_type: int
+    # symbol name, or the index of a section (relocation against its section symbol)
+    target: Union[str, int]
+
+
+@dataclass
+class ObjSection:
+    name: str
+    flags: int = SHF_ALLOC
+    align: int = 4
+    data: bytearray = field(default_factory=bytearray)
+    relocations: list[ObjRelocation] = field(default_factory=list)
+
+
+@dataclass
+class ObjSymbol:
+    name: str
+    section: Optional[int] = None  # index into the section list, None if undefined
+    value: int = 0
+    size: int = 0
+    bind: int = STB_GLOBAL
+    type: int = STT_NOTYPE
+
+
+class StrtabBuilder:
+    def __init__(self) -> None:
+        self.data = bytearray(b"\x00")
+        self.offsets = {"": 0}
+
+    def add(self, name: str) -> int:
+        if name not in self.offsets:
+            self.offsets[name] = len(self.data)
+            self.data += name.encode("utf-8") + b"\x00"
+        return self.offsets[name]
+
+
+def write_object(
+    sections: list[ObjSection],
+    symbols: list[ObjSymbol],
+    section_symbols: bool = True,
+) -> bytes:
+    """
+    Lay out `sections` (in order) followed by their .rel sections, .symtab, .strtab
+    and .shstrtab. Local symbols are emitted before globals as the ELF spec requires.
+    """
+    strtab = StrtabBuilder()
+
+    symtab = [struct.pack("<IIIBBH", 0, 0, 0, 0, 0, 0)]
+    section_symbol_index: dict[int, int] = {}
+    if section_symbols:
+        for i in range(len(sections)):
+            section_symbol_index[i] = len(symtab)
+            symtab.append(
+                struct.pack(
+                    "<IIIBBH", 0, 0, 0, (STB_LOCAL << 4) | STT_SECTION, 0, i + 1
+                )
+            )
+
+    symbol_index: dict[str, int] = {}
+    ordered = [s for s in symbols if s.bind == STB_LOCAL]
+    first_global = len(symtab) + len(ordered)
+    ordered += [s for s in symbols if s.bind != STB_LOCAL]
+    for sym in ordered:
+        if sym.type == STT_FILE:
+            shndx = SHN_ABS
+        else:
+            shndx = 0 if sym.section is None else sym.section + 1
+        symbol_index[sym.name] = len(symtab)
+        symtab.append(
+            struct.pack(
+                "<IIIBBH",
+                strtab.add(sym.name),
+                sym.value,
+                sym.size,
+                (sym.bind << 4) | sym.type,
+                0,
+                shndx,
+            )
+        )
+
+    # (name, type, flags, data, link, info, align, entsize)
+    headers: list[tuple[str, int, int, bytes, int, int, int, int]] = [
+        (s.name, SHT_PROGBITS, s.flags, bytes(s.data), 0, 0, s.align, 0)
+        for s in sections
+    ]
+
+    symtab_index = (
+        len(sections) + 1 + sum(1 for s in sections if len(s.relocations) > 0)
+    )
+    for i, s in enumerate(sections):
+        if not s.relocations:
+            continue
+        rel_data = bytearray()
+        for r in s.relocations:
+            if isinstance(r.target, int):
+                index = section_symbol_index[r.target]
+            else:
+                index = symbol_index[r.target]
+            rel_data += struct.pack("<II", r.offset, (index << 8) | r.reloc_type)
+        headers.append(
+            (".rel" + s.name, SHT_REL, 0, bytes(rel_data), symtab_index, i + 1, 4, 8)
+        )
+
+    headers.append(
+        (
+            ".symtab",
+            SHT_SYMTAB,
+            0,
+            b"".join(symtab),
+            symtab_index + 1,
+            first_global,
+            4,
+            16,
+        )
+    )
+    headers.append((".strtab", SHT_STRTAB, 0, bytes(strtab.data), 0, 0, 1, 0))
+
+    shstrtab = StrtabBuilder()
+    for h in headers:
+        shstrtab.add(h[0])
+    shstrtab.add(".shstrtab")
+    headers.append((".shstrtab", SHT_STRTAB, 0, bytes(shstrtab.data), 0, 0, 1, 0))
+
+    body = bytearray()
+    offsets = []
+    for h in headers:
+        body += bytes(-(0x34 + len(body)) % 4)
+        offsets.append(0x34 + len(body))
+        body += h[3]
+    body += bytes(-(0x34 + len(body)) % 4)
+    e_shoff = 0x34 + len(body)
+
+    section_headers = bytearray(0x28)
+    for offset, (name, sh_type, flags, data, link, info, align, entsize) in zip(
+        offsets, headers
+    ):
+        section_headers += struct.pack(
+            "<IIIIIIIIII",
+            shstrtab.offsets[name],
+            sh_type,
+            flags,
+            0,
+            offset,
+            len(data),
+            link,
+            info,
+            align,
+            entsize,
+        )
+
+    header = struct.pack(
+        "<16sHHIIIIIHHHHHH",
+        b"\x7fELF\x01\x01\x01" + bytes(9),
+        1,  # ET_REL
+        8,  # EM_MIPS
+        1,  # EV_CURRENT
+        0,
+        0,
+        e_shoff,
+        0x10A23001,
+        0x34,
+        0,
+        0,
+        0x28,
+        len(headers) + 1,
+        len(headers),  # .shstrtab is last
+    )
+    return header + bytes(body) + bytes(section_headers)
@@ -0,0 +1,227 @@
+"""
+Measure mwccgap end to end on a generated translation unit, run as
+`python3 -m benchmarks.pipeline [options] [-- mwccgap options]`.
+
+The translation unit is compiled and assembled by the stand-ins for MWCC and GNU as
+in this directory, so no real toolchain (or wibo) is needed. `--mwcc-ms` and
+`--as-ms` calibrate the stand-ins so that every invocation takes (at least) that
+long, startup included, to model the real tools. mwccgap runs in this process and
+the time spent in each phase is reported separately.
+
+The SHA-256 of the object (with the temporary C file name normalized) is printed
+too, to check that an optimization leaves the output unchanged.
+"""
+
+import argparse
+import contextlib
+import functools
+import hashlib
+import io
+import os
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from collections import defaultdict
+from pathlib import Path
+from typing import Callable, Iterator, Optional
+
+from mwccgap import mwccgap
+from mwccgap.assembler import Assembler
+from mwccgap.cli import main as mwccgap_main
+from mwccgap.compiler import Compiler
+from mwccgap.elf import Elf
+from mwccgap.preprocessor import Preprocessor
+
+from .generate import add_arguments, generate_from_args
+
+HERE = Path(__file__).resolve().parent
+STANDIN_MWCC = HERE / "standin_mwcc.py"
+STANDIN_AS = HERE / "standin_as.py"
+
+# in the order they run
+PHASES = ["preprocess", "discovery", "compile", "assemble", "transplant", "pack"]
+
+
+class PhaseTimer:
+    """
+    Wall time per phase. Phases nested in another phase on the same thread (e.g.
+    the compile of the discovery compile) are counted as part of it.
+    """
+
+    def __init__(self) -> None:
+        self.seconds: dict[str, float] = defaultdict(float)
+        self.active = threading.local()
+
+    def wrap(self, phase: str, function: Callable) -> Callable:
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if getattr(self.active, "phase", None) is not None:
+                return function(*args, **kwargs)
+
+            self.active.phase = phase
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.seconds[phase] += time.perf_counter() - start
+                self.active.phase = None
+
+        return wrapper
+
+    @contextlib.contextmanager
+    def patch(self) -> Iterator[None]:
+        targets = [
+            (Preprocessor, "preprocess_c_file", "preprocess"),
+            (mwccgap, "compile_c_file", "discovery"),
+            (Compiler, "compile_file", "compile"),
+            (Assembler, "assemble_files", "assemble"),
+            (mwccgap, "plan_transplant", "transplant"),
+            (mwccgap, "apply_transplant", "transplant"),
+            (Elf, "pack", "pack"),
+        ]
+        originals = [(owner, name, owner.__dict__[name]) for owner, name, _ in targets]
+        try:
+            for owner, name, phase in targets:
+                function = owner.__dict__[name]
+                if isinstance(function, staticmethod):
+                    function = staticmethod(self.wrap(phase, function.__func__))
+                else:
+                    function = self.wrap(phase, function)
+                setattr(owner, name, function)
+            yield
+        finally:
+            for owner, name, original in originals:
+                setattr(owner, name, original)
+
+
+def invocation_seconds(cmd: list[str], stdin: bytes, repeat: int = 5) -> float:
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run(
+            cmd,
+            input=stdin,
+            check=True,
+            stdout=subprocess.DEVNULL,
+            env={
+                **os.environ,
+                "STANDIN_MWCC_LATENCY_MS": "0",
+                "STANDIN_AS_LATENCY_MS": "0",
+            },
+        )
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+def calibrate(mwcc_ms: Optional[float], as_ms: Optional[float]) -> tuple[float, float]:
+    """
+    Latency to add to each stand-in for invocations to take `mwcc_ms` and `as_ms`
+    """
+    mwcc_latency = 0.0
+    as_latency = 0.0
+    with tempfile.TemporaryDirectory() as temp_dir:
+        o_file = str(Path(temp_dir) / "out.o")
+        if mwcc_ms is not None:
+            c_file = Path(temp_dir) / "empty.c"
+            c_file.write_text("void f(void) {\n}\n")
+            seconds = invocation_seconds(
+                [str(STANDIN_MWCC), "-c", "-o", o_file, str(c_file)], b""
+            )
+            mwcc_latency = max(0.0, mwcc_ms - seconds * 1000)
+
+        if as_ms is not None:
+            seconds = invocation_seconds([str(STANDIN_AS), "-o", o_file], b"nop\n")
+            as_latency = max(0.0, as_ms - seconds * 1000)
+
+    return mwcc_latency, as_latency
+
+
+def object_digest(o_file: Path) -> str:
+    # the temporary C file's name ends up in the object (e.g. __sinit_)
+    data = re.sub(rb"tmp\w{8}\.c", b"tmpXXXXXXXX.c", o_file.read_bytes())
+    return hashlib.sha256(data).hexdigest()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    add_arguments(parser)
+    parser.add_argument(
+        "--mwcc-ms", type=float, help="duration of each MWCC invocation"
+    )
+    parser.add_argument("--as-ms", type=float, help="duration of each as invocation")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument(
+        "--keep", type=Path, help="generate the translation unit here and keep it"
+    )
+    parser.add_argument("mwccgap_args", nargs="*", help="extra mwccgap options")
+    args = parser.parse_args()
+
+    mwcc_latency, as_latency = calibrate(args.mwcc_ms, args.as_ms)
+    os.environ["STANDIN_MWCC_LATENCY_MS"] = str(mwcc_latency)
+    os.environ["STANDIN_AS_LATENCY_MS"] = str(as_latency)
+
+    with contextlib.ExitStack() as stack:
+        if args.keep is not None:
+            tu_dir = args.keep
+        else:
+            tu_dir = Path(stack.enter_context(tempfile.TemporaryDirectory()))
+        c_file = generate_from_args(tu_dir, args)
+        o_file = tu_dir / "tu.o"
+
+        argv = [
+            str(c_file),
+            str(o_file),
+            "--mwcc-path",
+            str(STANDIN_MWCC),
+            "--as-path",
+            str(STANDIN_AS),
+            "--asm-dir-prefix",
+            str(tu_dir),
+            "--macro-inc-path",
+            str(tu_dir / "include" / "macro.inc"),
+            *args.mwccgap_args,
+            "-O4,p",
+            f"-I{tu_dir / 'include'}",
+        ]
+
+        runs = []
+        for _ in range(args.repeat):
+            timer = PhaseTimer()
+            start = time.perf_counter()
+            with timer.patch():
+                # an empty stdin: the C file is read from `c_file`
+                exit_code = mwccgap_main(argv, io.StringIO(), prog="mwccgap.py")
+            total = time.perf_counter() - start
+            if exit_code != 0:
+                sys.exit(exit_code)
+            runs.append((total, timer.seconds))
+
+        digest = object_digest(o_file)
+
+    print(
+        f"{args.functions} INCLUDE_ASM, {args.rodata_files} INCLUDE_RODATA, "
+        f"{args.c_functions} C functions; "
+        f"stand-in latency: mwcc +{mwcc_latency:.1f} ms, as +{as_latency:.1f} ms"
+    )
+    print(f"{'phase':<12} {'min (ms)':>10} {'median (ms)':>12}")
+    for phase in PHASES + ["total"]:
+        times = [
+            total if phase == "total" else seconds.get(phase, 0.0)
+            for total, seconds in runs
+        ]
+        print(
+            f"{phase:<12} {min(times) * 1000:>10.1f} "
+            f"{statistics.median(times) * 1000:>12.1f}"
+        )
+    print(f"object sha256: {digest}")
+
+
+if __name__ == "__main__":
+    main()
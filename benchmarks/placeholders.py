@@ -0,0 +1,111 @@
+"""
+Measure the size of the placeholder C that the preprocessor emits for INCLUDE_ASM and
+INCLUDE_RODATA files, and the time it takes to compile, run as
+`python3 -m benchmarks.placeholders [--cc gcc]`.
+
+The .rodata placeholders are compared with the explicit initializers (one `0, ` per
+byte) that were emitted before, for translation units with increasingly large jump
+tables and string pools. The stand-in for MWCC only matches the C, so its time is
+mostly that of building the object; with `--cc`, the .rodata placeholders (which are
+plain C, unlike the asm functions) are also checked by that compiler with
+`-fsyntax-only`, as a model of MWCC lexing and parsing them.
+"""
+
+import argparse
+import re
+import subprocess
+import tempfile
+import time
+
+from pathlib import Path
+from typing import Callable
+
+from mwccgap.constants import FUNCTION_PREFIX
+from mwccgap.preprocessor import Preprocessor, Symbol
+
+from .standin_mwcc import compile_source
+
+PLACEHOLDER_REGEX = re.compile(r"\[(\d+)\] = \{0\};")
+
+
+def emit_translation_unit(
+    function_count: int,
+    instructions: int,
+    rodata_size: int,
+) -> list[str]:
+    c_lines = []
+    for i in range(function_count):
+        rodata_entries = {
+            f"jtbl_{i}": Symbol(f"jtbl_{i}", rodata_size),
+            f"str_{i}": Symbol(f"str_{i}", rodata_size, local=True),
+        }
+        c_lines += Preprocessor.emit_s_file(
+            f"{FUNCTION_PREFIX}func_{i}", instructions, rodata_entries
+        )
+    return c_lines
+
+
+def explicit_initializers(c_lines: list[str]) -> list[str]:
+    def explicit(match: re.Match) -> str:
+        size = int(match.group(1))
+        return f"[{size}] = {{" + size * "0, " + "};"
+
+    return [PLACEHOLDER_REGEX.sub(explicit, line) for line in c_lines]
+
+
+def measure(run: Callable[[], object], repeat: int) -> float:
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def check_syntax(cc: str, c_file: Path) -> None:
+    subprocess.run([cc, "-fsyntax-only", "-x", "c", str(c_file)], check=True)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--functions", type=int, default=500)
+    parser.add_argument("--instructions", type=int, default=64)
+    parser.add_argument("--rodata-size", type=int, nargs="+", default=[64, 1024, 16384])
+    parser.add_argument("--cc", help="C compiler to check the .rodata with")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    columns = ["stand-in (ms)"] + (["cc (ms)"] if args.cc else [])
+    print(
+        f"{'rodata size':>12} {'form':>9} {'C (KiB)':>9} "
+        + " ".join(f"{x:>14}" for x in columns)
+    )
+    for rodata_size in args.rodata_size:
+        c_lines = emit_translation_unit(args.functions, args.instructions, rodata_size)
+        forms = {"explicit": explicit_initializers(c_lines), "compact": c_lines}
+        # the objects are the same, only the C differs
+        objects = set(compile_source("\n".join(x), "tu.c") for x in forms.values())
+        assert len(objects) == 1
+
+        for form, lines in forms.items():
+            text = "\n".join(lines)
+            times = [measure(lambda: compile_source(text, "tu.c"), args.repeat)]
+            if args.cc:
+                with tempfile.TemporaryDirectory() as temp_dir:
+                    c_file = Path(temp_dir) / "rodata.c"
+                    c_file.write_text(
+                        "\n".join(x for x in lines if x.endswith(";")),
+                        encoding="utf-8",
+                    )
+                    times.append(
+                        measure(lambda: check_syntax(args.cc, c_file), args.repeat)
+                    )
+
+            print(
+                f"{rodata_size:>12} {form:>9} {len(text) / 1024:>9.0f} "
+                + " ".join(f"{x * 1000:>14.1f}" for x in times)
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""
+Measure renumbering and repacking the relocations of a compiled object when a local
+symbol is inserted, run as `python3 -m benchmarks.relocations`.
+
+Relocations that were never decoded are rewritten in bulk (with NumPy if it is
+installed); `decoded` decodes them to Relocation objects first, which is what the
+bulk path avoids.
+"""
+
+import argparse
+import time
+
+from mwccgap import tables
+from mwccgap.elf import Elf, Symbol
+
+from .objects import (
+    R_MIPS_26,
+    SHF_ALLOC,
+    SHF_EXECINSTR,
+    STT_FUNC,
+    ObjRelocation,
+    ObjSection,
+    ObjSymbol,
+    write_object,
+)
+
+RELOCATIONS_PER_FUNCTION = 16
+
+
+def make_object(relocation_count: int) -> bytes:
+    function_count = relocation_count // RELOCATIONS_PER_FUNCTION
+    sections: list[ObjSection] = []
+    symbols: list[ObjSymbol] = []
+    for i in range(function_count):
+        text = ObjSection(
+            ".text",
+            SHF_ALLOC | SHF_EXECINSTR,
+            data=bytearray(4 * RELOCATIONS_PER_FUNCTION),
+        )
+        for j in range(RELOCATIONS_PER_FUNCTION):
+            text.relocations.append(
+                ObjRelocation(j * 4, R_MIPS_26, f"func_{(i + j) % function_count}")
+            )
+        sections.append(text)
+        symbols.append(
+            ObjSymbol(f"func_{i}", i, 0, 4 * RELOCATIONS_PER_FUNCTION, type=STT_FUNC)
+        )
+    return write_object(sections, symbols)
+
+
+def insert_local(data: bytes, decode: bool) -> float:
+    elf = Elf(data)
+    symbol = Symbol(0, 0, 0, 0, 0, 1)
+    symbol.name = "local"
+
+    start = time.perf_counter()
+    if decode:
+        for record in elf.get_relocations():
+            record.relocations
+    elf.stage_symbol(symbol)
+    elf.commit_symbols()
+    elf.pack()
+    return time.perf_counter() - start
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--relocations", type=int, nargs="+", default=[10000, 50000, 100000]
+    )
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"NumPy: {'yes' if tables.numpy is not None else 'no'}")
+    print(f"{'relocations':>12} {'bulk (ms)':>10} {'decoded (ms)':>13}")
+    for relocation_count in args.relocations:
+        data = make_object(relocation_count)
+        bulk, decoded = (
+            min(insert_local(data, decode) for _ in range(args.repeat))
+            for decode in (False, True)
+        )
+        print(f"{relocation_count:>12} {bulk * 1000:>10.2f} {decoded * 1000:>13.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,261 @@
+#!/usr/bin/env python3
+"""
+Stand-in for GNU as (mipsel). Assembles the spimdisasm-style assembly that mwccgap feeds
+it: instruction words are taken from the `/* offset vram bytes */` comments, data
+directives are encoded, and %hi/%lo/%gp_rel, jal/j and .word references produce
+relocations the same way GNU as does (references to local labels are rewritten against
+the section symbol).
+
+Environment:
+    STANDIN_AS_LATENCY_MS  fixed per-invocation latency to simulate (default 0)
+"""
+
+import ast
+import os
+import re
+import struct
+import sys
+import time
+
+from pathlib import Path
+from typing import Optional
+
+# run as an executable, so make the benchmarks package importable
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from benchmarks.objects import (  # noqa: E402
+    ObjRelocation,
+    ObjSection,
+    ObjSymbol,
+    R_MIPS_26,
+    R_MIPS_32,
+    R_MIPS_HI16,
+    R_MIPS_LO16,
+    SHF_ALLOC,
+    SHF_EXECINSTR,
+    STB_GLOBAL,
+    STB_LOCAL,
+    STT_FUNC,
+    STT_NOTYPE,
+    STT_OBJECT,
+    write_object,
+)
+
+R_MIPS_GPREL16 = 7
+
+COMMENT_REGEX = re.compile(r"/\*.*?\*/")
+INSTRUCTION_BYTES_REGEX = re.compile(r"^/\*\s*\S+\s+\S+\s+([0-9A-Fa-f]{8})\s*\*/")
+OPERATOR_RELOC_REGEX = re.compile(r"%(hi|lo|gp_rel)\(([^)]+)\)")
+JUMP_REGEX = re.compile(r"^(jal|j)\s+([A-Za-z_.$][\w.$]*)$")
+
+OPERATOR_RELOC_TYPES = {"hi": R_MIPS_HI16, "lo": R_MIPS_LO16, "gp_rel": R_MIPS_GPREL16}
+
+
+class AssemblyError(Exception):
+    pass
+
+
+class Assembler:
+    def __init__(self) -> None:
+        self.sections: list[ObjSection] = []
+        self.section_index: dict[str, int] = {}
+        self.section_align: list[int] = []
+        # name -> (section index, offset, bind, type)
+        self.labels: dict[str, tuple[int, int, int, int]] = {}
+        # (section index, offset, reloc type, target name)
+        self.pending: list[tuple[int, int, int, str]] = []
+        self.current = self.switch_section(".text", SHF_ALLOC | SHF_EXECINSTR, 16)
+        self.switch_section(".data", SHF_ALLOC | 0x1, 16)
+        self.switch_section(".bss", SHF_ALLOC | 0x1, 16)
+        self.current = 0
+
+    def switch_section(self, name: str, flags: int = SHF_ALLOC, align: int = 1) -> int:
+        if name not in self.section_index:
+            self.section_index[name] = len(self.sections)
+            self.sections.append(ObjSection(name, flags, align=1))
+            self.section_align.append(align)
+        self.current = self.section_index[name]
+        return self.current
+
+    @property
+    def data(self) -> bytearray:
+        return self.sections[self.current].data
+
+    def align(self, alignment: int) -> None:
+        self.data.extend(bytes(-len(self.data) % alignment))
+        self.section_align[self.current] = max(
+            self.section_align[self.current], alignment
+        )
+
+    def define(self, name: str, bind: int, sym_type: int = STT_NOTYPE) -> None:
+        if name in self.labels:
+            raise AssemblyError(f"symbol `{name}' is already defined")
+        if sym_type == STT_NOTYPE and bind == STB_GLOBAL:
+            is_text = self.sections[self.current].flags & SHF_EXECINSTR
+            sym_type = STT_FUNC if is_text else STT_OBJECT
+        self.labels[name] = (self.current, len(self.data), bind, sym_type)
+
+    def reloc(self, reloc_type: int, target: str) -> None:
+        self.pending.append((self.current, len(self.data), reloc_type, target))
+
+    def emit_word(self, value: int) -> None:
+        self.data.extend(struct.pack("<I", value & 0xFFFFFFFF))
+
+    def assemble_line(self, line: str) -> None:
+        raw = line.strip()
+        m = INSTRUCTION_BYTES_REGEX.match(raw)
+        instruction_bytes = bytes.fromhex(m.group(1)) if m else None
+        line = COMMENT_REGEX.sub("", raw).split("#", 1)[0].strip()
+        if not line:
+            return
+
+        directive, _, args = line.partition(" ")
+        args = args.strip()
+
+        if directive in (".include", ".set", ".size", ".type", "nonmatching"):
+            return
+        if directive in ("endlabel", "enddlabel", ".globl", ".global", ".ent", ".end"):
+            return
+        if directive == ".section":
+            name = args.split(",")[0].strip()
+            if name.startswith(".text"):
+                self.switch_section(name, SHF_ALLOC | SHF_EXECINSTR, 4)
+            else:
+                self.switch_section(name)
+            return
+        if directive in (".text", ".data", ".bss"):
+            self.switch_section(directive)
+            return
+        if directive == ".align":
+            self.align(1 << int(args, 0))
+            return
+        if directive == ".balign":
+            self.align(int(args, 0))
+            return
+        if directive in ("glabel", "dlabel", "alabel", "jlabel", "nmlabel"):
+            local = args.endswith(", local")
+            name = args.removesuffix(", local").strip()
+            if not name:
+                raise AssemblyError(f"{directive} requires a symbol name")
+            bind = STB_LOCAL if local or directive == "jlabel" else STB_GLOBAL
+            self.define(name, bind)
+            return
+        if line.endswith(":"):
+            name = line[:-1]
+            self.define(name, STB_LOCAL)
+            return
+
+        if directive == ".byte":
+            for value in args.split(","):
+                self.data.extend(struct.pack("<B", int(value, 0) & 0xFF))
+            return
+        if directive == ".short":
+            for value in args.split(","):
+                self.data.extend(struct.pack("<H", int(value, 0) & 0xFFFF))
+            return
+        if directive in (".word", ".long"):
+            for value in args.split(","):
+                value = value.strip()
+                try:
+                    self.emit_word(int(value, 0))
+                except ValueError:
+                    self.reloc(R_MIPS_32, value)
+                    self.emit_word(0)
+            return
+        if directive == ".float":
+            self.data.extend(struct.pack("<f", float(args)))
+            return
+        if directive == ".double":
+            self.data.extend(struct.pack("<d", float(args)))
+            return
+        if directive in (".ascii", ".asciz"):
+            text = ast.literal_eval(args)
+            self.data.extend(text.encode("latin-1"))
+            if directive == ".asciz":
+                self.data.append(0)
+            return
+        if directive == ".space":
+            self.data.extend(bytes(int(args, 0)))
+            return
+        if directive.startswith("."):
+            raise AssemblyError(f"unknown pseudo-op: `{directive}'")
+
+        # instruction
+        for op, target in OPERATOR_RELOC_REGEX.findall(line):
+            self.reloc(OPERATOR_RELOC_TYPES[op], target)
+        if m := JUMP_REGEX.match(line):
+            self.reloc(R_MIPS_26, m.group(2))
+        self.section_align[self.current] = max(self.section_align[self.current], 4)
+        self.data.extend(instruction_bytes or bytes(4))
+
+    def finish(self) -> bytes:
+        for i, section in enumerate(self.sections):
+            section.align = self.section_align[i]
+            if section.flags & SHF_EXECINSTR or i < 3:
+                section.data.extend(bytes(-len(section.data) % min(section.align, 16)))
+
+        symbols: list[ObjSymbol] = []
+        for name, (section_index, offset, bind, sym_type) in self.labels.items():
+            if name.startswith(".L"):
+                continue
+            symbols.append(ObjSymbol(name, section_index, offset, 0, bind, sym_type))
+
+        undefined: dict[str, None] = {}
+        for section_index, offset, reloc_type, target in self.pending:
+            label = self.labels.get(target)
+            resolved: Optional[int] = None
+            if label is not None and label[2] == STB_LOCAL:
+                # local references are made against the section symbol
+                resolved = label[0]
+                addend = label[1]
+                data = self.sections[section_index].data
+                if reloc_type == R_MIPS_32:
+                    data[offset : offset + 4] = struct.pack("<I", addend)
+                elif reloc_type == R_MIPS_26:
+                    (word,) = struct.unpack("<I", data[offset : offset + 4])
+                    word = (word & 0xFC000000) | ((addend >> 2) & 0x03FFFFFF)
+                    data[offset : offset + 4] = struct.pack("<I", word)
+            elif label is None:
+                undefined[target] = None
+            self.sections[section_index].relocations.append(
+                ObjRelocation(
+                    offset, reloc_type, target if resolved is None else resolved
+                )
+            )
+
+        symbols += [ObjSymbol(name) for name in undefined]
+
+        return write_object(self.sections, symbols)
+
+
+def main() -> int:
+    latency = float(os.environ.get("STANDIN_AS_LATENCY_MS", "0"))
+    if latency:
+        time.sleep(latency / 1000)
+
+    argv = sys.argv[1:]
+    o_file = Path(argv[argv.index("-o") + 1])
+
+    source = sys.stdin.buffer.read().decode("utf-8")
+    assembler = Assembler()
+    in_macro = False
+    for n, line in enumerate(source.splitlines()):
+        stripped = line.strip()
+        if stripped.startswith(".macro"):
+            in_macro = True
+            continue
+        if in_macro:
+            in_macro = not stripped.startswith(".endm")
+            continue
+        try:
+            assembler.assemble_line(line)
+        except (AssemblyError, ValueError, SyntaxError) as e:
+            sys.stderr.write(f"{{standard input}}:{n + 1}: Error: {e}\n")
+            return 1
+
+    o_file.write_bytes(assembler.finish())
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+"""
+Stand-in for MWCC. Understands just enough C to turn the sources mwccgap produces into
+a realistic relocatable object: one .text section per function and one .rodata section
+per const array, in source order, with R_MIPS_26 relocations for calls.
+
+Environment:
+    STANDIN_MWCC_LATENCY_MS  fixed per-invocation latency to simulate (default 0)
+"""
+
+import os
+import re
+import sys
+import time
+
+from pathlib import Path
+
+# run as an executable, so make the benchmarks package importable
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from benchmarks.objects import (  # noqa: E402
+    ObjRelocation,
+    ObjSection,
+    ObjSymbol,
+    R_MIPS_26,
+    SHF_ALLOC,
+    SHF_EXECINSTR,
+    STB_GLOBAL,
+    STB_LOCAL,
+    STT_FILE,
+    STT_FUNC,
+    STT_OBJECT,
+    write_object,
+)
+
+ASM_FUNCTION_REGEX = re.compile(r"asm\s+void\s+(\w+)\s*\(\s*\)\s*\{")
+C_FUNCTION_REGEX = re.compile(r"(static\s+)?[\w\s\*]*?\b(\w+)\s*\([^;{]*\)\s*\{")
+RODATA_REGEX = re.compile(
+    r"(static\s+)?const\s+unsigned\s+char\s+(\w+)\s*\[(\d+)\]\s*=\s*\{[^}]*\};"
+)
+CALL_REGEX = re.compile(r"\b(\w+)\s*\(")
+C_KEYWORDS = {"if", "while", "for", "switch", "return", "sizeof"}
+
+
+def compile_source(text: str, file_name: str) -> bytes:
+    sections: list[ObjSection] = []
+    symbols = [ObjSymbol(file_name, bind=STB_LOCAL, type=STT_FILE)]
+    referenced: dict[str, None] = {}
+
+    lines = text.splitlines()
+    i = 0
+    while i < len(lines):
+        line = lines[i].strip()
+        i += 1
+        if not line or line.startswith("#"):
+            continue
+
+        if m := ASM_FUNCTION_REGEX.match(line):
+            nops = 0
+            while lines[i].strip() != "}":
+                nops += len(re.findall(r"\bnop\b", lines[i]))
+                i += 1
+            i += 1
+            sections.append(
+                ObjSection(".text", SHF_ALLOC | SHF_EXECINSTR, data=bytearray(4 * nops))
+            )
+            symbols.append(
+                ObjSymbol(m.group(1), len(sections) - 1, size=4 * nops, type=STT_FUNC)
+            )
+            continue
+
+        if m := RODATA_REGEX.match(line):
+            size = int(m.group(3))
+            sections.append(ObjSection(".rodata", data=bytearray(size)))
+            symbols.append(
+                ObjSymbol(
+                    m.group(2),
+                    len(sections) - 1,
+                    size=size,
+                    bind=STB_LOCAL if m.group(1) else STB_GLOBAL,
+                    type=STT_OBJECT,
+                )
+            )
+            continue
+
+        if m := C_FUNCTION_REGEX.match(line):
+            depth = line.count("{") - line.count("}")
+            body = [line[m.end() :]]
+            while depth > 0:
+                body.append(lines[i])
+                depth += lines[i].count("{") - lines[i].count("}")
+                i += 1
+            calls = [
+                c for c in CALL_REGEX.findall("\n".join(body)) if c not in C_KEYWORDS
+            ]
+            # prologue, (jal, nop) per call, jr ra, epilogue
+            section = ObjSection(
+                ".text",
+                SHF_ALLOC | SHF_EXECINSTR,
+                data=bytearray(4 * (3 + 2 * len(calls))),
+            )
+            for n, call in enumerate(calls):
+                section.relocations.append(ObjRelocation(4 + 8 * n, R_MIPS_26, call))
+                referenced[call] = None
+            sections.append(section)
+            symbols.append(
+                ObjSymbol(
+                    m.group(2),
+                    len(sections) - 1,
+                    size=len(section.data),
+                    bind=STB_LOCAL if m.group(1) else STB_GLOBAL,
+                    type=STT_FUNC,
+                )
+            )
+            continue
+
+    defined = {s.name for s in symbols}
+    symbols += [ObjSymbol(name) for name in referenced if name not in defined]
+
+    return write_object(sections, symbols, section_symbols=False)
+
+
+def main() -> int:
+    latency = float(os.environ.get("STANDIN_MWCC_LATENCY_MS", "0"))
+    if latency:
+        time.sleep(latency / 1000)
+
+    argv = sys.argv[1:]
+    o_file = Path(argv[argv.index("-o") + 1])
+    c_file = Path(argv[-1])
+
+    try:
+        obj = compile_source(
+            c_file.read_text(encoding="utf-8", errors="replace"), c_file.name
+        )
+    except Exception as e:
+        sys.stderr.write(f"{c_file}: error: {e}\n")
+        return 1
+
+    o_file.write_bytes(obj)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
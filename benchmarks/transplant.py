@@ -0,0 +1,144 @@
+"""
+Measure transplanting assembled functions into a compiled object against the number
+of INCLUDE_ASM functions, run as `python3 -m benchmarks.transplant`.
+
+Every function has two .rodata jump tables relocated against its .text, so each one
+inserts local symbols and has its .rodata relocations split. The time per function
+should stay flat as the translation unit grows.
+"""
+
+import argparse
+import time
+
+from pathlib import Path
+
+from mwccgap.constants import FUNCTION_PREFIX
+from mwccgap.elf import Elf
+from mwccgap.transplant import apply_transplant, plan_transplant
+
+from .objects import (
+    R_MIPS_26,
+    R_MIPS_32,
+    SHF_ALLOC,
+    SHF_EXECINSTR,
+    STB_LOCAL,
+    STT_FUNC,
+    STT_OBJECT,
+    ObjRelocation,
+    ObjSection,
+    ObjSymbol,
+    write_object,
+)
+
+TEXT_SIZE = 64
+JUMP_TABLE_SIZE = 20
+JUMP_TABLES = 2
+
+
+def make_compiled_object(function_count: int) -> bytes:
+    """
+    The nop-filled functions as MWCC compiles them, each followed by its .rodata
+    """
+    sections: list[ObjSection] = []
+    symbols: list[ObjSymbol] = []
+    for i in range(function_count):
+        sections.append(
+            ObjSection(".text", SHF_ALLOC | SHF_EXECINSTR, data=bytearray(TEXT_SIZE))
+        )
+        symbols.append(
+            ObjSymbol(
+                f"{FUNCTION_PREFIX}func_{i}",
+                len(sections) - 1,
+                0,
+                TEXT_SIZE,
+                type=STT_FUNC,
+            )
+        )
+        for j in range(JUMP_TABLES):
+            sections.append(ObjSection(".rodata", data=bytearray(JUMP_TABLE_SIZE)))
+            symbols.append(
+                ObjSymbol(
+                    f"@{i}_{j}",
+                    len(sections) - 1,
+                    0,
+                    JUMP_TABLE_SIZE,
+                    bind=STB_LOCAL,
+                    type=STT_OBJECT,
+                )
+            )
+    return write_object(sections, symbols)
+
+
+def make_assembled_object(i: int, function_count: int) -> bytes:
+    text = ObjSection(
+        ".text", SHF_ALLOC | SHF_EXECINSTR, data=bytearray(b"\x01" * TEXT_SIZE)
+    )
+    text.relocations.append(
+        ObjRelocation(0, R_MIPS_26, f"func_{(i + 1) % function_count}")
+    )
+
+    rodata = ObjSection(".rodata", data=bytearray(b"\x02" * JUMP_TABLE_SIZE * 2))
+    symbols = [ObjSymbol(f"func_{i}", 0, 0, TEXT_SIZE, type=STT_FUNC)]
+    for j in range(JUMP_TABLES):
+        symbols.append(
+            ObjSymbol(
+                f"jtbl_{i}_{j}",
+                1,
+                j * JUMP_TABLE_SIZE,
+                JUMP_TABLE_SIZE,
+                type=STT_OBJECT,
+            )
+        )
+        for k in range(4):
+            # against the .text section symbol, like local labels
+            rodata.relocations.append(
+                ObjRelocation(j * JUMP_TABLE_SIZE + k * 4, R_MIPS_32, 0)
+            )
+
+    symbols.append(ObjSymbol(f"func_{(i + 1) % function_count}"))
+    return write_object([text, rodata], symbols)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--functions", type=int, nargs="+", default=[250, 500, 1000, 2000]
+    )
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"{'functions':>10} {'transplant (ms)':>16} {'us/function':>12}")
+    per_function = []
+    for function_count in args.functions:
+        compiled_bytes = make_compiled_object(function_count)
+        asm_files = [(Path(f"func_{i}.s"), JUMP_TABLES) for i in range(function_count)]
+        asm_objects = [
+            make_assembled_object(i, function_count) for i in range(function_count)
+        ]
+
+        times = []
+        for _ in range(args.repeat):
+            compiled_elf = Elf(compiled_bytes)
+            start = time.perf_counter()
+            transplants = plan_transplant(
+                compiled_elf, Path("tu.c"), asm_files, asm_objects, {}
+            )
+            apply_transplant(compiled_elf, transplants)
+            compiled_elf.pack()
+            times.append(time.perf_counter() - start)
+
+        seconds = min(times)
+        per_function.append(seconds / function_count)
+        print(
+            f"{function_count:>10} {seconds * 1000:>16.2f} "
+            f"{per_function[-1] * 1e6:>12.2f}"
+        )
+
+    print(
+        "cost per function, largest vs smallest: "
+        f"{per_function[-1] / per_function[0]:.2f}x"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,51 @@
-import subprocess
+import contextlib
+import re
+import struct
 import sys
-import tempfile
 
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Optional
+from typing import Optional, Union
 
+from .cache import Cache, make_key, package_digest, tool_digest
+from .constants import IGNORED_RELOCATIONS
+from .elf import (
+    Elf,
+    Relocation,
+    RelocationRecord,
+    Section,
+    Symbol,
+    SECTION_HEADER_SIZE,
+    SHT_NOBITS,
+    SHT_REL,
+    SHT_STRTAB,
+    SHT_SYMTAB,
+)
 from .exceptions import AssemblerException
+from .memo import Memo, file_key
+from .timings import Timings, run_process
+from .workspace import ToolOutput, Workspace, get_workspace
+
+# section switches that can be renamed so that each file of a batch gets its own
+BATCH_SECTION_REGEX = re.compile(r"^\s*\.section\s+\.(text|rodata)\s*$")
+# directives whose effect could leak into, or clash with, other files of a batch
+UNBATCHABLE_REGEX = re.compile(
+    r"^\s*(\.(section|pushsection|popsection|previous|text|data|bss|rdata|rodata"
+    r"|sdata|sbss|macro|equ|eqv|equiv)\b|\.set\s+[\w.$]+\s*,|[\w.$]+\s*=)"
+)
+
+# files read by GNU as, i.e. `.include "file"` and `.incbin "file"[, skip[, count]]`
+ASM_INCLUDE_REGEX = re.compile(
+    rb'^[ \t]*\.(include|incbin)\b[ \t]*(?:"([^"\n]*)")?', re.MULTILINE
+)
+
+# the contents of each macro.inc, keyed by file_key()
+_macro_inc_files = Memo("macro-inc-files")
+
+STB_LOCAL = 0
+STT_NOTYPE = 0
+STT_SECTION = 3
+SHN_LORESERVE = 0xFF00
 
 
 class Assembler:
@@ -16,57 +56,253 @@ class Assembler:
         as_mabi="32",
         as_flags: Optional[list[str]] = None,
         macro_inc_path: Optional[Path] = None,
+        cache: Optional[Cache] = None,
+        timings: Optional[Timings] = None,
+        workspace: Optional[Workspace] = None,
+        in_memory_output: bool = True,
     ):
         if as_flags is None:
             as_flags = []
+        if workspace is None:
+            workspace = get_workspace()
 
         self.as_path = as_path
         self.as_march = as_march
         self.as_mabi = as_mabi
         self.as_flags = as_flags
         self.macro_inc_path = macro_inc_path
+        self.cache = cache
+        self.timings = timings
+        self.workspace = workspace
+        self.in_memory_output = in_memory_output
+
+        self.macro_inc_bytes = b""
+        if self.macro_inc_path and self.macro_inc_path.is_file():
+            memo_key = file_key(self.macro_inc_path)
+            if (macro_inc_bytes := _macro_inc_files.get(memo_key)) is None:
+                macro_inc_bytes = self.macro_inc_path.read_bytes()
+                _macro_inc_files[memo_key] = macro_inc_bytes
+            self.macro_inc_bytes = macro_inc_bytes
+
+        self._cache_key_prefix: Optional[str] = None
+        # the contents of the files read by .include/.incbin
+        self._included_files: dict[Path, bytes] = {}
+        self._tool_key: Optional[tuple[str, ...]] = None
+
+    def get_tool_key(self) -> tuple[str, ...]:
+        """
+        Identifies GNU as by its contents when there is a cache, and its flags
+        """
+        if self._tool_key is None:
+            as_path = self.as_path
+            self._tool_key = (
+                tool_digest(self.cache, as_path) if self.cache else str(as_path),
+                *self.as_flags,
+            )
+        return self._tool_key
+
+    def get_include_dirs(self) -> list[Path]:
+        """
+        Where GNU as looks for .include/.incbin files after the working directory
+        """
+        include_dirs = []
+        if self.macro_inc_path:
+            include_dirs.append(self.macro_inc_path.resolve().parent)
+        flags = iter(self.as_flags)
+        for flag in flags:
+            if flag == "-I":
+                include_dir = next(flags, None)
+            elif flag.startswith("-I"):
+                include_dir = flag[2:]
+            else:
+                continue
+            if include_dir:
+                include_dirs.append(Path(include_dir))
+        return include_dirs
+
+    def find_included_files(self, asm_bytes: bytes) -> Optional[list[Path]]:
+        """
+        The files read by .include/.incbin in `asm_bytes` or macro.inc, and in the
+        files they include, or None if one of them cannot be found (e.g. a path
+        given by a macro argument)
+        """
+        included: dict[Path, None] = {}
+
+        def scan(data: bytes) -> bool:
+            if b".inc" not in data:
+                return True
+            for match in ASM_INCLUDE_REGEX.finditer(data):
+                if match.group(2) is None:
+                    return False
+                name = match.group(2).decode("utf-8", errors="replace")
+                for include_dir in [Path("."), *self.get_include_dirs()]:
+                    path = include_dir / name
+                    if path.is_file():
+                        break
+                else:
+                    return False
+
+                if path in included:
+                    continue
+                included[path] = None
+                if match.group(1) == b"include" and not scan(
+                    self.read_included_file(path)
+                ):
+                    return False
+            return True
+
+        if not scan(self.macro_inc_bytes) or not scan(asm_bytes):
+            return None
+        return list(included)
+
+    def read_included_file(self, path: Path) -> bytes:
+        if (data := self._included_files.get(path)) is None:
+            data = self._included_files[path] = path.read_bytes()
+        return data
+
+    def get_cache_key(self, asm_bytes: bytes) -> Optional[str]:
+        """
+        The key of the object assembled from `asm_bytes`, or None if it depends on
+        files that cannot be found, and so cannot be cached
+        """
+        if (included_files := self.find_included_files(asm_bytes)) is None:
+            return None
+
+        if self._cache_key_prefix is None:
+            assert self.cache is not None
+            self._cache_key_prefix = make_key(
+                "asm",
+                package_digest(),
+                self.macro_inc_bytes,
+                tool_digest(self.cache, self.as_path),
+                self.as_march,
+                self.as_mabi,
+                repr(self.as_flags),
+            )
+        key_parts: list[Union[bytes, str]] = [self._cache_key_prefix, asm_bytes]
+        for path in included_files:
+            key_parts += [str(path), self.read_included_file(path)]
+        return make_key(*key_parts)
 
     def assemble_file(
         self,
         asm_filepath: Path,
     ) -> bytes:
-        with tempfile.NamedTemporaryFile(suffix=".o") as temp_file:
+        return self.assemble_files([asm_filepath], batch=False)[0]
+
+    def assemble_files(
+        self,
+        asm_filepaths: list[Path],
+        batch: bool = True,
+        jobs: int = 1,
+    ) -> list[bytes]:
+        """
+        Assemble each file into its own object. With `batch`, files that are not
+        cached are assembled by a single assembler invocation and the result is split
+        into per-file objects; files that cannot be batched safely (or a batch that
+        fails to assemble) fall back to one invocation per file. With `jobs` > 1, up
+        to `jobs` assembler invocations run concurrently, batches being split into
+        `jobs` chunks.
+        """
+        asm_bytes = [asm_filepath.read_bytes() for asm_filepath in asm_filepaths]
+        objects: list[Optional[bytes]] = [None] * len(asm_filepaths)
+
+        cache_keys: list[Optional[str]] = [None] * len(asm_filepaths)
+        if self.cache is not None:
+            for i, data in enumerate(asm_bytes):
+                if (cache_key := self.get_cache_key(data)) is not None:
+                    cache_keys[i] = cache_key
+                    objects[i] = self.cache.get(cache_key)
+
+        pending = [i for i, obj in enumerate(objects) if obj is None]
+
+        def store(i: int, obj_bytes: bytes) -> None:
+            objects[i] = obj_bytes
+            if self.cache is not None and (cache_key := cache_keys[i]) is not None:
+                self.cache.put(cache_key, obj_bytes)
+
+        def timed_assembly(indices: list[int]):
+            if self.timings is None:
+                return contextlib.nullcontext()
+            return self.timings.assembly([asm_filepaths[i].stem for i in indices])
+
+        def assemble_batch(chunk: list[int]) -> list[int]:
+            if len(chunk) < 2:
+                return chunk
+            with timed_assembly(chunk):
+                batched = self._assemble_batch([asm_bytes[i] for i in chunk])
+            if batched is None:
+                return chunk
+            for i, obj_bytes in zip(chunk, batched):
+                store(i, obj_bytes)
+            return []
+
+        def assemble(i: int) -> None:
+            with timed_assembly([i]):
+                obj_bytes = self._assemble(
+                    asm_filepaths[i], self.macro_inc_bytes + asm_bytes[i]
+                )
+            store(i, obj_bytes)
+
+        with ThreadPoolExecutor(max_workers=max(jobs, 1)) as executor:
+            if batch and len(pending) > 1:
+                chunk_count = min(max(jobs, 1), len(pending))
+                chunks = [pending[i::chunk_count] for i in range(chunk_count)]
+                pending = sorted(
+                    i for chunk in executor.map(assemble_batch, chunks) for i in chunk
+                )
+
+            # list() to propagate the first exception
+            list(executor.map(assemble, pending))
+
+        return [obj for obj in objects if obj is not None]
+
+    def _run(
+        self,
+        in_bytes: bytes,
+    ) -> tuple[int, bytes, bytes, bytes]:
+
+        def run(output: ToolOutput) -> tuple[int, bytes, bytes]:
             cmd = [
                 self.as_path,
                 "-EL",
                 f"-march={self.as_march}",
                 f"-mabi={self.as_mabi}",
                 "-o",
-                temp_file.name,
+                output.path,
                 *self.as_flags,
             ]
 
             if self.macro_inc_path:
                 cmd.insert(4, f"-I{str(self.macro_inc_path.resolve().parent)}")
 
-            with subprocess.Popen(
-                cmd,
-                stdout=subprocess.PIPE,
-                stdin=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-            ) as process:
-                in_bytes = asm_filepath.read_bytes()
-                if self.macro_inc_path and self.macro_inc_path.is_file():
-                    in_bytes = self.macro_inc_path.read_bytes() + in_bytes
-
-                stdout, stderr = process.communicate(input=in_bytes)
-
-            if stdout:
-                sys.stderr.write(stdout.decode("utf-8"))
-            if stderr:
-                sys.stderr.write(stderr.decode("utf-8"))
-
-            if process.returncode != 0:
-                raise AssemblerException(
-                    f"Failed to assemble {asm_filepath} (assembler returned {process.returncode})"
-                )
+            return run_process(cmd, in_bytes, self.timings, output.pass_fds)
+
+        returncode, stdout, stderr, obj_bytes = self.workspace.run_tool(
+            self.get_tool_key(),
+            run,
+            ".o",
+            cache=self.cache,
+            in_memory=self.in_memory_output,
+        )
+        return (returncode, stdout, stderr, obj_bytes or b"")
+
+    def _assemble(
+        self,
+        asm_filepath: Path,
+        in_bytes: bytes,
+    ) -> bytes:
+        returncode, stdout, stderr, obj_bytes = self._run(in_bytes)
+
+        if stdout:
+            sys.stderr.write(stdout.decode("utf-8"))
+        if stderr:
+            sys.stderr.write(stderr.decode("utf-8"))
 
-            obj_bytes = temp_file.read()
+        if returncode != 0:
+            raise AssemblerException(
+                f"Failed to assemble {asm_filepath} (assembler returned {returncode})"
+            )
 
         if len(obj_bytes) == 0:
             raise AssemblerException(
@@ -74,3 +310,283 @@ class Assembler:
             )
 
         return obj_bytes
+
+    def _assemble_batch(
+        self,
+        asm_bytes: list[bytes],
+    ) -> Optional[list[bytes]]:
+        lines = []
+        for i, data in enumerate(asm_bytes):
+            try:
+                asm_lines = data.decode("utf-8").splitlines()
+            except UnicodeDecodeError:
+                return None
+
+            # start every file in its own .text section with as's default .text
+            # alignment, and isolate any .set options it changes
+            lines += [f'.section .text.{i}, "ax", @progbits', ".align 4", ".set push"]
+            for line in asm_lines:
+                if match := BATCH_SECTION_REGEX.match(line):
+                    if match.group(1) == "text":
+                        line = f'.section .text.{i}, "ax", @progbits'
+                    else:
+                        line = f'.section .rodata.{i}, "a", @progbits'
+                elif UNBATCHABLE_REGEX.match(line):
+                    return None
+                lines.append(line)
+            lines += [".set pop", ""]
+
+        in_bytes = self.macro_inc_bytes + "\n".join(lines).encode("utf-8")
+        returncode, stdout, stderr, obj_bytes = self._run(in_bytes)
+        if returncode != 0 or len(obj_bytes) == 0:
+            # let the individual assembly report the error
+            return None
+
+        try:
+            objects = split_object(Elf(obj_bytes), len(asm_bytes))
+        except Exception:
+            # anything unexpected in the batched object, assemble individually instead
+            return None
+
+        if stdout:
+            sys.stderr.write(stdout.decode("utf-8"))
+        if stderr:
+            sys.stderr.write(stderr.decode("utf-8"))
+
+        return objects
+
+
+def split_object(elf: Elf, count: int) -> list[bytes]:
+    """
+    Split an object assembled from a batch of `count` files into the objects that
+    assembling each file on its own would have produced (as far as the transplant is
+    concerned): a .text and optional .rodata section, their relocations and the
+    symbols that are defined in, or referenced by, those sections.
+    """
+    section_indices = {section.name: i for i, section in enumerate(elf.sections)}
+
+    for name in (".text", ".data", ".bss"):
+        if (index := section_indices.get(name)) is not None:
+            section = elf.sections[index]
+            size = (
+                section.sh_size if section.sh_type == SHT_NOBITS else len(section.data)
+            )
+            if size > 0:
+                raise ValueError(f"Unexpected data in {name} section")
+
+    relocation_records: dict[int, RelocationRecord] = {}
+    for record in elf.get_relocations():
+        if record.name in IGNORED_RELOCATIONS:
+            continue
+        relocation_records[record.sh_info] = record
+
+    objects = []
+    claimed = set()
+    for i in range(count):
+        text_index = section_indices.get(f".text.{i}")
+        rodata_index = section_indices.get(f".rodata.{i}")
+        own_sections = [x for x in (text_index, rodata_index) if x is not None]
+        claimed.update(own_sections)
+        objects.append(
+            extract_object(elf, text_index, rodata_index, relocation_records)
+        )
+
+    if not claimed.issuperset(relocation_records):
+        raise ValueError("Relocations against sections outside of the batch")
+
+    return objects
+
+
+def extract_object(
+    elf: Elf,
+    text_index: Optional[int],
+    rodata_index: Optional[int],
+    relocation_records: dict[int, RelocationRecord],
+) -> bytes:
+    # new section layout: null, .text, [.rodata], [.rel.text], [.rel.rodata], .symtab,
+    # .strtab, .shstrtab
+    sections: list[tuple[str, Section, bytes]] = []
+
+    if text_index is not None:
+        text_section = elf.sections[text_index]
+        text_data = text_section.data
+    else:
+        text_section = Section(0, 1, 0x6, 0, 0, 0, 0, 0, 0x10, 0, b"")
+        text_data = b""
+    sections.append((".text", text_section, text_data))
+
+    new_section_index = {}
+    if text_index is not None:
+        new_section_index[text_index] = 1
+    if rodata_index is not None:
+        new_section_index[rodata_index] = 2
+        rodata_section = elf.sections[rodata_index]
+        sections.append((".rodata", rodata_section, rodata_section.data))
+
+    records = [
+        (name, relocation_records[index])
+        for name, index in ((".rel.text", text_index), (".rel.rodata", rodata_index))
+        if index is not None and index in relocation_records
+    ]
+
+    referenced = set()
+    for _, record in records:
+        for relocation in record.relocations:
+            referenced.add(relocation.symbol_index)
+
+    symbols = elf.symtab.symbols
+
+    # locals (null, section symbols, then other locals) precede globals
+    local_indices = []
+    global_indices = []
+    for index, symbol in enumerate(symbols):
+        if index == 0:
+            continue
+
+        defined_here = symbol.st_shndx in new_section_index
+        if symbol.bind == STB_LOCAL:
+            if defined_here:
+                local_indices.append(index)
+            elif index in referenced:
+                if symbol.st_shndx < SHN_LORESERVE:
+                    # e.g. a local label in another file of the batch
+                    raise ValueError(f"Cannot split reference to local symbol {index}")
+                local_indices.append(index)
+        elif defined_here or index in referenced:
+            global_indices.append(index)
+
+    local_indices.sort(key=lambda x: symbols[x].type != STT_SECTION)
+
+    strtab = bytearray(b"\x00")
+    symtab = bytearray(Symbol(0, 0, 0, 0, 0, 0).pack())
+    symbol_index_map = {}
+    for index in local_indices + global_indices:
+        symbol = symbols[index]
+
+        if symbol.st_shndx in new_section_index:
+            shndx = new_section_index[symbol.st_shndx]
+            new_symbol = Symbol(
+                0,
+                symbol.st_value,
+                symbol.st_size,
+                symbol.st_info,
+                symbol.st_other,
+                shndx,
+            )
+        elif 0 < symbol.st_shndx < SHN_LORESERVE:
+            # defined by another file of the batch, undefined when assembled alone
+            new_symbol = Symbol(0, 0, 0, (symbol.bind << 4) | STT_NOTYPE, 0, 0)
+        else:
+            new_symbol = Symbol(
+                0,
+                symbol.st_value,
+                symbol.st_size,
+                symbol.st_info,
+                symbol.st_other,
+                symbol.st_shndx,
+            )
+
+        if symbol.name:
+            new_symbol.st_name = len(strtab)
+            strtab += symbol.name.encode("utf-8") + b"\x00"
+
+        symbol_index_map[index] = len(symtab) // 0x10
+        symtab += new_symbol.pack()
+
+    rel_sections = []
+    for name, record in records:
+        rel_data = b"".join(
+            Relocation(
+                relocation.r_offset,
+                (symbol_index_map[relocation.symbol_index] << 8)
+                | relocation.reloc_type,
+            ).pack()
+            for relocation in record.relocations
+        )
+        rel_sections.append((name, record, rel_data))
+
+    symtab_index = 1 + len(sections) + len(rel_sections)
+
+    # (name, sh_type, sh_flags, sh_link, sh_info, sh_addralign, sh_entsize, data)
+    headers = [
+        (name, s.sh_type, s.sh_flags, 0, 0, s.sh_addralign, s.sh_entsize, data)
+        for name, s, data in sections
+    ]
+    for name, record, data in rel_sections:
+        target_index = 1 if name == ".rel.text" else len(sections)
+        headers.append(
+            (
+                name,
+                SHT_REL,
+                record.sh_flags,
+                symtab_index,
+                target_index,
+                record.sh_addralign,
+                record.sh_entsize,
+                data,
+            )
+        )
+    headers.append(
+        (
+            ".symtab",
+            SHT_SYMTAB,
+            0,
+            symtab_index + 1,
+            1 + len(local_indices),
+            elf.symtab.sh_addralign,
+            elf.symtab.sh_entsize,
+            bytes(symtab),
+        )
+    )
+    headers.append((".strtab", SHT_STRTAB, 0, 0, 0, 1, 0, bytes(strtab)))
+
+    shstrtab = bytearray(b"\x00")
+    sh_names = []
+    for header in headers + [(".shstrtab",)]:
+        sh_names.append(len(shstrtab))
+        shstrtab += header[0].encode("utf-8") + b"\x00"
+    headers.append((".shstrtab", SHT_STRTAB, 0, 0, 0, 1, 0, bytes(shstrtab)))
+
+    elf_header_size = 0x34
+    body = bytearray()
+    section_headers = bytearray(SECTION_HEADER_SIZE)
+    for sh_name, header in zip(sh_names, headers):
+        name, sh_type, sh_flags, sh_link, sh_info, sh_addralign, sh_entsize, data = (
+            header
+        )
+        body += bytes(-(elf_header_size + len(body)) % 4)
+        section_headers += struct.pack(
+            Section.fmt,
+            sh_name,
+            sh_type,
+            sh_flags,
+            0,
+            elf_header_size + len(body),
+            len(data),
+            sh_link,
+            sh_info,
+            sh_addralign,
+            sh_entsize,
+        )
+        body += data
+    body += bytes(-(elf_header_size + len(body)) % 4)
+
+    elf_header = struct.pack(
+        Elf.fmt,
+        elf.e_ident,
+        elf.e_type,
+        elf.e_machine,
+        elf.e_version,
+        0,  # e_entry
+        0,  # e_phoff
+        elf_header_size + len(body),  # e_shoff
+        elf.e_flags,
+        elf_header_size,
+        elf.e_phentsize,
+        0,  # e_phnum
+        SECTION_HEADER_SIZE,
+        1 + len(headers),
+        len(headers),  # .shstrtab is the last section
+    )
+
+    return elf_header + bytes(body) + bytes(section_headers)
@@ -0,0 +1,186 @@
+import contextlib
+import io
+import json
+import os
+import shlex
+import sys
+import tempfile
+import time
+
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Optional
+
+from .workspace import remove_workspaces
+
+
+@dataclass
+class Job:
+    # mwccgap arguments, relative paths are relative to `directory`
+    argv: list[str]
+    directory: Path
+    # identifies the job across runs for duration bookkeeping
+    name: str
+
+
+@dataclass
+class JobResult:
+    exit_code: int
+    output: str
+    duration: float = 0.0
+
+
+def load_manifest(
+    manifest_path: Path,
+    common_argv: Optional[list[str]] = None,
+) -> list[Job]:
+    """
+    Read the jobs of a batch manifest, a JSON list in one of two formats:
+
+    - mwccgap jobs: {"c_file": ..., "o_file": ..., "flags": [...], "directory": ...}
+      where `flags` are passed as if given on the command line, and `flags` and
+      `directory` (relative to the manifest's directory) are optional.
+    - compile_commands.json entries whose command invokes mwccgap, i.e. whose
+      "arguments" (or "command") contain an argument named mwccgap*; the arguments
+      that follow it are used.
+
+    `common_argv` is appended to the arguments of every job.
+    """
+    if common_argv is None:
+        common_argv = []
+
+    entries = json.loads(manifest_path.read_text(encoding="utf-8"))
+    if not isinstance(entries, list):
+        raise ValueError(f"{manifest_path} does not contain a list of jobs")
+
+    jobs = []
+    for i, entry in enumerate(entries):
+        directory = (manifest_path.parent / entry.get("directory", ".")).absolute()
+
+        if "c_file" in entry:
+            argv = [entry["c_file"], entry["o_file"], *entry.get("flags", [])]
+            name = entry["o_file"]
+        else:
+            if "arguments" in entry:
+                arguments = entry["arguments"]
+            elif "command" in entry:
+                arguments = shlex.split(entry["command"])
+            else:
+                raise ValueError(f"Job {i} in {manifest_path} has no command")
+
+            for j, argument in enumerate(arguments):
+                if Path(argument).name.startswith("mwccgap"):
+                    break
+            else:
+                raise ValueError(f"Job {i} in {manifest_path} does not run mwccgap")
+
+            argv = arguments[j + 1 :]
+            name = entry.get("output", entry.get("file", str(i)))
+
+        jobs.append(
+            Job(
+                argv=[*argv, *common_argv],
+                directory=directory,
+                name=os.path.normpath(directory / name),
+            )
+        )
+
+    return jobs
+
+
+def run_job(job: Job) -> JobResult:
+    # the CLI imports this module
+    from .cli import main
+
+    output = io.StringIO()
+    cwd = os.getcwd()
+    start = time.perf_counter()
+    try:
+        os.chdir(job.directory)
+        with contextlib.redirect_stderr(output), contextlib.redirect_stdout(output):
+            exit_code = main(job.argv, io.StringIO(), prog="mwccgap.py")
+    except SystemExit as e:
+        # e.g. argparse errors
+        exit_code = e.code if isinstance(e.code, int) else int(e.code is not None)
+    except Exception as e:
+        output.write(f"{e}\n")
+        exit_code = 1
+    finally:
+        os.chdir(cwd)
+        # pool processes exit without running atexit handlers
+        remove_workspaces()
+
+    return JobResult(exit_code, output.getvalue(), time.perf_counter() - start)
+
+
+def load_durations(durations_path: Optional[Path]) -> dict[str, float]:
+    if durations_path is None:
+        return {}
+    try:
+        durations = json.loads(durations_path.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return {}
+    return durations if isinstance(durations, dict) else {}
+
+
+def save_durations(durations_path: Path, durations: dict[str, float]) -> None:
+    durations_path.parent.mkdir(exist_ok=True, parents=True)
+    fd, temp_name = tempfile.mkstemp(dir=durations_path.parent, prefix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(durations, f, indent=2, sort_keys=True)
+        os.replace(temp_name, durations_path)
+    except BaseException:
+        Path(temp_name).unlink(missing_ok=True)
+        raise
+
+
+def run_batch(
+    jobs: list[Job],
+    max_workers: Optional[int] = None,
+    durations_path: Optional[Path] = None,
+) -> int:
+    """
+    Run `jobs` on a pool of at most `max_workers` processes (defaults to the number
+    of CPUs). Jobs are started longest first according to the durations recorded by
+    previous runs in `durations_path`, jobs without a recorded duration going first.
+    A failing job does not stop the others; its output is reported once it finishes.
+
+    Returns 0 if all jobs succeeded, 1 otherwise.
+    """
+    durations = load_durations(durations_path)
+
+    order = sorted(
+        range(len(jobs)),
+        key=lambda i: -durations.get(jobs[i].name, float("inf")),
+    )
+
+    failed = []
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(run_job, jobs[i]): i for i in order}
+        for future in as_completed(futures):
+            job = jobs[futures[future]]
+            try:
+                result = future.result()
+            except Exception as e:
+                # e.g. the worker process died
+                result = JobResult(1, f"{e}\n")
+
+            if result.output:
+                sys.stderr.write(result.output)
+            if result.exit_code != 0:
+                failed.append(job)
+            else:
+                durations[job.name] = result.duration
+
+    if durations_path is not None:
+        save_durations(durations_path, durations)
+
+    if failed:
+        sys.stderr.write(f"{len(failed)} of {len(jobs)} jobs failed:\n")
+        for job in failed:
+            sys.stderr.write(f"  {job.name}\n")
+        return 1
+
+    return 0
@@ -0,0 +1,213 @@
+import hashlib
+import os
+import shutil
+import tempfile
+
+from pathlib import Path
+from typing import Optional, Union
+
+from .memo import Memo, file_key
+
+# bump whenever the contents of cache entries change meaning
+CACHE_VERSION = 1
+
+DEFAULT_CACHE_MAX_SIZE = 1024 * 1024 * 1024  # 1 GiB
+
+# entries are spread across 256 shard directories named after the first 2 key chars
+SHARD_COUNT = 256
+
+# fraction of the maximum size that eviction brings the cache back down to
+EVICT_TO = 0.9
+
+# the digest of each tool (see tool_digest), keyed by file_key()
+_tool_digests = Memo("tool-digests")
+
+
+class Cache:
+    """
+    Content-addressed on-disk store, keyed by hex digests (see `make_key`).
+
+    Entries are written to a temporary file and renamed into place, so concurrent
+    writers never expose partial entries. Hits refresh the entry's mtime, which is
+    used to evict the least recently used entries once the cache grows beyond
+    `max_size`. The size of the cache is estimated from the shard an entry is put in,
+    and only when that estimate exceeds `max_size` is the whole cache scanned.
+    """
+
+    def __init__(
+        self,
+        cache_dir: Path,
+        max_size: int = DEFAULT_CACHE_MAX_SIZE,
+    ):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+
+    def _entry_path(self, key: str) -> Path:
+        return self.cache_dir / key[:2] / key[2:]
+
+    def get(self, key: str) -> Optional[bytes]:
+        path = self._entry_path(key)
+        try:
+            data = path.read_bytes()
+        except OSError:
+            return None
+
+        try:
+            os.utime(path)
+        except OSError:
+            # evicted by someone else in the meantime, data is still valid
+            pass
+        return data
+
+    def put(self, key: str, data: bytes) -> None:
+        path = self._entry_path(key)
+        try:
+            path.parent.mkdir(exist_ok=True, parents=True)
+            fd, temp_name = tempfile.mkstemp(dir=path.parent, prefix=".tmp")
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    f.write(data)
+                os.replace(temp_name, path)
+            except BaseException:
+                Path(temp_name).unlink(missing_ok=True)
+                raise
+        except OSError:
+            # a cache that cannot be written to should never fail the build
+            return
+
+        # keys are uniformly distributed, so the shard gives an estimate of the
+        # size of the whole cache without scanning it
+        _, shard_size = scan_dir(path.parent)
+        if shard_size * SHARD_COUNT > self.max_size:
+            self.evict()
+
+    def evict(self) -> None:
+        """
+        Evict the least recently used entries of the whole cache until it is back
+        down to EVICT_TO of `max_size`, if it is larger than `max_size`
+        """
+        entries: list[tuple[int, int, str]] = []
+        total_size = 0
+        try:
+            with os.scandir(self.cache_dir) as it:
+                shard_dirs = [x.path for x in it if x.is_dir()]
+        except OSError:
+            return
+        for shard_dir in shard_dirs:
+            shard_entries, shard_size = scan_dir(Path(shard_dir))
+            entries += shard_entries
+            total_size += shard_size
+
+        if total_size <= self.max_size:
+            return
+
+        # evict least recently used first
+        target_size = int(self.max_size * EVICT_TO)
+        entries.sort()
+        for _, size, path in entries:
+            Path(path).unlink(missing_ok=True)
+            total_size -= size
+            if total_size <= target_size:
+                break
+
+
+def scan_dir(shard_dir: Path) -> tuple[list[tuple[int, int, str]], int]:
+    """
+    The (mtime, size, path) of every entry of a shard, and their total size
+    """
+    entries = []
+    total_size = 0
+    try:
+        with os.scandir(shard_dir) as it:
+            for entry in it:
+                if entry.name.startswith(".tmp"):
+                    continue
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime_ns, stat.st_size, entry.path))
+                total_size += stat.st_size
+    except OSError:
+        pass
+    return (entries, total_size)
+
+
+def make_key(*parts: Union[bytes, str, None]) -> str:
+    hasher = hashlib.sha256(f"mwccgap-cache-{CACHE_VERSION}".encode("utf-8"))
+    for part in parts:
+        if part is None:
+            hasher.update(b"n")
+            continue
+        if isinstance(part, str):
+            hasher.update(b"s")
+            part = part.encode("utf-8")
+        else:
+            hasher.update(b"b")
+        hasher.update(len(part).to_bytes(8, "little"))
+        hasher.update(part)
+    return hasher.hexdigest()
+
+
+def read_file(path: Optional[Path]) -> Optional[bytes]:
+    if path is None or not path.is_file():
+        return None
+    return path.read_bytes()
+
+
+def file_digest(path: Path) -> str:
+    hasher = hashlib.sha256()
+    with path.open("rb") as f:
+        while chunk := f.read(1024 * 1024):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def tool_digest(cache: Cache, path: Union[Path, str]) -> str:
+    """
+    Identify an executable by the digest of its contents, so that identical tools in
+    fresh checkouts share cache entries. The digest is itself cached against the
+    file's path, size and modification time to avoid rehashing on every invocation,
+    and kept in memory.
+    """
+    tool_path = Path(path)
+    if not tool_path.is_file():
+        # not a path to an existing file, look for it on PATH
+        resolved = shutil.which(str(path))
+        if resolved is None:
+            return str(path)
+        tool_path = Path(resolved)
+
+    memo_key = file_key(tool_path)
+    if (digest_str := _tool_digests.get(memo_key)) is not None:
+        return digest_str
+
+    resolved_path, size, mtime_ns = memo_key
+    key = make_key("tool", resolved_path, str(size), str(mtime_ns))
+    if (digest := cache.get(key)) is not None:
+        digest_str = digest.decode("ascii")
+    else:
+        digest_str = file_digest(tool_path)
+        cache.put(key, digest_str.encode("ascii"))
+
+    _tool_digests[memo_key] = digest_str
+    return digest_str
+
+
+_package_digest: Optional[str] = None
+
+
+def package_digest() -> str:
+    """
+    Identify the mwccgap sources so that upgrading mwccgap invalidates previously
+    cached output.
+    """
+    global _package_digest
+    if _package_digest is None:
+        _package_digest = make_key(
+            *(
+                path.read_bytes()
+                for path in sorted(Path(__file__).resolve().parent.glob("*.py"))
+            )
+        )
+    return _package_digest
@@ -0,0 +1,193 @@
+import argparse
+import contextlib
+import json
+import sys
+import traceback
+
+from pathlib import Path
+from typing import ContextManager, List, Optional, TextIO
+
+from .batch import load_manifest, run_batch
+from .cache import DEFAULT_CACHE_MAX_SIZE
+from .mwccgap import process_c_file
+from .timings import Timings
+from .workspace import get_workspace
+
+
+class CustomTildeFormatter(argparse.HelpFormatter):
+    def format_help(self):
+        text = super().format_help()
+        return text.replace("~~", "--")
+
+
+def main(
+    argv: Optional[List[str]] = None,
+    stdin: Optional[TextIO] = None,
+    prog: Optional[str] = None,
+) -> int:
+    """
+    Run mwccgap with command line arguments `argv` (defaults to `sys.argv[1:]`),
+    reading the C file from `stdin` when it is not a terminal. Returns the exit code.
+
+    Hack: We replace `--` with `~~` before parsing so argparse ignores user-supplied
+    flags meant for the assembler. The prefixes are restored afterward.
+    """
+    if argv is None:
+        argv = sys.argv[1:]
+    if stdin is None:
+        stdin = sys.stdin
+
+    argv = [arg.replace("--", "~~") for arg in argv]
+
+    # --batch runs the jobs of a manifest instead, with the remaining arguments
+    # applying to every job
+    batch_parser = argparse.ArgumentParser(
+        prefix_chars="~", add_help=False, allow_abbrev=False
+    )
+    batch_parser.add_argument("~~batch", type=Path)
+    batch_parser.add_argument("~~batch-jobs", type=int)
+    batch_parser.add_argument("~~batch-durations", type=Path)
+    batch_args, argv = batch_parser.parse_known_args(argv)
+
+    if batch_args.batch is not None:
+        jobs = load_manifest(
+            batch_args.batch, [arg.replace("~~", "--") for arg in argv]
+        )
+        return run_batch(jobs, batch_args.batch_jobs, batch_args.batch_durations)
+
+    parser = argparse.ArgumentParser(
+        prog=prog, prefix_chars="~", formatter_class=CustomTildeFormatter
+    )
+
+    read_from_file = stdin.isatty()
+    if not read_from_file:
+        in_lines = stdin.readlines()
+        if len(in_lines) == 0:
+            read_from_file = True
+
+    if read_from_file:
+        parser.add_argument("c_file", type=Path)
+
+    parser.add_argument("o_file", type=Path)
+
+    default_as_flags = ["-G0"]  # TODO: base this on -sdatathreshold value from c_flags
+
+    def add_argument(arg, **kwargs):
+        parser.add_argument(arg.replace("--", "~~"), **kwargs)
+
+    add_argument("--mwcc-path", type=Path, default=Path("mwccpsp.exe"))
+    add_argument("--as-path", type=Path, default=Path("mipsel-linux-gnu-as"))
+    add_argument("--as-march", type=str, default="allegrex")
+    add_argument("--as-mabi", type=str, default="32")
+    add_argument("--as-flags", nargs="*", default=default_as_flags)
+    add_argument("--use-wibo", action="store_true")
+    add_argument("--wibo-path", type=Path, default=Path("wibo"))
+    add_argument("--asm-dir-prefix", type=Path)
+    add_argument("--macro-inc-path", type=Path)
+    add_argument("--target-encoding", type=str)
+    add_argument("--src-dir", type=Path)
+    add_argument(
+        "--discovery", choices=["compile", "scan", "speculative"], default="compile"
+    )
+    add_argument("--batch-assembly", action="store_true")
+    add_argument("--jobs", type=int, default=1)
+    add_argument("--depfile", type=Path)
+    add_argument("--depfile-target", type=str)
+    add_argument("--cache-dir", type=Path)
+    add_argument(
+        "--cache-max-size", type=int, default=DEFAULT_CACHE_MAX_SIZE // (1024 * 1024)
+    )
+    add_argument("--timings", choices=["summary", "json"])
+    add_argument("--timings-file", type=Path)
+    add_argument("--trace-file", type=Path)
+    add_argument("--profile", type=Path)
+    add_argument("--workspace-dir", type=Path)
+    add_argument("--tool-output", choices=["memory", "file"], default="memory")
+    add_argument("--c-copies", choices=["source", "workspace"], default="source")
+
+    args, c_flags = parser.parse_known_args(argv)
+
+    timings: Optional[Timings] = None
+    if any(x is not None for x in (args.timings, args.timings_file, args.trace_file)):
+        # a C file read from stdin is known by its object instead
+        timings = Timings(str(args.c_file if read_from_file else args.o_file))
+
+    c_file = args.c_file if read_from_file else Path("<stdin>")
+    try:
+        if read_from_file:
+            c_file_context: ContextManager[Path] = contextlib.nullcontext(c_file)
+        else:
+            # relative #includes are found from --src-dir, if given
+            c_file_context = get_workspace(args.workspace_dir).temp_file(
+                ".c", "".join(in_lines).encode("utf"), args.src_dir
+            )
+
+        with c_file_context as c_file:
+            process_c_file(
+                c_file,
+                args.o_file,
+                c_flags,
+                mwcc_path=args.mwcc_path,
+                as_path=args.as_path,
+                as_march=args.as_march,
+                as_mabi=args.as_mabi,
+                as_flags=args.as_flags,
+                use_wibo=args.use_wibo,
+                wibo_path=args.wibo_path,
+                asm_dir_prefix=args.asm_dir_prefix,
+                macro_inc_path=args.macro_inc_path,
+                c_file_encoding=args.target_encoding,
+                discovery=args.discovery,
+                batch_assembly=args.batch_assembly,
+                jobs=args.jobs,
+                depfile=args.depfile,
+                depfile_target=args.depfile_target,
+                # a C file read from stdin only exists for the duration of the run
+                depfile_c_file=read_from_file,
+                cache_dir=args.cache_dir,
+                cache_max_size=args.cache_max_size * 1024 * 1024,
+                timings=timings,
+                profile=args.profile,
+                workspace_dir=args.workspace_dir,
+                tool_output=args.tool_output,
+                c_copies=args.c_copies,
+                c_file_from_stdin=not read_from_file,
+            )
+
+    except Exception as e:
+        sys.stderr.write(f"Exception processing {c_file.name}: {e}\n")
+        sys.stderr.write(traceback.format_exc())
+        sys.stderr.write("\n")
+        # cleanup
+        args.o_file.unlink(missing_ok=True)
+        return 1
+
+    if timings is not None:
+        timings.finish()
+        report_timings(timings, args.o_file, args.timings, args.timings_file)
+        if args.trace_file is not None:
+            timings.write_trace(args.trace_file)
+
+    return 0
+
+
+def report_timings(
+    timings: Timings,
+    o_file: Path,
+    timings_format: Optional[str],
+    timings_file: Optional[Path],
+) -> None:
+    """
+    Write `timings` to stderr as a one-line summary or as JSON, and/or append them
+    as a line of JSON to `timings_file`
+    """
+    report = {"o_file": str(o_file), **timings.to_dict()}
+    if timings_format == "summary":
+        sys.stderr.write(f"{o_file}: {timings.summary()}\n")
+    elif timings_format == "json":
+        sys.stderr.write(json.dumps(report) + "\n")
+
+    if timings_file is not None:
+        timings_file.parent.mkdir(exist_ok=True, parents=True)
+        with timings_file.open("a", encoding="utf-8") as f:
+            f.write(json.dumps(report) + "\n")
@@ -1,9 +1,12 @@
-import subprocess
+import os
 import sys
-import tempfile
 
 from pathlib import Path
-from typing import List, Optional
+from typing import Dict, List, Optional
+
+from .cache import Cache, tool_digest
+from .timings import Timings, run_process, traced
+from .workspace import ToolOutput, Workspace, get_workspace
 
 
 class Compiler:
@@ -14,63 +17,160 @@ class Compiler:
         mwcc_path: Path,
         use_wibo: bool,
         wibo_path: Path,
+        timings: Optional[Timings] = None,
+        workspace: Optional[Workspace] = None,
+        cache: Optional[Cache] = None,
+        in_memory_output: bool = True,
     ):
         if c_flags is None:
             c_flags = []
+        if workspace is None:
+            workspace = get_workspace()
 
         self.c_flags = c_flags
         self.mwcc_path = mwcc_path
         self.use_wibo = use_wibo
         self.wibo_path = wibo_path
+        self.timings = timings
+        self.workspace = workspace
+        self.cache = cache
+        self.in_memory_output = in_memory_output
+
+        self._tool_key: Optional[tuple[str, ...]] = None
+
+    def get_include_dirs(self) -> List[Path]:
+        include_dirs = []
+        flags = iter(self.c_flags)
+        for flag in flags:
+            if flag in ("-I", "-i", "-ir"):
+                include_dir = next(flags, None)
+            elif flag.startswith("-I") and flag != "-I-":
+                include_dir = flag[2:]
+            else:
+                continue
+
+            if not include_dir:
+                continue
+            include_dirs.append(Path(include_dir))
+            if flag == "-ir":
+                # recursive, every subdirectory is searched too
+                for root, dirs, _ in os.walk(include_dir):
+                    dirs.sort()
+                    include_dirs += [Path(root) / x for x in dirs]
+
+        return include_dirs
+
+    def get_defines(self) -> Dict[str, str]:
+        """
+        The macros defined by -D/-d/-define, by name
+        """
+        defines = {}
+        flags = iter(self.c_flags)
+        for flag in flags:
+            if flag in ("-D", "-d", "-define"):
+                define = next(flags, None)
+            elif flag.startswith("-D"):
+                define = flag[2:]
+            else:
+                continue
+
+            if define:
+                name, _, value = define.partition("=")
+                # e.g. -D'F(x)=x', whose parameters are part of its body as for
+                # Preprocessor.find_macros_in_lines()
+                name, paren, parameters = name.partition("(")
+                defines[name] = f"{paren}{parameters} {value or '1'}".strip()
+        return defines
+
+    def get_prefix_files(self) -> List[str]:
+        """
+        The files included before the C file by -prefix/-include
+        """
+        prefix_files = []
+        flags = iter(self.c_flags)
+        for flag in flags:
+            if flag in ("-prefix", "-include"):
+                if prefix_file := next(flags, None):
+                    prefix_files.append(prefix_file)
+        return prefix_files
+
+    def get_tool_key(self) -> tuple[str, ...]:
+        """
+        Identifies MWCC (and wibo) by their contents when there is a cache, and the
+        flags, on which whether it can write to memory depends
+        """
+        if self._tool_key is None:
+            tools = [self.mwcc_path, *([self.wibo_path] if self.use_wibo else [])]
+            self._tool_key = (
+                *(tool_digest(self.cache, x) if self.cache else str(x) for x in tools),
+                *self.c_flags,
+            )
+        return self._tool_key
+
+    def has_implicit_include_dir(self) -> bool:
+        """
+        Whether quoted #includes are searched for relative to the C file first (MWCC's
+        default `-cwd include`, or `-cwd source`), so that a copy of the C file can be
+        compiled from another directory by adding its directory to the include path
+        """
+        flags = iter(self.c_flags)
+        for flag in flags:
+            # -I- and -i- imply -cwd explicit
+            if flag in ("-I-", "-i-"):
+                return False
+            if flag == "-cwd" and next(flags, None) not in ("include", "source"):
+                return False
+        return True
 
     def _compile_file(
         self,
         c_file: Path,
-        o_file: Path,
-    ) -> tuple[bytes, bytes]:
-        o_file.parent.mkdir(exist_ok=True, parents=True)
-        o_file.unlink(missing_ok=True)
-
+        output: ToolOutput,
+        source_dir: Optional[Path] = None,
+    ) -> tuple[int, bytes, bytes]:
         cmd = [
             str(self.mwcc_path),
             "-c",
+            *([f"-I{source_dir}"] if source_dir is not None else []),
             *self.c_flags,
             "-o",
-            str(o_file),
+            output.path,
             str(c_file),
         ]
         if self.use_wibo:
             cmd.insert(0, str(self.wibo_path))
 
-        with subprocess.Popen(
-            cmd,
-            stdout=subprocess.PIPE,
-            stdin=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-        ) as proc:
-            return proc.communicate()
+        return run_process(cmd, timings=self.timings, pass_fds=output.pass_fds)
 
     def compile_file(
         self,
         c_file: Path,
+        source_dir: Optional[Path] = None,
     ) -> bytes:
-        with tempfile.TemporaryDirectory() as temp_dir:
-            o_file = Path(temp_dir) / "result.o"
-            stdout, stderr = self._compile_file(
-                c_file,
-                o_file,
+        """
+        Compile `c_file`, which is a copy of a C file in `source_dir` if given
+        """
+        if source_dir is not None and source_dir == c_file.parent:
+            source_dir = None
+
+        with traced(self.timings, "compile_file", c_file=c_file.name):
+            _, stdout, stderr, obj_bytes = self.workspace.run_tool(
+                self.get_tool_key(),
+                lambda output: self._compile_file(c_file, output, source_dir),
+                ".o",
+                cache=self.cache,
+                in_memory=self.in_memory_output,
             )
 
-            if stdout:
-                sys.stderr.write(stdout.decode("utf-8"))
-            if stderr:
-                sys.stderr.write(stderr.decode("utf-8"))
+        if stdout:
+            sys.stderr.write(stdout.decode("utf-8"))
+        if stderr:
+            sys.stderr.write(stderr.decode("utf-8"))
 
-            if not o_file.is_file():
-                raise Exception(f"Error compiling {c_file}")
+        if obj_bytes is None:
+            raise Exception(f"Error compiling {c_file}")
 
-            obj_bytes = o_file.read_bytes()
-            if len(obj_bytes) == 0:
-                raise Exception(f"Error compiling {c_file}, object is empty")
+        if len(obj_bytes) == 0:
+            raise Exception(f"Error compiling {c_file}, object is empty")
 
         return obj_bytes
@@ -0,0 +1,169 @@
+"""
+Long-running mwccgap server, run as `python3 -m mwccgap.daemon SOCKET`.
+
+Jobs are sent over a Unix socket by `mwccgap_client.py`. The server forks for every
+job, so jobs start with mwccgap already imported and with whatever the server has
+warmed up in memory, and can freely change their working directory and environment.
+
+Each job sends what it added to the in-memory memos (tool digests, .s file scans,
+etc., see `mwccgap.memo`) back to the server, which merges it before forking the
+next jobs.
+"""
+
+import argparse
+import io
+import json
+import os
+import pickle
+import socket
+import socketserver
+import struct
+import sys
+import traceback
+
+from pathlib import Path
+from typing import Optional, TextIO, cast
+
+from . import memo
+from .cache import package_digest
+from .cli import main
+from .protocol import (
+    FRAME_EXIT,
+    FRAME_REQUEST,
+    FRAME_STDERR,
+    FRAME_STDOUT,
+    recv_frame,
+    send_frame,
+)
+from .workspace import remove_workspaces
+
+# the largest message of memo entries sent by a job
+MAX_MEMOS_SIZE = 4 * 1024 * 1024
+
+
+class FrameWriter(io.TextIOBase):
+    def __init__(self, sock, kind: bytes):
+        self.sock = sock
+        self.kind = kind
+
+    def write(self, s: str) -> int:
+        if s:
+            send_frame(self.sock, self.kind, s.encode("utf-8"))
+        return len(s)
+
+
+class RequestHandler(socketserver.BaseRequestHandler):
+    def handle(self) -> None:
+        frame = recv_frame(self.request)
+        if frame is None or frame[0] != FRAME_REQUEST:
+            return
+        request = json.loads(frame[1])
+
+        # this runs in a forked child, process-wide state is ours to change
+        os.chdir(request["cwd"])
+        os.environ.clear()
+        os.environ.update(request["env"])
+        sys.stdout = cast(TextIO, FrameWriter(self.request, FRAME_STDOUT))
+        sys.stderr = cast(TextIO, FrameWriter(self.request, FRAME_STDERR))
+
+        try:
+            exit_code = main(
+                request["argv"],
+                io.StringIO(request["stdin"] or ""),
+                prog=request["prog"],
+            )
+        except SystemExit as e:
+            # e.g. argparse errors and --help
+            exit_code = e.code if isinstance(e.code, int) else int(e.code is not None)
+        except Exception:
+            traceback.print_exc()
+            exit_code = 1
+        finally:
+            # the child exits without running atexit handlers
+            remove_workspaces()
+
+        # before the exit code, so that the client's next job can start with it
+        cast(Server, self.server).send_memos()
+        send_frame(self.request, FRAME_EXIT, struct.pack("<i", exit_code))
+
+
+class Server(socketserver.ForkingMixIn, socketserver.UnixStreamServer):
+    # let jobs queue up rather than be refused while the server is busy forking
+    request_queue_size = socket.SOMAXCONN
+
+    def __init__(self, *args, max_jobs: Optional[int] = None, **kwargs):
+        # ForkingMixIn waits for a job to exit before forking beyond max_children
+        # (40 by default), by default only the build limits the number of jobs
+        self.max_children = max_jobs if max_jobs is not None else sys.maxsize
+        # jobs send the entries they added to the memos over this
+        self.memos_recv, self.memos_send = socket.socketpair(
+            socket.AF_UNIX, socket.SOCK_DGRAM
+        )
+        self.memos_recv.setblocking(False)
+        try:
+            self.memos_send.setsockopt(
+                socket.SOL_SOCKET, socket.SO_SNDBUF, MAX_MEMOS_SIZE
+            )
+        except OSError:
+            pass
+        super().__init__(*args, **kwargs)
+
+    def send_memos(self) -> None:
+        """
+        Send the entries this job added to the memos to the server
+        """
+        added = memo.take_added()
+        if not added:
+            return
+        try:
+            self.memos_send.send(pickle.dumps(added), socket.MSG_DONTWAIT)
+        except OSError:
+            # e.g. too large or the server is behind, the next jobs do without
+            pass
+
+    def merge_memos(self) -> None:
+        while True:
+            try:
+                data = self.memos_recv.recv(MAX_MEMOS_SIZE)
+            except BlockingIOError:
+                return
+            memo.merge(pickle.loads(data))
+
+    def process_request(self, request, client_address) -> None:
+        # the job forked for this request inherits the memos of the previous ones
+        self.merge_memos()
+        super().process_request(request, client_address)
+
+    def service_actions(self) -> None:
+        self.merge_memos()
+        super().service_actions()
+
+    def server_close(self) -> None:
+        super().server_close()
+        self.memos_recv.close()
+        self.memos_send.close()
+
+
+def serve(socket_path: Path, max_jobs: Optional[int] = None) -> None:
+    socket_path.unlink(missing_ok=True)
+
+    # warm up before forking so that every job inherits it
+    package_digest()
+
+    with Server(str(socket_path), RequestHandler, max_jobs=max_jobs) as server:
+        try:
+            server.serve_forever()
+        finally:
+            socket_path.unlink(missing_ok=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("socket_path", type=Path)
+    parser.add_argument("--max-jobs", type=int)
+    args = parser.parse_args()
+
+    try:
+        serve(args.socket_path, args.max_jobs)
+    except KeyboardInterrupt:
+        pass
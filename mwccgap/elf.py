@@ -1,6 +1,9 @@
+import bisect
 import struct
 from typing import Optional
 
+from .tables import pack_relocations, pack_symbols, renumber_relocations
+
 SECTION_HEADER_SIZE = 0x28
 
 SHT_SYMTAB = 2
@@ -44,6 +47,12 @@ class Elf:
         self,
         data: bytes,
     ):
+        """
+        Only the headers are parsed up front. Section data are zero-copy views of
+        `data`, and symbols and relocations are decoded when first accessed.
+        """
+        data = memoryview(data)
+
         (
             self.e_ident,
             self.e_type,
@@ -67,6 +76,11 @@ class Elf:
 
         self.rodata_sections: list[Section] = []
 
+        # section index of each function's .text, and of every .rodata in order,
+        # kept up to date by add_section
+        self._function_section_indices: dict[str, int] = {}
+        self._rodata_section_indices: list[int] = []
+
         self.symtab = None  # type: ignore
         self.shstrtab = None  # type: ignore
         self.strtab = None  # type: ignore
@@ -193,22 +207,14 @@ class Elf:
         for section in self.sections:
             section.name = self.shstrtab.get_symbol_by_index(section.sh_name)
 
-        for symbol in self.symtab.symbols:
-            symbol.name = self.strtab.get_symbol_by_index(symbol.st_name)
+        self.symtab.strtab = self.strtab
 
         # To be refined
-        function_names = [
-            s.name
-            for s in sorted(
-                filter(lambda x: x.st_info in FUNCTION_ST_INFOS, self.symtab.symbols),
-                key=lambda x: x.st_shndx,
-            )
-        ]
+        function_names = self.symtab.get_function_names()
 
         for i, section in enumerate(self.sections):
             if isinstance(section, RelocationRecord):
-                for reloc in section.relocations:
-                    reloc.symbol = self.symtab.symbols[reloc.symbol_index].name
+                section.symtab = self.symtab
                 self.relocations.append(section)
             else:
                 if section.name == ".text":
@@ -223,6 +229,7 @@ class Elf:
                     self.functions.append(text_section)
                 elif section.name == ".rodata":
                     self.rodata_sections.append(section)
+                self._index_section(i, self.sections[i])
 
     def add_sh_symbol(self, symbol_name: str):
         return self.shstrtab.add_symbol(symbol_name)
@@ -236,6 +243,44 @@ class Elf:
 
         return index
 
+    def stage_symbol(self, symbol: "Symbol", force=False) -> int:
+        """
+        Like add_symbol(), but the symbol is only added by commit_symbols(): the
+        returned index is provisional until then.
+        """
+        index, _ = self.symtab.get_symbol_by_name(symbol.name)
+        if index is None or force:
+            if symbol.name != "":
+                symbol.st_name = self.strtab.add_symbol(symbol.name)
+            index = self.symtab.stage_symbol(symbol)
+
+        return index
+
+    def commit_symbols(self) -> list[int]:
+        """
+        Add the staged symbols and renumber the relocations of every relocation
+        section, including the provisional indices of staged symbols.
+
+        Returns the new index of every symbol by its former (or provisional) index.
+        """
+        # existing symbols only move when locals are inserted before the globals
+        renumber = any(x.bind == 0 for x in self.symtab.staged)
+
+        remap = self.symtab.commit_symbols()
+        if renumber:
+            # records that were never decoded are renumbered in bulk
+            encoded = [x for x in self.get_relocations() if not x.decoded]
+            for record, data in zip(
+                encoded, renumber_relocations([x.data for x in encoded], remap)
+            ):
+                record.data = data
+
+            for record in self.get_relocations():
+                if record.decoded:
+                    for relocation in record.relocations:
+                        relocation.symbol_index = remap[relocation.symbol_index]
+        return remap
+
     def add_section(self, section) -> int:
         self.sections.append(section)
         self.e_shnum += 1  # not strictly necessary
@@ -243,8 +288,31 @@ class Elf:
         if isinstance(section, RelocationRecord):
             self.relocations.append(section)
 
+        self._index_section(len(self.sections) - 1, section)
         return len(self.sections) - 1
 
+    def _index_section(self, index: int, section: "Section") -> None:
+        if isinstance(section, TextSection):
+            if section.function_name:
+                self._function_section_indices.setdefault(section.function_name, index)
+        elif section.name == ".rodata":
+            # sections are only ever appended, so this stays sorted
+            self._rodata_section_indices.append(index)
+
+    def get_function_section_index(self, function_name: str) -> Optional[int]:
+        """
+        Index of the (first) .text section of `function_name`
+        """
+        return self._function_section_indices.get(function_name)
+
+    def get_rodata_section_indices(self, section_index: int, count: int) -> list[int]:
+        """
+        Indices of (at most) the first `count` .rodata sections after the section
+        at `section_index`, i.e. the .rodata of the function at that index
+        """
+        start = bisect.bisect_right(self._rodata_section_indices, section_index)
+        return self._rodata_section_indices[start : start + count]
+
     def get_relocations(self) -> list["RelocationRecord"]:
         return self.relocations
 
@@ -255,36 +323,34 @@ class Elf:
     def unpack(data):
         return struct.unpack(Elf.fmt, data[:0x34])
 
-    def pack(self):
+    def pack(self) -> bytes:
         elf_header_size = 0x40
 
+        # lay out every section first, then write everything into a single buffer
+        section_data = []
         sh_offset = elf_header_size  # 0x34 + 0xC alignment
-
-        section_headers = bytes()
-        section_data = bytes()
         for section in self.sections:
             section.sh_offset = sh_offset
-            header, data = section.pack()
-
-            section_headers += header
-            section_data += data
+            data = section.pack_data()
+            section_data.append(data)
 
             sh_offset += len(data)
 
             alignment = 1 << section.sh_addralign
             if alignment:
                 if sh_offset % alignment:
-                    bytes_needed = alignment - (sh_offset % alignment)
-                    section_data += bytes(bytes_needed)
-                    sh_offset += bytes_needed
+                    sh_offset += alignment - (sh_offset % alignment)
 
         if sh_offset % 4:
-            bytes_needed = 4 - (sh_offset % 4)
-            section_data += bytes(bytes_needed)
-            sh_offset += bytes_needed
+            sh_offset += 4 - (sh_offset % 4)
+
+        e_shoff = sh_offset
+        out = bytearray(e_shoff + len(self.sections) * SECTION_HEADER_SIZE)
 
-        elf_header = struct.pack(
+        struct.pack_into(
             Elf.fmt,
+            out,
+            0,
             *[
                 self.e_ident,
                 self.e_type,
@@ -292,7 +358,7 @@ class Elf:
                 self.e_version,
                 self.e_entry,
                 self.e_phoff,
-                len(section_data) + elf_header_size,  # self.e_shoff,
+                e_shoff,  # self.e_shoff,
                 self.e_flags,
                 self.e_ehsize,
                 self.e_phentsize,
@@ -302,13 +368,31 @@ class Elf:
                 self.e_shstrndx,
             ],
         )
+        # header is padded to 0x40 by the zero-initialised buffer
 
-        elf_header += bytes(0xC)  # pad to 0x40
+        header_offset = e_shoff
+        for section, data in zip(self.sections, section_data):
+            out[section.sh_offset : section.sh_offset + len(data)] = data
+            out[header_offset : header_offset + SECTION_HEADER_SIZE] = (
+                section.pack_header()
+            )
+            header_offset += SECTION_HEADER_SIZE
 
-        return elf_header + section_data + section_headers
+        return bytes(out)
 
 
 class Symbol:
+    # objects can have tens of thousands of symbols, so no __dict__ per instance
+    __slots__ = (
+        "st_name",
+        "st_info",
+        "st_other",
+        "st_shndx",
+        "st_value",
+        "st_size",
+        "name",
+    )
+
     st_name: int
     st_info: int
     st_other: int
@@ -336,11 +420,24 @@ class Symbol:
         self.st_other = st_other
         self.st_shndx = st_shndx
 
-        self.bind = st_info >> 4
-        self.type = st_info & 0xF
-
         self.name = ""
 
+    @property
+    def bind(self) -> int:
+        return self.st_info >> 4
+
+    @bind.setter
+    def bind(self, bind: int) -> None:
+        self.st_info = (bind << 4) | (self.st_info & 0xF)
+
+    @property
+    def type(self) -> int:
+        return self.st_info & 0xF
+
+    @type.setter
+    def type(self, type: int) -> None:
+        self.st_info = (self.st_info & ~0xF) | type
+
     def __str__(self):
         if self.name:
             res = self.name
@@ -364,7 +461,7 @@ class Symbol:
                 self.st_name,
                 self.st_value,
                 self.st_size,
-                (self.bind << 4) | self.type,
+                self.st_info,
                 self.st_other,
                 self.st_shndx,
             ],
@@ -372,6 +469,21 @@ class Symbol:
 
 
 class Section:
+    __slots__ = (
+        "sh_name",
+        "sh_type",
+        "sh_flags",
+        "sh_addr",
+        "sh_offset",
+        "sh_size",
+        "sh_link",
+        "sh_info",
+        "sh_addralign",
+        "sh_entsize",
+        "data",
+        "name",
+    )
+
     sh_name: int
     sh_type: int
     sh_flags: int
@@ -453,7 +565,13 @@ class Section:
 
 
 class TextSection(Section):
-    function_name: str = ""
+    __slots__ = ("function_name",)
+
+    function_name: str
+
+    def _handle_data(self, data: bytes) -> bytes:
+        self.function_name = ""
+        return data
 
     @staticmethod
     def from_section(section) -> "TextSection":
@@ -473,6 +591,8 @@ class TextSection(Section):
 
 
 class BssSection(Section):
+    __slots__ = ()
+
     def pack_header(self) -> bytes:
         return struct.pack(
             Section.fmt,
@@ -495,95 +615,285 @@ class BssSection(Section):
 
 
 class Symtab(Section):
-    symbols: list[Symbol]
+    """
+    Symbols, locals first: sh_info is the index of the first non-local symbol.
+
+    Symbols can be added one at a time, which renumbers the globals whenever a local
+    is inserted, or staged and added together by commit_symbols(). Until then,
+    staged symbols are referred to by provisional indices following the existing
+    symbols.
+    """
+
+    __slots__ = ("_symbols", "strtab", "_names", "staged")
+
+    # names the symbols once they are decoded
+    strtab: Optional["Strtab"]
 
     def _handle_data(self, data: bytes) -> bytes:
-        self.symbols = []
-        ptr = 0
-        while ptr < len(data):
-            self.symbols.append(Symbol.from_data(data[ptr : ptr + 0x10]))
-            ptr += 0x10
+        self._symbols: Optional[list[Symbol]] = None
+        self.strtab = None
+        # index of the first symbol with each name (staged ones included)
+        self._names: Optional[dict[str, int]] = None
+        # symbols to add on commit_symbols()
+        self.staged: list[Symbol] = []
         return data
 
+    @property
+    def symbols(self) -> list[Symbol]:
+        if self._symbols is None:
+            self._symbols = [
+                Symbol(*entry) for entry in struct.iter_unpack(Symbol.fmt, self.data)
+            ]
+            if self.strtab is not None:
+                for symbol in self._symbols:
+                    symbol.name = self.strtab.get_symbol_by_index(symbol.st_name)
+        return self._symbols
+
+    @symbols.setter
+    def symbols(self, symbols: list[Symbol]) -> None:
+        assert not self.staged, "Symbols are staged"
+        self._symbols = symbols
+        self._names = None
+
+    def get_function_names(self) -> list[str]:
+        """
+        Names of the function symbols, ordered by section index
+        """
+        if self._symbols is not None:
+            functions = filter(lambda x: x.st_info in FUNCTION_ST_INFOS, self._symbols)
+            return [x.name for x in sorted(functions, key=lambda x: x.st_shndx)]
+
+        # only decode and name the function symbols
+        assert self.strtab is not None
+        entries = sorted(
+            (
+                (st_shndx, st_name)
+                for (st_name, _, _, st_info, _, st_shndx) in struct.iter_unpack(
+                    Symbol.fmt, self.data
+                )
+                if st_info in FUNCTION_ST_INFOS
+            ),
+            key=lambda x: x[0],
+        )
+        return [self.strtab.get_symbol_by_index(st_name) for _, st_name in entries]
+
+    def _get_symbol(self, index: int) -> Symbol:
+        if index < len(self.symbols):
+            return self.symbols[index]
+        return self.staged[index - len(self.symbols)]
+
+    def _index_names(self) -> dict[str, int]:
+        if self._names is None:
+            self._names = {}
+            for i, symbol in enumerate(self.symbols):
+                self._names.setdefault(symbol.name, i)
+        return self._names
+
     def get_symbol_by_name(self, name) -> tuple[Optional[int], Optional[Symbol]]:
-        for i, symbol in enumerate(self.symbols):
-            if symbol.name == name:
-                return (i, symbol)
-        return (None, None)
+        index = self._index_names().get(name)
+        if index is None:
+            return (None, None)
+        return (index, self._get_symbol(index))
 
     def add_symbol(self, symbol: Symbol) -> int:
-        # sh_info is the index of the first non-local symbol.
+        assert not self.staged, "Symbols are staged"
+
         if symbol.bind == 0:  # STB_LOCAL
             # insert local symbol before sh_info
             index = self.sh_info
             self.symbols.insert(index, symbol)
             self.sh_info += 1
+            # every global moved
+            self._names = None
             return index
 
         # assume global?
         index = len(self.symbols)
         self.symbols.append(symbol)
+        if self._names is not None:
+            self._names.setdefault(symbol.name, index)
+        return index
+
+    def stage_symbol(self, symbol: Symbol) -> int:
+        """
+        Stage `symbol` to be added by commit_symbols(), returns its provisional index
+        """
+        names = self._index_names()
+        index = len(self.symbols) + len(self.staged)
+        self.staged.append(symbol)
+
+        first = names.get(symbol.name)
+        # locals will precede every global, so one can take the name from a global
+        if first is None or (symbol.bind == 0 and self._get_symbol(first).bind != 0):
+            names[symbol.name] = index
         return index
 
+    def commit_symbols(self) -> list[int]:
+        """
+        Add the staged symbols, locals after the existing locals and globals after
+        the existing globals, both in the order they were staged: the same order
+        as adding them one at a time.
+
+        Returns the new index of every existing and staged symbol, by its current
+        (or provisional) index.
+        """
+        symbols = self.symbols
+        staged, self.staged = self.staged, []
+
+        new_locals = [x for x in staged if x.bind == 0]
+        new_globals = [x for x in staged if x.bind != 0]
+        local_count = self.sh_info
+        shift = len(new_locals)
+
+        remap = list(range(local_count))
+        remap.extend(range(local_count + shift, len(symbols) + shift))
+        next_local = local_count
+        next_global = len(symbols) + shift
+        for symbol in staged:
+            if symbol.bind == 0:
+                remap.append(next_local)
+                next_local += 1
+            else:
+                remap.append(next_global)
+                next_global += 1
+
+        self._symbols = (
+            symbols[:local_count] + new_locals + symbols[local_count:] + new_globals
+        )
+        self.sh_info += shift
+        if self._names is not None:
+            self._names = {name: remap[i] for name, i in self._names.items()}
+        return remap
+
     def pack_data(self) -> bytes:
-        self.data = b"".join(s.pack() for s in self.symbols)
+        assert not self.staged, "Symbols are staged"
+        if self._symbols is None:
+            # never decoded, so never modified
+            return self.data
+        self.data = pack_symbols(self.symbols)
         return self.data
 
 
 class Strtab(Section):
-    symbols: list[str]
+    """
+    NUL-terminated strings, referenced by their offset into `data`.
 
-    def _handle_data(self, data: bytes) -> bytes:
-        self.symbols = []
+    Names are shared with the tail of existing strings where possible (e.g. `foo`
+    resolves into `mwccgap_foo`), always at the lowest such offset. Every string, and
+    every tail of it shorter than TAIL_LENGTH bytes, is mapped to the lowest offset it
+    can be referenced at. Longer tails are found through an index of the strings by
+    their last TAIL_LENGTH bytes.
+    """
 
-        ptr = start = 0
-        while ptr < len(data):
-            if data[ptr] == 0:
-                self.symbols.append(data[start:ptr].decode("utf"))
-                start = ptr + 1
-            ptr += 1
+    __slots__ = ("_offsets", "_tails")
 
-        return data
+    TAIL_LENGTH = 8
+
+    data: bytearray
+
+    def _handle_data(self, data: bytes) -> bytearray:
+        # both built on first use
+        self._offsets: Optional[dict[bytes, int]] = None
+        # end offsets of the strings ending with each tail
+        self._tails: dict[bytes, list[int]] = {}
+        # grows as strings are added, so keep a copy rather than a view
+        return bytearray(data)
+
+    @property
+    def symbols(self) -> list[str]:
+        # every NUL-terminated string, in order
+        return [x.decode("utf") for x in self.data.split(b"\x00")[:-1]]
 
     def pack_data(self) -> bytes:
-        self.data = bytes()
-        for symbol in self.symbols:
-            # print(f"Packing symbol: {symbol}")
-            self.data += symbol.encode("utf") + b"\x00"
-        return self.data
+        # every NUL-terminated string, dropping anything after the last one
+        del self.data[self.data.rfind(b"\x00") + 1 :]
+        return bytes(self.data)
 
     def get_symbol_by_index(self, index) -> str:
-        ptr = index
-        while ptr < len(self.data):
-            if self.data[ptr] == 0:
-                return self.data[index:ptr].decode("utf")
-            ptr += 1
-        raise Exception(f"Symbol not found at index: {index}")
+        end = self.data.find(b"\x00", index)
+        if end == -1:
+            raise Exception(f"Symbol not found at index: {index}")
+        return self.data[index:end].decode("utf")
+
+    def _index_string(self, start: int, end: int) -> None:
+        assert self._offsets is not None
+        name = bytes(self.data[start:end])
+        self._offsets.setdefault(name, start)
+        # strings are indexed in order, so the first offset of a tail is the lowest
+        for length in range(min(end - start + 1, Strtab.TAIL_LENGTH)):
+            self._offsets.setdefault(name[len(name) - length :], end - length)
+        if end - start >= Strtab.TAIL_LENGTH:
+            self._tails.setdefault(name[-Strtab.TAIL_LENGTH :], []).append(end)
+
+    def _index(self) -> dict[bytes, int]:
+        if self._offsets is None:
+            self._offsets = {}
+            start = 0
+            while (end := self.data.find(b"\x00", start)) != -1:
+                self._index_string(start, end)
+                start = end + 1
+        return self._offsets
+
+    def find_symbol(self, symbol_name: str) -> int:
+        """
+        Returns the lowest offset at which `symbol_name` can be referenced, or -1
+        """
+        encoded_name = symbol_name.encode("utf8")
+        offset = self._index().get(encoded_name, -1)
+        if len(encoded_name) < Strtab.TAIL_LENGTH:
+            return offset
+
+        # the tail of an earlier string
+        for end in self._tails.get(encoded_name[-Strtab.TAIL_LENGTH :], ()):
+            start = end - len(encoded_name)
+            if offset != -1 and start >= offset:
+                break
+            if start >= 0 and self.data[start:end] == encoded_name:
+                return start
+        return offset
 
     def add_symbol(self, symbol_name: str) -> int:
-        encoded_name = symbol_name.encode("utf8") + b"\x00"
-        idx = self.data.find(encoded_name)
+        idx = self.find_symbol(symbol_name)
         if idx != -1:
             return idx
 
+        encoded_name = symbol_name.encode("utf8")
+        # anything after the last NUL becomes the start of the new string
+        start = self.data.rfind(b"\x00") + 1
         idx = len(self.data)
-        self.data = self.data + encoded_name
-        self.symbols.append(symbol_name)
+        self.data += encoded_name + b"\x00"
+        self._index_string(start, len(self.data) - 1)
         return idx
 
 
 class Relocation:
-    symbol: Optional[Symbol]
+    __slots__ = ("r_offset", "r_info", "symbol")
+
+    # name of the symbol, once the relocation is decoded from a RelocationRecord
+    symbol: Optional[str]
 
     def __init__(self, r_offset, r_info):
         self.r_offset = r_offset
         self.r_info = r_info
 
-        self.reloc_type = r_info & 0xFF
-        self.symbol_index = r_info >> 0x8
-
         self.symbol = None
 
+    @property
+    def reloc_type(self) -> int:
+        return self.r_info & 0xFF
+
+    @reloc_type.setter
+    def reloc_type(self, reloc_type: int) -> None:
+        self.r_info = (self.r_info & ~0xFF) | reloc_type
+
+    @property
+    def symbol_index(self) -> int:
+        return self.r_info >> 0x8
+
+    @symbol_index.setter
+    def symbol_index(self, symbol_index: int) -> None:
+        self.r_info = (symbol_index << 0x8) | (self.r_info & 0xFF)
+
     def __str__(self) -> str:
         return f"r_offset: 0x{self.r_offset:X}, r_info: 0x{self.r_info:X}, reloc_type: 0x{self.reloc_type:X}, symbol_index: 0x{self.symbol_index:X}"
 
@@ -592,20 +902,47 @@ class Relocation:
             "<II",
             *[
                 self.r_offset,
-                (self.symbol_index << 0x8) + self.reloc_type,
+                self.r_info,
             ],
         )
 
 
 class RelocationRecord(Section):
+    __slots__ = ("_relocations", "symtab")
+
+    # names the relocations' symbols once they are decoded
+    symtab: Optional[Symtab]
+
     def _handle_data(self, data: bytes) -> bytes:
-        self.relocations = [
-            Relocation(offset, info)
-            for (offset, info) in struct.iter_unpack("<II", data)
-        ]
+        self._relocations: Optional[list[Relocation]] = None
+        self.symtab = None
         return data
 
+    @property
+    def relocations(self) -> list[Relocation]:
+        if self._relocations is None:
+            self._relocations = [
+                Relocation(offset, info)
+                for (offset, info) in struct.iter_unpack("<II", self.data)
+            ]
+            if self.symtab is not None:
+                symbols = self.symtab.symbols
+                for reloc in self._relocations:
+                    reloc.symbol = symbols[reloc.symbol_index].name
+        return self._relocations
+
+    @relocations.setter
+    def relocations(self, relocations: list[Relocation]) -> None:
+        self._relocations = relocations
+
+    @property
+    def decoded(self) -> bool:
+        return self._relocations is not None
+
     def pack_data(self) -> bytes:
+        if self._relocations is None:
+            # never decoded, so never modified
+            return self.data
         # print(f"Packing {len(self.relocations)} relocation(s)")
-        self.data = b"".join(r.pack() for r in self.relocations)
+        self.data = pack_relocations(self.relocations)
         return self.data
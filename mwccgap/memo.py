@@ -0,0 +1,67 @@
+"""
+In-memory memos of results that only depend on their key, e.g. the digest of a tool
+or the scan of an .s file keyed on the file's path, size and modification time.
+
+Within a process, each memo saves recomputing (or reading back from the cache) the
+same result. The daemon collects the entries added by each job and merges them into
+its own memos, so that the jobs forked after it start with them (see
+`mwccgap.daemon`).
+"""
+
+import os
+
+from pathlib import Path
+from typing import Any, Dict, Hashable
+
+_memos: Dict[str, "Memo"] = {}
+
+
+class Memo(Dict[Hashable, Any]):
+    """
+    A dict that records the entries added to it since `take_added()`
+    """
+
+    def __init__(self, name: str):
+        super().__init__()
+        self.name = name
+        self.added: Dict[Hashable, Any] = {}
+        _memos[name] = self
+
+    def __setitem__(self, key: Hashable, value: Any) -> None:
+        super().__setitem__(key, value)
+        self.added[key] = value
+
+    def merge(self, entries: Dict[Hashable, Any]) -> None:
+        """
+        Add entries without recording them as added
+        """
+        super().update(entries)
+
+
+def file_key(path: Path) -> tuple[str, int, int]:
+    """
+    Identifies the contents of a file by its path, size and modification time
+    """
+    stat = os.stat(path)
+    return (str(Path(path).resolve()), stat.st_size, stat.st_mtime_ns)
+
+
+def take_added() -> Dict[str, Dict[Hashable, Any]]:
+    """
+    The entries added to every memo since the last call, by memo name
+    """
+    added = {}
+    for name, memo in _memos.items():
+        if memo.added:
+            added[name] = memo.added
+            memo.added = {}
+    return added
+
+
+def merge(added: Dict[str, Dict[Hashable, Any]]) -> None:
+    """
+    Add entries returned by `take_added()`, e.g. in another process
+    """
+    for name, entries in added.items():
+        if (memo := _memos.get(name)) is not None:
+            memo.merge(entries)
@@ -1,10 +1,19 @@
-import copy
-import tempfile
+import contextlib
+import io
 
+from concurrent.futures import Future, ThreadPoolExecutor
 from pathlib import Path
-from typing import List, Optional
+from typing import Iterator, List, Optional, Union
 
 from .assembler import Assembler
+from .cache import (
+    Cache,
+    DEFAULT_CACHE_MAX_SIZE,
+    make_key,
+    package_digest,
+    read_file,
+    tool_digest,
+)
 from .compiler import Compiler
 from .constants import (
     FUNCTION_PREFIX,
@@ -12,10 +21,13 @@ from .constants import (
     SYMBOL_DOLLAR,
     DOLLAR_SIGN,
     SYMBOL_SINIT,
-    IGNORED_RELOCATIONS,
 )
-from .elf import Elf, TextSection, Relocation
+from .elf import Elf
 from .preprocessor import Preprocessor
+from .profiler import profiling
+from .timings import Timings, timed, traced
+from .transplant import apply_transplant, plan_transplant
+from .workspace import get_workspace
 
 
 def process_c_file(
@@ -32,260 +44,325 @@ def process_c_file(
     asm_dir_prefix: Optional[Path] = None,
     macro_inc_path: Optional[Path] = None,
     c_file_encoding: Optional[str] = None,
+    discovery: str = "compile",
+    cache_dir: Optional[Path] = None,
+    cache_max_size: int = DEFAULT_CACHE_MAX_SIZE,
+    batch_assembly: bool = False,
+    jobs: int = 1,
+    depfile: Optional[Path] = None,
+    depfile_target: Optional[str] = None,
+    depfile_c_file: bool = True,
+    timings: Optional[Timings] = None,
+    profile: Optional[Path] = None,
+    workspace_dir: Optional[Path] = None,
+    tool_output: str = "memory",
+    c_copies: str = "source",
+    c_file_from_stdin: bool = False,
 ):
-    # 1. compile file as-is, any INCLUDE_ASM'd functions will be missing from the object
-    compiler = Compiler(c_flags, mwcc_path, use_wibo, wibo_path)
-    if c_file_encoding:
-        with tempfile.NamedTemporaryFile(suffix=".c", dir=c_file.parent) as temp_c_file:
-            data = c_file.read_text(encoding="utf-8")
-            temp_c_file.write(data.encode(c_file_encoding))
-            temp_c_file.flush()
-            obj_bytes = compiler.compile_file(Path(temp_c_file.name))
-    else:
-        obj_bytes = compiler.compile_file(c_file)
-
-    precompiled_elf = Elf(obj_bytes)
-    # for now we only care about the names of the functions that exist
-    c_functions = set(f.function_name for f in precompiled_elf.get_functions())
-
-    # 2. identify all INCLUDE_ASM statements and replace with asm statements full of nops
-    with c_file.open("r", encoding="utf-8") as f:
-        out_lines, asm_files = Preprocessor(asm_dir_prefix).preprocess_c_file(f)
-
-    # filter out functions that can be found in the compiled c object
-    asm_files = [(x, y) for (x, y) in asm_files if x.stem not in c_functions]
-
-    # if there's nothing to do, write out the bytes from the precompiled object
-    if len(asm_files) == 0:
-        o_file.parent.mkdir(exist_ok=True, parents=True)
-        o_file.write_bytes(obj_bytes)
-        return
-
-    # 3. compile the modified .c file for real
-    with tempfile.NamedTemporaryFile(suffix=".c", dir=c_file.parent) as temp_c_file:
-        temp_c_file.write("\n".join(out_lines).encode(c_file_encoding or "utf-8"))
-        temp_c_file.flush()
-
-        temp_c_file_path = Path(temp_c_file.name)
-        temp_c_file_name = temp_c_file_path.name
-        obj_bytes = compiler.compile_file(temp_c_file_path)
-
-    compiled_elf = Elf(obj_bytes)
-
-    rel_text_sh_name = compiled_elf.add_sh_symbol(".rel.text")
-
-    symbol_to_section_idx = {}
-    for symbol in compiled_elf.symtab.symbols:
-        if symbol.name.startswith(FUNCTION_PREFIX):
-            symbol.name = symbol.name[len(FUNCTION_PREFIX) :]
-            symbol.st_name += len(FUNCTION_PREFIX)
-
-        elif symbol.name.startswith(SYMBOL_AT):
-            symbol.name = "@" + symbol.name.removeprefix(SYMBOL_AT)
-            symbol.st_name = compiled_elf.strtab.add_symbol(symbol.name)
-
-        elif SYMBOL_DOLLAR in symbol.name:
-            symbol.name = symbol.name.replace(SYMBOL_DOLLAR, DOLLAR_SIGN)
-            symbol.st_name = compiled_elf.strtab.add_symbol(symbol.name)
-
-        elif symbol.name.find(SYMBOL_SINIT + temp_c_file_name) != -1:
-            symbol.name = replace_sinit(symbol.name, temp_c_file_name, c_file.name)
-            symbol.st_name = compiled_elf.strtab.add_symbol(symbol.name)
-
-        symbol_to_section_idx[symbol.name] = symbol.st_shndx
-
+    if profile is not None:
+        # the same arguments, without profiling again
+        arguments = {**locals(), "profile": None}
+        with profiling(profile):
+            return process_c_file(**arguments)
+
+    cache: Optional[Cache] = None
+    if cache_dir is not None:
+        cache = Cache(cache_dir, cache_max_size)
+
+    workspace = get_workspace(workspace_dir)
+    copies_in_workspace = c_copies == "workspace"
+    compiler = Compiler(
+        c_flags,
+        mwcc_path,
+        use_wibo,
+        wibo_path,
+        timings=timings,
+        workspace=workspace,
+        cache=cache,
+        in_memory_output=tool_output == "memory",
+    )
     assembler = Assembler(
         as_path=as_path,
         as_flags=as_flags,
         as_march=as_march,
         as_mabi=as_mabi,
         macro_inc_path=macro_inc_path,
+        cache=cache,
+        timings=timings,
+        workspace=workspace,
+        in_memory_output=tool_output == "memory",
     )
+    preprocessor = Preprocessor(asm_dir_prefix, cache=cache)
+
+    c_bytes = c_file.read_bytes()
+    c_lines = io.TextIOWrapper(io.BytesIO(c_bytes), encoding="utf-8").readlines()
+
+    includes: List[Path] = []
+    unresolved: List[str] = []
+    asm_dependencies: List[Path] = []
+    asm_contents: dict[Path, bytes] = {}
+    asm_includes: dict[Path, None] = {}
+    # -prefix/-include files are included before the C file
+    prefix_lines = [f'#include "{x}"\n' for x in compiler.get_prefix_files()]
+    if cache_dir is not None or depfile is not None:
+        includes = preprocessor.find_includes(
+            c_file, prefix_lines + c_lines, compiler.get_include_dirs(), unresolved
+        )
+        asm_dependencies = preprocessor.find_asm_files(c_lines)
+        for asm_file in asm_dependencies:
+            asm_contents[asm_file] = asm_file.read_bytes()
+            # the files read by .include/.incbin
+            included_files = assembler.find_included_files(asm_contents[asm_file])
+            if included_files is None:
+                unresolved.append(str(asm_file))
+                continue
+            for path in included_files:
+                asm_includes.setdefault(path, None)
 
-    for asm_file, num_rodata_symbols in asm_files:
-        function = asm_file.stem
-
-        asm_bytes = assembler.assemble_file(asm_file)
-        assembled_elf = Elf(asm_bytes)
-
-        asm_functions = assembled_elf.get_functions()
-        assert (
-            len(asm_functions) == 1
-        ), f"Maximum of 1 function per ASM file (found {len(asm_functions)})"
-
-        asm_text = asm_functions[0].data
-        has_text = len(asm_text) > 0
-
-        if has_text:
-            # identify the .text section for this function
-            for text_section_index, text_section in enumerate(compiled_elf.sections):
-                if (
-                    isinstance(text_section, TextSection)
-                    and text_section.function_name == f"{FUNCTION_PREFIX}{function}"
-                ):
-                    break
-            else:
-                raise Exception(f"{function} not found in {c_file}")
-
-            # assumption is that .rodata will immediately follow the .text section
-            rodata_section_indices = []
-            if num_rodata_symbols > 0:
-                for i, section in enumerate(
-                    compiled_elf.sections[text_section_index + 1 :]
-                ):
-                    if section.name == ".rodata":
-                        # found some .rodata before another .text section
-                        rodata_section_indices.append(text_section_index + 1 + i)
-                        if len(rodata_section_indices) == num_rodata_symbols:
-                            # reached end of rodata sections for this text section
-                            break
-
-            assert num_rodata_symbols == len(
-                rodata_section_indices
-            ), ".rodata section count mismatch"
-        else:
-            # this file only contains .rodata
-            assert (
-                num_rodata_symbols == 1
-            ), f"Maximum of 1 symbol per rodata ASM file (found {num_rodata_symbols})"
-            idx = symbol_to_section_idx.get(function)
-            assert (
-                idx is not None
-            ), f"Could not find .rodata section for symbol '{function}'"
-            rodata_section_indices = [idx]
-
-        if has_text:
-            # transplant .text section data from assembled object
-            compiled_function_length = len(text_section.data)
-
-            assert (
-                len(asm_text) >= compiled_function_length
-            ), f"Not enough assembly to fill {function} in {c_file}"
-
-            text_section.data = asm_text[:compiled_function_length]
-
-        if num_rodata_symbols > 0:
-            assert (
-                len(assembled_elf.rodata_sections) == 1
-            ), f"Expected ASM to contain 1 .rodata section, found {len(assembled_elf.rodata_sections)}"
-            asm_rodata = assembled_elf.rodata_sections[0]
-
-            offset = 0
-            rodata_section_offsets = []
-            for idx in rodata_section_indices:
-                # copy slices of rodata from ASM object into each .rodata section
-                data_len = len(compiled_elf.sections[idx].data)
-                compiled_elf.sections[idx].data = asm_rodata.data[
-                    offset : offset + data_len
-                ]
-                offset += data_len
-                rodata_section_offsets.append(offset)
-
-                # force 4-byte alignment for .rodata sections (defaults to 16-byte)
-                compiled_elf.sections[idx].sh_addralign = 2  # 1 << 2 = 4
-
-            rel_rodata_sh_name = compiled_elf.add_sh_symbol(".rel.rodata")
-
-        relocation_records = [
-            record
-            for record in assembled_elf.get_relocations()
-            if record.name not in IGNORED_RELOCATIONS
+    def write_output(obj_bytes: bytes) -> None:
+        o_file.parent.mkdir(exist_ok=True, parents=True)
+        o_file.write_bytes(obj_bytes)
+
+        if depfile is not None:
+            dependencies = [c_file] if depfile_c_file else []
+            dependencies += includes
+            dependencies += asm_dependencies
+            dependencies += asm_includes
+            if macro_inc_path is not None and macro_inc_path.is_file():
+                dependencies.append(macro_inc_path)
+            write_depfile(depfile, depfile_target or str(o_file), dependencies)
+
+    cache_key = ""
+    # an object is only cached if all of the files it depends on are known
+    if cache is not None and not unresolved:
+        # C source, headers, INCLUDE_ASM files, macro.inc, options and tools
+        key_parts: List[Union[str, bytes, None]] = [
+            "object",
+            package_digest(),
+            # a C file read from stdin is a copy with a random name
+            "<stdin>" if c_file_from_stdin else c_file.name,
+            c_bytes,
+            c_file_encoding,
         ]
-        assert (
-            len(relocation_records) < 3
-        ), f"{asm_file} has too many relocation records!"
-
-        reloc_symbols = set()
-
-        initial_sh_info_value = compiled_elf.symtab.sh_info
-        local_syms_inserted = 0
-
-        # assumes .text relocations precede .rodata relocations
-        for i, relocation_record in enumerate(relocation_records):
-            relocation_record.sh_link = compiled_elf.symtab_index
-            if has_text and i == 0:
-                relocation_record.sh_name = rel_text_sh_name
-                relocation_record.sh_info = text_section_index
-            else:
-                relocation_record.sh_name = rel_rodata_sh_name
-                relocation_record.sh_info = rodata_section_indices[0]
-
-            for relocation in relocation_record.relocations:
-                symbol = assembled_elf.symtab.symbols[relocation.symbol_index]
-
-                if symbol.bind == 0:
-                    local_syms_inserted += 1
-
-                if has_text and i == 0:
-                    force = False
-                else:
-                    force = True
-
-                relocation.symbol_index = compiled_elf.add_symbol(symbol, force=force)
-                reloc_symbols.add(symbol.name)
-
-                if has_text and i == 1:
-                    # repoint .rodata reloc to .text section
-                    symbol.st_shndx = text_section_index
-
-            compiled_elf.add_section(relocation_record)
-
-        new_rodata_relocs = []
-        if local_syms_inserted > 0:
-            # update relocations
-            for relocation_record in compiled_elf.get_relocations():
-                if relocation_record.sh_info == rodata_section_indices[0]:
-                    if num_rodata_symbols == 1:
-                        # nothing to do when only a single .rodata section
-                        continue
-
-                    # otherwise we need to split the rodata relocations across each .rodata section
-                    new_relocations: List[List[Relocation]] = [
-                        [] for _ in rodata_section_indices
-                    ]
-                    for relocation in relocation_record.relocations:
-                        for i in range(len(rodata_section_offsets)):
-                            if relocation.r_offset < rodata_section_offsets[i]:
-                                if i > 0:
-                                    relocation.r_offset -= rodata_section_offsets[i - 1]
-                                new_relocations[i].append(relocation)
-                                break
-
-                    for i, relocations in enumerate(new_relocations):
-                        if i == 0:
-                            # amend original in place
-                            new_rodata_reloc = relocation_record
-                        else:
-                            # take a copy of the original
-                            new_rodata_reloc = copy.copy(relocation_record)
-
-                        new_rodata_reloc.relocations = relocations
-                        new_rodata_reloc.sh_info = rodata_section_indices[i]
-                        new_rodata_relocs.append(new_rodata_reloc)
-
-                    continue
-
-                for relocation in relocation_record.relocations:
-                    if relocation.symbol_index >= initial_sh_info_value:
-                        relocation.symbol_index += local_syms_inserted
-
-            for new_rodata_reloc in new_rodata_relocs[1:]:
-                compiled_elf.add_section(new_rodata_reloc)
-
-        for symbol in assembled_elf.symtab.symbols:
-            if symbol.st_name == 0:
-                continue
+        for include in includes:
+            key_parts += [include.name, include.read_bytes()]
+        for asm_file in asm_dependencies:
+            key_parts += [asm_file.name, asm_contents[asm_file]]
+        for path in asm_includes:
+            key_parts += [str(path), assembler.read_included_file(path)]
+        key_parts += [
+            read_file(macro_inc_path),
+            repr(c_flags),
+            repr(as_flags),
+            as_march,
+            as_mabi,
+            tool_digest(cache, mwcc_path),
+            tool_digest(cache, as_path),
+            tool_digest(cache, wibo_path) if use_wibo else None,
+        ]
+        cache_key = make_key(*key_parts)
+
+        if (cached_bytes := cache.get(cache_key)) is not None:
+            write_output(cached_bytes)
+            return
+
+    # 1. identify all INCLUDE_ASM statements and replace with asm statements full of nops
+    with timed(timings, "preprocess"):
+        out_lines, asm_files = preprocessor.preprocess_c_file(c_lines)
+
+    def compile_nop_c_file() -> tuple[str, bytes]:
+        with timed(timings, "compile"), scratch_c_file(
+            compiler,
+            c_file,
+            "\n".join(out_lines).encode(c_file_encoding or "utf-8"),
+            copies_in_workspace,
+        ) as temp_c_file_path:
+            return (
+                temp_c_file_path.name,
+                compiler.compile_file(temp_c_file_path, c_file.parent),
+            )
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        # 2. determine which INCLUDE_ASM'd functions are already defined in C
+        obj_bytes: Optional[bytes] = None
+        c_functions: Optional[set[str]] = None
+        if discovery in ("scan", "speculative") and can_scan_c_file(c_file, c_flags):
+            # the macros of the headers, prefix files and flags can hide definitions
+            macros = Preprocessor.find_macros(
+                c_file, prefix_lines + c_lines, compiler.get_include_dirs()
+            )
+            if macros is not None:
+                macros.update(compiler.get_defines())
+            if macros is not None and not Preprocessor.may_define_functions(
+                c_lines, [x.stem for x, _ in asm_files], macros
+            ):
+                c_functions = set()
+
+        compile_future: Optional[Future[tuple[str, bytes]]] = None
+        if c_functions is None:
+            if discovery == "speculative" and len(asm_files) > 0:
+                # the modified .c file does not depend on what is defined in C, so
+                # it is compiled (step 3) while the original is
+                compile_future = executor.submit(compile_nop_c_file)
+
+            with timed(timings, "discovery"):
+                # compile file as-is, any INCLUDE_ASM'd functions will be missing
+                # from the object
+                obj_bytes = compile_c_file(
+                    compiler, c_file, c_file_encoding, c_lines, copies_in_workspace
+                )
+                with traced(timings, "parse ELF"):
+                    precompiled_elf = Elf(obj_bytes)
+                # for now we only care about the names of the functions that exist
+                c_functions = set(
+                    f.function_name for f in precompiled_elf.get_functions()
+                )
+
+        # filter out functions that can be found in the compiled c object
+        asm_files = [(x, y) for (x, y) in asm_files if x.stem not in c_functions]
+
+        # if there's nothing to do, write out the bytes from the precompiled object
+        # (a speculative compile of the modified .c file is not needed, even if it
+        # failed)
+        if len(asm_files) == 0:
+            if obj_bytes is None:
+                with timed(timings, "compile"):
+                    obj_bytes = compile_c_file(
+                        compiler,
+                        c_file,
+                        c_file_encoding,
+                        c_lines,
+                        copies_in_workspace,
+                    )
+            write_output(obj_bytes)
+            if cache is not None and cache_key:
+                cache.put(cache_key, obj_bytes)
+            return
+
+        def assemble_files() -> List[bytes]:
+            with timed(timings, "assemble"):
+                return assembler.assemble_files(
+                    [asm_file for asm_file, _ in asm_files],
+                    batch=batch_assembly,
+                    jobs=jobs,
+                )
+
+        # the assembled objects do not depend on the compiled object, so with
+        # multiple jobs they are assembled while the compiler runs
+        asm_future = executor.submit(assemble_files) if jobs > 1 else None
+
+        # 3. compile the modified .c file for real, unless that is already underway
+        if compile_future is None:
+            temp_c_file_name, compiled_bytes = compile_nop_c_file()
+
+        asm_objects = asm_future.result() if asm_future else assemble_files()
+
+        if compile_future is not None:
+            temp_c_file_name, compiled_bytes = compile_future.result()
+
+    with timed(timings, "transplant"):
+        with traced(timings, "parse ELF"):
+            compiled_elf = Elf(compiled_bytes)
+
+        symbol_to_section_idx = {}
+        for symbol in compiled_elf.symtab.symbols:
+            if symbol.name.startswith(FUNCTION_PREFIX):
+                symbol.name = symbol.name[len(FUNCTION_PREFIX) :]
+                symbol.st_name += len(FUNCTION_PREFIX)
+
+            elif symbol.name.startswith(SYMBOL_AT):
+                symbol.name = "@" + symbol.name.removeprefix(SYMBOL_AT)
+                symbol.st_name = compiled_elf.strtab.add_symbol(symbol.name)
+
+            elif SYMBOL_DOLLAR in symbol.name:
+                symbol.name = symbol.name.replace(SYMBOL_DOLLAR, DOLLAR_SIGN)
+                symbol.st_name = compiled_elf.strtab.add_symbol(symbol.name)
+
+            elif symbol.name.find(SYMBOL_SINIT + temp_c_file_name) != -1:
+                symbol.name = replace_sinit(symbol.name, temp_c_file_name, c_file.name)
+                symbol.st_name = compiled_elf.strtab.add_symbol(symbol.name)
+
+            symbol_to_section_idx[symbol.name] = symbol.st_shndx
+
+        transplants = plan_transplant(
+            compiled_elf, c_file, asm_files, asm_objects, symbol_to_section_idx
+        )
+        apply_transplant(compiled_elf, transplants)
+
+    with timed(timings, "pack"):
+        out_bytes = compiled_elf.pack()
+    write_output(out_bytes)
+    if cache is not None and cache_key:
+        cache.put(cache_key, out_bytes)
+
+
+def escape_make_path(path: str) -> str:
+    return path.replace("$", "$$").replace("#", "\\#").replace(" ", "\\ ")
+
+
+def write_depfile(depfile: Path, target: str, dependencies: List[Path]) -> None:
+    """
+    Write a Make/Ninja depfile declaring that `target` depends on `dependencies`
+    """
+    lines = [f"{escape_make_path(target)}:"]
+    lines += [escape_make_path(str(x)) for x in dict.fromkeys(dependencies)]
+    depfile.parent.mkdir(exist_ok=True, parents=True)
+    depfile.write_text(" \\\n  ".join(lines) + "\n", encoding="utf-8")
 
-            if symbol.bind == 0:
-                # ignore local symbols
-                continue
 
-            if has_text and symbol.name not in reloc_symbols:
-                symbol.st_shndx = text_section_index
-                compiled_elf.add_symbol(symbol)
+@contextlib.contextmanager
+def scratch_c_file(
+    compiler: Compiler,
+    c_file: Path,
+    data: bytes,
+    in_workspace: bool = False,
+) -> Iterator[Path]:
+    """
+    A copy of `c_file` containing `data`, to compile in its place: next to `c_file`,
+    or in the compiler's workspace if `in_workspace` and the #includes of `c_file`
+    can still be found from there
+    """
+    directory: Optional[Path] = c_file.parent
+    if in_workspace and compiler.has_implicit_include_dir():
+        directory = None
+    with compiler.workspace.temp_file(".c", data, directory) as path:
+        yield path
 
-    o_file.parent.mkdir(exist_ok=True, parents=True)
-    o_file.write_bytes(compiled_elf.pack())
+
+def compile_c_file(
+    compiler: Compiler,
+    c_file: Path,
+    c_file_encoding: Optional[str] = None,
+    c_lines: Optional[List[str]] = None,
+    in_workspace: bool = False,
+) -> bytes:
+    """
+    Compile `c_file` as-is, converted to `c_file_encoding` if given (from `c_lines`,
+    its already decoded contents, if given) in a copy placed as by `scratch_c_file`
+    """
+    if not c_file_encoding:
+        return compiler.compile_file(c_file)
+
+    if c_lines is None:
+        data = c_file.read_text(encoding="utf-8")
+    else:
+        data = "".join(c_lines)
+    with scratch_c_file(
+        compiler, c_file, data.encode(c_file_encoding), in_workspace
+    ) as path:
+        return compiler.compile_file(path, c_file.parent)
+
+
+def can_scan_c_file(c_file: Path, c_flags: Optional[List[str]]) -> bool:
+    """
+    The source scan only understands C; C++ function symbols are mangled and
+    therefore never match the INCLUDE_ASM file name.
+    """
+    if c_file.suffix != ".c":
+        return False
+    return not any(
+        "c++" in flag.lower() or "cplus" in flag.lower() for flag in c_flags or []
+    )
 
 
 def replace_sinit(symbol_name, temp_file_name, c_file_name):
@@ -1,9 +1,14 @@
 import re
 import ast
+import io
+import json
 
 from pathlib import Path
-from typing import Dict, Optional, TextIO
-from dataclasses import dataclass
+from typing import Dict, Iterable, Optional
+from dataclasses import astuple, dataclass
+
+from .cache import Cache, make_key, package_digest
+from .memo import Memo, file_key
 
 from .constants import (
     SYMBOL_AT,
@@ -31,6 +36,19 @@ C_MACRO_END = """
 #endif
 """.splitlines()
 
+C_COMMENT_OR_LITERAL_REGEX = re.compile(
+    r"//[^\n]*|/\*.*?\*/|\"(?:\\.|[^\"\\\n])*\"|'(?:\\.|[^'\\\n])*'", re.DOTALL
+)
+C_TOKEN_REGEX = re.compile(r"[A-Za-z_]\w*|[{}();,=]")
+C_HEADER_SUFFIXES = (".h", ".hh", ".hpp")
+C_INCLUDE_REGEX = r'\s*#\s*include\s*([<"])([^>"]+)[>"]'
+# any #include, including computed ones (e.g. #include HEADER)
+C_INCLUDE_DIRECTIVE_REGEX = r"\s*#\s*include\b"
+C_DEFINE_REGEX = re.compile(r"\s*#\s*define\s+([A-Za-z_]\w*)(\([^)]*\))?(.*)")
+
+# the scan of each .s file (see scan_asm_file), keyed by file_key()
+_s_file_scans = Memo("s-file-scans")
+
 
 @dataclass
 class Symbol:
@@ -43,17 +61,29 @@ class Preprocessor:
     def __init__(
         self,
         asm_dir_prefix: Optional[Path] = None,
+        cache: Optional[Cache] = None,
     ):
         self.asm_dir_prefix = asm_dir_prefix
+        self.cache = cache
 
     @staticmethod
     def preprocess_s_file(
         function_name: str,
-        textio: TextIO,
+        textio: Iterable[str],
     ) -> tuple[list[str], Dict[str, Symbol]]:
+        nops_needed, rodata_entries = Preprocessor.scan_s_file(textio)
+        c_lines = Preprocessor.emit_s_file(function_name, nops_needed, rodata_entries)
+        return (c_lines, rodata_entries)
+
+    @staticmethod
+    def scan_s_file(
+        textio: Iterable[str],
+    ) -> tuple[int, Dict[str, Symbol]]:
+        """
+        Count the instructions of an .s file and size each of its .rodata symbols
+        """
         # mwcc creates a .rodata section per rodata symbol so we need to track them individually
         rodata_entries: Dict[str, Symbol] = {}
-        c_lines: list[str] = []
         nops_needed = 0
 
         in_rodata = False
@@ -173,6 +203,16 @@ class Preprocessor:
 
             nops_needed += 1
 
+        return (nops_needed, rodata_entries)
+
+    @staticmethod
+    def emit_s_file(
+        function_name: str,
+        nops_needed: int,
+        rodata_entries: Dict[str, Symbol],
+    ) -> list[str]:
+        c_lines: list[str] = []
+
         if nops_needed > 0:
             nops = nops_needed * ["nop"]
             c_lines.extend([f"asm void {function_name}() {{", *nops, "}"])
@@ -187,17 +227,358 @@ class Preprocessor:
             elif DOLLAR_SIGN in symbol.name:
                 symbol.name = symbol.name.replace(DOLLAR_SIGN, SYMBOL_DOLLAR)
 
+            # the elements without an initializer are zeroed too, while the array
+            # stays initialized data (i.e. in .rodata rather than .bss)
+            initializer = "{0}" if symbol.size > 0 else "{}"
             c_lines.append(
-                f"{static}const unsigned char {symbol.name}[{symbol.size}] = {{"
-                + symbol.size * "0, "
-                + "};",
+                f"{static}const unsigned char {symbol.name}[{symbol.size}] = "
+                + initializer
+                + ";",
             )
 
-        return (c_lines, rodata_entries)
+        return c_lines
+
+    def scan_asm_file(
+        self,
+        asm_file: Path,
+    ) -> tuple[int, Dict[str, Symbol]]:
+        """
+        `scan_s_file` for a file on disk. Results are kept in memory, keyed by the
+        file's path, size and modification time. With a cache, they are also looked
+        up by those and then by the file's contents, so unchanged files are never
+        scanned again.
+        """
+        memo_key = file_key(asm_file)
+        if (data := _s_file_scans.get(memo_key)) is None:
+            if self.cache is None:
+                data = Preprocessor.scan_s_file_to_json(asm_file.read_bytes())
+            else:
+                path, size, mtime_ns = memo_key
+                stat_key = make_key(
+                    "s-scan-stat", package_digest(), path, str(size), str(mtime_ns)
+                )
+                if (data := self.cache.get(stat_key)) is None:
+                    asm_bytes = asm_file.read_bytes()
+                    content_key = make_key("s-scan", package_digest(), asm_bytes)
+                    if (data := self.cache.get(content_key)) is None:
+                        data = Preprocessor.scan_s_file_to_json(asm_bytes)
+                        self.cache.put(content_key, data)
+                    self.cache.put(stat_key, data)
+            _s_file_scans[memo_key] = data
+
+        nops_needed, symbols = json.loads(data)
+        return (nops_needed, {x[0]: Symbol(*x) for x in symbols})
+
+    @staticmethod
+    def scan_s_file_to_json(asm_bytes: bytes) -> bytes:
+        nops_needed, rodata_entries = Preprocessor.scan_s_file(
+            io.StringIO(asm_bytes.decode("utf-8"), newline=None)
+        )
+        return json.dumps(
+            [nops_needed, [astuple(x) for x in rodata_entries.values()]]
+        ).encode("utf-8")
+
+    @staticmethod
+    def may_define_functions(
+        lines: Iterable[str],
+        function_names: Iterable[str],
+        macros: Optional[Dict[str, str]] = None,
+    ) -> bool:
+        """
+        Conservatively scan C source for definitions of any of `function_names`.
+
+        Returns False only when none of the functions can be defined by the file
+        itself, i.e. every mention of them outside of INCLUDE_ASM/INCLUDE_RODATA is
+        either within a function body or part of a prototype. Anything the scan cannot
+        see through (token pasting, non-header includes, preprocessor directives or
+        brace scopes that could hide a definition) returns True.
+
+        `macros` are the macros defined by the headers of the file (see
+        `find_macros`). A definition whose name is a macro or is not an identifier
+        (e.g. `GLUE(func_, 801)(void) {`), or a use of a macro that could expand to a
+        definition of one of the functions, returns True.
+
+        Headers are not scanned otherwise; they are assumed not to define INCLUDE_ASM
+        functions themselves.
+        """
+        names = set(function_names)
+        if len(names) == 0:
+            return False
+
+        lines = list(lines)
+
+        # the macros of the headers and of the file itself
+        all_macros = dict(macros or {})
+        all_macros.update(Preprocessor.find_macros_in_lines(lines))
+        unsafe_macros = Preprocessor.find_unsafe_macros(all_macros, names)
+
+        def strip_comment(match: re.Match) -> str:
+            text = match.group(0)
+            return " " if text.startswith("/") else text
+
+        source = "\n".join(
+            line.rstrip()
+            for line in lines
+            if not line.startswith(INCLUDE_ASM) and not line.startswith(INCLUDE_RODATA)
+        )
+        source = source.replace("\\\n", "")
+        source = C_COMMENT_OR_LITERAL_REGEX.sub(strip_comment, source)
+
+        code_lines = []
+        for line in source.splitlines():
+            stripped = line.strip()
+            if not stripped.startswith("#"):
+                code_lines.append(line)
+                continue
+
+            directive = stripped[1:].strip()
+            if directive.startswith("include"):
+                target = directive.removeprefix("include").strip()
+                if target[:1] not in ('"', "<") or not target[1:-1].endswith(
+                    C_HEADER_SUFFIXES
+                ):
+                    # e.g. #include "foo.c" or a computed include
+                    return True
+                continue
+            if "##" in directive:
+                # token pasting can synthesise any of the function names
+                return True
+            if not names.isdisjoint(C_TOKEN_REGEX.findall(directive)):
+                return True
+
+        code = C_COMMENT_OR_LITERAL_REGEX.sub('""', "\n".join(code_lines))
+        if re.search(r'\bextern\s*""\s*\{', code) or re.search(r"\bnamespace\b", code):
+            # definitions inside linkage/namespace blocks are not at depth 0
+            return True
+
+        tokens = C_TOKEN_REGEX.findall(code)
+        depth = 0
+        i = 0
+        while i < len(tokens):
+            token = tokens[i]
+            i += 1
+            if token == "{":
+                if depth == 0 and i >= 2 and tokens[i - 2] == ")":
+                    # a function body, unless the name of the function is not a
+                    # plain identifier or is a macro
+                    parens = 0
+                    j = i - 2
+                    while j >= 0:
+                        if tokens[j] == ")":
+                            parens += 1
+                        elif tokens[j] == "(":
+                            parens -= 1
+                            if parens == 0:
+                                break
+                        j -= 1
+                    name = tokens[j - 1] if j >= 1 else ""
+                    if not (name[:1].isalpha() or name[:1] == "_"):
+                        return True
+                    if name in all_macros:
+                        return True
+                depth += 1
+            elif token == "}":
+                depth -= 1
+            elif depth == 0 and token in unsafe_macros:
+                return True
+            elif depth == 0 and token in names:
+                # only allow prototypes: name ( ... ) followed by ; or ,
+                if i >= len(tokens) or tokens[i] != "(":
+                    return True
+                parens = 0
+                while i < len(tokens):
+                    if tokens[i] == "(":
+                        parens += 1
+                    elif tokens[i] == ")":
+                        parens -= 1
+                        if parens == 0:
+                            break
+                    elif tokens[i] in ("{", "}"):
+                        return True
+                    i += 1
+                i += 1
+                if i >= len(tokens) or tokens[i] not in (";", ","):
+                    return True
+
+        return False
+
+    @staticmethod
+    def find_macros_in_lines(lines: Iterable[str]) -> Dict[str, str]:
+        """
+        The name and body of every macro #define'd in `lines`
+        """
+        macros: Dict[str, str] = {}
+        source = "".join(
+            line if line.endswith("\n") else line + "\n" for line in lines
+        ).replace("\\\n", " ")
+        for line in source.splitlines():
+            if match := C_DEFINE_REGEX.match(line):
+                body = (match.group(2) or "") + match.group(3)
+                macros[match.group(1)] = " ".join(body.split())
+        return macros
+
+    @staticmethod
+    def find_unsafe_macros(
+        macros: Dict[str, str],
+        function_names: Iterable[str],
+    ) -> set[str]:
+        """
+        The macros that could expand to a definition of one of `function_names`:
+        those that paste tokens, contain braces, mention one of the functions, or
+        use another such macro
+        """
+        names = set(function_names)
+        unsafe = set()
+        for name, body in macros.items():
+            if (
+                "##" in body
+                or "{" in body
+                or not names.isdisjoint(C_TOKEN_REGEX.findall(body))
+            ):
+                unsafe.add(name)
+
+        changed = True
+        while changed:
+            changed = False
+            for name, body in macros.items():
+                if name in unsafe:
+                    continue
+                if not unsafe.isdisjoint(C_TOKEN_REGEX.findall(body)):
+                    unsafe.add(name)
+                    changed = True
+        return unsafe
+
+    @staticmethod
+    def find_macros(
+        c_file: Path,
+        textio: Iterable[str],
+        include_dirs: list[Path],
+    ) -> Optional[Dict[str, str]]:
+        """
+        The macros #define'd by the headers that `c_file` includes (see
+        `find_includes`), or None if a quoted #include cannot be found, in which case
+        the macros cannot all be known. Headers included with <> that cannot be
+        found (e.g. those bundled with MWCC) are assumed not to matter.
+        """
+        unresolved: list[str] = []
+        includes = Preprocessor.find_includes(c_file, textio, include_dirs, unresolved)
+        if unresolved:
+            return None
+
+        macros: Dict[str, str] = {}
+        for include in includes:
+            try:
+                with include.open("r", encoding="utf-8", errors="replace") as f:
+                    macros.update(Preprocessor.find_macros_in_lines(f))
+            except OSError:
+                return None
+        return macros
+
+    def resolve_asm_file(
+        self,
+        i: int,
+        line: str,
+    ) -> Optional[Path]:
+        """
+        Return the .s file referenced by an INCLUDE_ASM/INCLUDE_RODATA line (0-indexed
+        line number `i`), or None if the line is not an include.
+        """
+        if not (line.startswith(INCLUDE_ASM) or line.startswith(INCLUDE_RODATA)):
+            return None
+
+        if line.startswith(INCLUDE_ASM):
+            macro = INCLUDE_ASM
+            regex = INCLUDE_ASM_REGEX
+        else:
+            macro = INCLUDE_RODATA
+            regex = INCLUDE_RODATA_REGEX
+
+        if not (match := re.match(regex, line)):
+            raise ValueError(
+                f"File contains invalid {macro} macro on line {i+1}: {line}"
+            )
+        try:
+            asm_dir = Path(match.group(1))
+            asm_function = match.group(2)
+        except Exception:
+            raise ValueError(
+                f"File contains invalid {macro} macro on line {i+1}: {line}"
+            ) from None
+
+        asm_file: Path = asm_dir / f"{asm_function}.s"
+        if self.asm_dir_prefix is not None:
+            asm_file = self.asm_dir_prefix / asm_file
+
+        if not asm_file.is_file():
+            raise ValueError(
+                f"File includes ASM {asm_file} that does not exist on line {i+1}: {line}"
+            )
+
+        return asm_file
+
+    def find_asm_files(
+        self,
+        textio: Iterable[str],
+    ) -> list[Path]:
+        asm_files = []
+        for i, line in enumerate(textio):
+            if (asm_file := self.resolve_asm_file(i, line.rstrip())) is not None:
+                asm_files.append(asm_file)
+        return asm_files
+
+    @staticmethod
+    def find_includes(
+        c_file: Path,
+        textio: Iterable[str],
+        include_dirs: list[Path],
+        unresolved: Optional[list[str]] = None,
+    ) -> list[Path]:
+        """
+        Recursively resolve the files #include'd by `c_file`. Quoted includes are
+        searched for relative to the including file first, then in `include_dirs`.
+        Includes that cannot be resolved (e.g. toolchain headers) are skipped, and the
+        quoted ones, as well as computed includes, are added to `unresolved` if given.
+        """
+        includes: dict[Path, None] = {}
+
+        def scan(path: Path, lines: Iterable[str]) -> None:
+            for line in lines:
+                if not (match := re.match(C_INCLUDE_REGEX, line)):
+                    if unresolved is not None and re.match(
+                        C_INCLUDE_DIRECTIVE_REGEX, line
+                    ):
+                        unresolved.append(line.strip())
+                    continue
+                delimiter, name = match.group(1), match.group(2)
+
+                search_dirs = include_dirs
+                if delimiter == '"':
+                    search_dirs = [path.parent, *include_dirs]
+
+                for search_dir in search_dirs:
+                    include = search_dir / name
+                    if include.is_file():
+                        break
+                else:
+                    if delimiter == '"' and unresolved is not None:
+                        unresolved.append(name)
+                    continue
+
+                if include in includes:
+                    continue
+                includes[include] = None
+                try:
+                    with include.open("r", encoding="utf-8", errors="replace") as f:
+                        scan(include, f.readlines())
+                except OSError:
+                    continue
+
+        scan(c_file, textio)
+        return list(includes)
 
     def preprocess_c_file(
         self,
-        textio: TextIO,
+        textio: Iterable[str],
     ) -> tuple[list[str], list[tuple[Path, int]]]:
         out_lines: list[str] = []
         asm_files: list[tuple[Path, int]] = []
@@ -205,41 +586,14 @@ class Preprocessor:
         for i, line in enumerate(textio):
             line = line.rstrip()
 
-            if line.startswith(INCLUDE_ASM) or line.startswith(INCLUDE_RODATA):
-                if line.startswith(INCLUDE_ASM):
-                    macro = INCLUDE_ASM
-                    regex = INCLUDE_ASM_REGEX
-                else:
-                    macro = INCLUDE_RODATA
-                    regex = INCLUDE_RODATA_REGEX
-
-                if not (match := re.match(regex, line)):
-                    raise ValueError(
-                        f"File contains invalid {macro} macro on line {i+1}: {line}"
-                    )
+            if (asm_file := self.resolve_asm_file(i, line)) is not None:
                 try:
-                    asm_dir = Path(match.group(1))
-                    asm_function = match.group(2)
-                except Exception:
-                    raise ValueError(
-                        f"File contains invalid {macro} macro on line {i+1}: {line}"
-                    ) from None
-
-                asm_file: Path = asm_dir / f"{asm_function}.s"
-                if self.asm_dir_prefix is not None:
-                    asm_file = self.asm_dir_prefix / asm_file
-
-                if not asm_file.is_file():
-                    raise ValueError(
-                        f"File includes ASM {asm_file} that does not exist on line {i+1}: {line}"
+                    nops_needed, rodata_entries = self.scan_asm_file(asm_file)
+                    new_lines = Preprocessor.emit_s_file(
+                        f"{FUNCTION_PREFIX}{asm_file.stem}",
+                        nops_needed,
+                        rodata_entries,
                     )
-
-                try:
-                    with asm_file.open("r", encoding="utf-8") as f:
-                        new_lines, rodata_entries = Preprocessor.preprocess_s_file(
-                            f"{FUNCTION_PREFIX}{asm_file.stem}",
-                            f,
-                        )
                 except Exception as e:
                     raise Exception(f"Failed to preprocess {asm_file}: {e}") from None
 
@@ -0,0 +1,91 @@
+"""
+Profiles of the Python side of mwccgap, excluding the time spent waiting for MWCC
+and GNU as.
+
+A profile is written as pstats (cProfile's format) unless its path ends with
+.folded or .collapsed, in which case the stacks of the main thread are sampled
+and written as collapsed stacks, as read by flamegraph.pl, inferno or speedscope.
+"""
+
+import cProfile
+import contextlib
+import signal
+import time
+
+from collections import Counter
+from pathlib import Path
+from types import FrameType
+from typing import Iterator, Optional
+
+COLLAPSED_SUFFIXES = (".folded", ".collapsed")
+
+# seconds of CPU time between samples
+SAMPLE_INTERVAL = 0.001
+
+
+class StackSampler:
+    """
+    Samples the stack of the main thread every `interval` seconds of CPU time of the
+    process, each sample weighing the CPU time (in microseconds) of the main thread
+    since the previous one: the main thread waiting for a subprocess, while other
+    threads are busy, does not count.
+    """
+
+    def __init__(self, interval: float = SAMPLE_INTERVAL):
+        self.interval = interval
+        self.stacks: Counter[str] = Counter()
+        self._last_cpu = 0.0
+
+    def _sample(self, signum: int, frame: Optional[FrameType]) -> None:
+        cpu = time.thread_time()
+        weight = round((cpu - self._last_cpu) * 1e6)
+        self._last_cpu = cpu
+        if frame is None or weight <= 0:
+            return
+
+        labels = []
+        while frame is not None:
+            code = frame.f_code
+            labels.append(f"{Path(code.co_filename).name}:{code.co_name}")
+            frame = frame.f_back
+        self.stacks[";".join(reversed(labels))] += weight
+
+    @contextlib.contextmanager
+    def sampling(self) -> Iterator[None]:
+        self._last_cpu = time.thread_time()
+        previous_handler = signal.signal(signal.SIGPROF, self._sample)
+        signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+        try:
+            yield
+        finally:
+            signal.setitimer(signal.ITIMER_PROF, 0)
+            signal.signal(signal.SIGPROF, previous_handler)
+
+    def collapsed(self) -> str:
+        return "".join(f"{stack} {weight}\n" for stack, weight in self.stacks.items())
+
+
+@contextlib.contextmanager
+def profiling(profile_path: Path) -> Iterator[None]:
+    """
+    Profile the current thread, and write the profile to `profile_path`
+    """
+    profile_path.parent.mkdir(exist_ok=True, parents=True)
+
+    if profile_path.suffix in COLLAPSED_SUFFIXES:
+        sampler = StackSampler()
+        try:
+            with sampler.sampling():
+                yield
+        finally:
+            profile_path.write_text(sampler.collapsed(), encoding="utf-8")
+        return
+
+    # CPU time of this thread rather than wall time, so that waiting does not count
+    profiler = cProfile.Profile(time.thread_time)
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        profiler.dump_stats(profile_path)
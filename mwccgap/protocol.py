@@ -0,0 +1,51 @@
+"""
+Framing used between the mwccgap daemon and its client.
+
+Every message is a frame: a 1-byte kind, a 4-byte little-endian payload length and
+the payload. This module must only depend on the standard library so that the client
+can import it without importing the rest of mwccgap.
+"""
+
+import socket
+import struct
+
+from typing import Optional
+
+FRAME_HEADER = struct.Struct("<cI")
+
+# client -> daemon: JSON encoded
+# {"prog": str, "argv": [...], "cwd": str, "env": {...}, "stdin": str | null}
+FRAME_REQUEST = b"R"
+# daemon -> client
+FRAME_STDOUT = b"O"
+FRAME_STDERR = b"E"
+FRAME_EXIT = b"X"  # payload is the exit code as a little-endian int32, always last
+
+
+def send_frame(sock: socket.socket, kind: bytes, payload: bytes) -> None:
+    sock.sendall(FRAME_HEADER.pack(kind, len(payload)) + payload)
+
+
+def recv_exactly(sock: socket.socket, size: int) -> Optional[bytes]:
+    chunks = []
+    while size > 0:
+        chunk = sock.recv(min(size, 1024 * 1024))
+        if not chunk:
+            return None
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b"".join(chunks)
+
+
+def recv_frame(sock: socket.socket) -> Optional[tuple[bytes, bytes]]:
+    """
+    Returns the next (kind, payload), or None if the connection was closed.
+    """
+    header = recv_exactly(sock, FRAME_HEADER.size)
+    if header is None:
+        return None
+    kind, size = FRAME_HEADER.unpack(header)
+    payload = recv_exactly(sock, size)
+    if payload is None:
+        return None
+    return (kind, payload)
@@ -0,0 +1,93 @@
+"""
+Bulk operations on the packed contents of .rel and .symtab sections.
+
+Relocation tables that were never decoded are rewritten as arrays of 32-bit words
+rather than as Relocation objects: with NumPy when it is installed, with the array
+module otherwise.
+"""
+
+import struct
+import sys
+
+from array import array
+from typing import Iterable, Sequence
+
+try:
+    import numpy  # type: ignore
+except ImportError:
+    numpy = None  # type: ignore
+
+# an array typecode for 32-bit unsigned words
+WORD = next(x for x in "IL" if array(x).itemsize == 4)
+
+SYMBOL = struct.Struct("<IIIBBH")
+
+
+def _to_words(data: bytes) -> array:
+    words = array(WORD)
+    words.frombytes(data)
+    if sys.byteorder == "big":
+        words.byteswap()
+    return words
+
+
+def _from_words(words: array) -> bytes:
+    if sys.byteorder == "big":
+        words.byteswap()
+    return words.tobytes()
+
+
+def renumber_relocations(tables: list[bytes], remap: Sequence[int]) -> list[bytes]:
+    """
+    Rewrite the packed Elf32_Rel entries of every table in `tables`, replacing the
+    symbol index of each entry by remap[index]
+    """
+    if numpy is not None and tables:
+        lookup = numpy.asarray(remap, dtype=numpy.uint32)
+        renumbered = []
+        for table in tables:
+            entries = numpy.frombuffer(table, dtype="<u4").copy()
+            info = entries[1::2]
+            entries[1::2] = (lookup[info >> 8] << 8) | (info & 0xFF)
+            renumbered.append(entries.tobytes())
+        return renumbered
+
+    renumbered = []
+    for table in tables:
+        words = _to_words(table)
+        words[1::2] = array(
+            WORD, [(remap[x >> 8] << 8) | (x & 0xFF) for x in words[1::2]]
+        )
+        renumbered.append(_from_words(words))
+    return renumbered
+
+
+def pack_relocations(relocations: Iterable) -> bytes:
+    """
+    Elf32_Rel entries of Relocation objects
+    """
+    words = array(WORD)
+    for relocation in relocations:
+        words.append(relocation.r_offset)
+        words.append(relocation.r_info)
+    return _from_words(words)
+
+
+def pack_symbols(symbols: Iterable) -> bytes:
+    """
+    Elf32_Sym entries of Symbol objects
+    """
+    pack = SYMBOL.pack
+    return b"".join(
+        [
+            pack(
+                x.st_name,
+                x.st_value,
+                x.st_size,
+                x.st_info,
+                x.st_other,
+                x.st_shndx,
+            )
+            for x in symbols
+        ]
+    )
@@ -0,0 +1,300 @@
+import contextlib
+import json
+import os
+import subprocess
+import tempfile
+import threading
+import time
+
+from dataclasses import asdict, dataclass, field, replace
+from pathlib import Path
+from typing import Any, Iterator, Optional
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None  # type: ignore
+
+# in the order they run
+PHASES = ("preprocess", "discovery", "compile", "assemble", "transplant", "pack")
+
+
+def children_cpu() -> float:
+    """
+    CPU time (user and system) of the subprocesses that have exited so far
+    """
+    if resource is None:
+        return 0.0
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+@dataclass
+class Timing:
+    # seconds of wall time, and of CPU time of this process
+    wall: float = 0.0
+    cpu: float = 0.0
+    # subprocesses started, the wall time from starting each one until it exits,
+    # the part of it spent creating the process (up to exec), and their CPU time
+    subprocesses: int = 0
+    subprocess_wall: float = 0.0
+    subprocess_spawn: float = 0.0
+    subprocess_cpu: float = 0.0
+    # names of the assembled functions, for assembler invocations
+    functions: list[str] = field(default_factory=list)
+
+    def add(self, other: "Timing") -> None:
+        self.wall += other.wall
+        self.cpu += other.cpu
+        self.add_subprocesses(other)
+
+    def add_subprocesses(self, other: "Timing") -> None:
+        self.subprocesses += other.subprocesses
+        self.subprocess_wall += other.subprocess_wall
+        self.subprocess_spawn += other.subprocess_spawn
+        self.subprocess_cpu += other.subprocess_cpu
+
+
+class Timings:
+    """
+    Time spent in each phase of processing a C file, and in each assembler
+    invocation, measured from the creation of this object until finish().
+
+    CPU time is that of the whole process, and the CPU time of subprocesses is
+    attributed to whatever was being timed when they exited: when phases overlap
+    (e.g. with multiple jobs), they can be attributed to each other.
+
+    Everything timed is also recorded as a span of a trace, tagged with `tu`, see
+    write_trace().
+    """
+
+    def __init__(self, tu: str = "") -> None:
+        self.phases: dict[str, Timing] = {}
+        self.assemblies: list[Timing] = []
+        self.total = Timing()
+
+        self.tu = tu
+        self.events: list[dict[str, Any]] = []
+        # from perf_counter() to the time since the epoch, which traces of
+        # concurrent processes share
+        self._epoch = time.time() - time.perf_counter()
+
+        self._lock = threading.Lock()
+        # what each thread is timing
+        self._local = threading.local()
+        self._subprocesses = Timing()
+        self._start = (time.perf_counter(), time.process_time(), children_cpu())
+
+    def _stack(self) -> list[Timing]:
+        if not hasattr(self._local, "stack"):
+            self._local.stack = []
+        return self._local.stack
+
+    def _add_event(
+        self, name: str, category: str, start: float, end: float, **args: Any
+    ) -> None:
+        # a complete event, in microseconds
+        event = {
+            "name": name,
+            "cat": category,
+            "ph": "X",
+            "ts": round((self._epoch + start) * 1e6, 3),
+            "dur": round((end - start) * 1e6, 3),
+            "pid": os.getpid(),
+            "tid": threading.get_native_id(),
+            "args": {"tu": self.tu, **args},
+        }
+        with self._lock:
+            self.events.append(event)
+
+    @contextlib.contextmanager
+    def _measure(
+        self, timing: Timing, name: str, category: str, **args: Any
+    ) -> Iterator[Timing]:
+        stack = self._stack()
+        stack.append(timing)
+        wall, cpu, child_cpu = time.perf_counter(), time.process_time(), children_cpu()
+        try:
+            yield timing
+        finally:
+            end = time.perf_counter()
+            timing.wall += end - wall
+            timing.cpu += time.process_time() - cpu
+            timing.subprocess_cpu += children_cpu() - child_cpu
+            stack.pop()
+            self._add_event(name, category, wall, end, **args)
+
+    @contextlib.contextmanager
+    def span(self, name: str, **args: Any) -> Iterator[None]:
+        """
+        A span of the trace that is not timed otherwise
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._add_event(name, "span", start, time.perf_counter(), **args)
+
+    @contextlib.contextmanager
+    def phase(self, name: str) -> Iterator[Timing]:
+        with self._measure(Timing(), name, "phase") as timing:
+            yield timing
+        with self._lock:
+            self.phases.setdefault(name, Timing()).add(timing)
+
+    @contextlib.contextmanager
+    def assembly(self, functions: list[str]) -> Iterator[Timing]:
+        """
+        An assembler invocation for `functions`, on a thread of its own
+        """
+        with self._measure(
+            Timing(functions=functions), "assemble", "assembly", functions=functions
+        ) as timing:
+            yield timing
+        with self._lock:
+            self.assemblies.append(timing)
+            # the assemble phase measures the CPU time of the subprocesses itself
+            self.phases.setdefault("assemble", Timing()).add_subprocesses(
+                replace(timing, subprocess_cpu=0.0)
+            )
+
+    def record_subprocess(
+        self, cmd: list[str], start: float, spawned: float, end: float
+    ) -> None:
+        cmd = [str(x) for x in cmd]
+        name = Path(cmd[0]).name
+        self._add_event(name, "subprocess", start, end, cmd=cmd)
+        self._add_event(f"spawn {name}", "subprocess", start, spawned)
+
+        process = Timing(
+            subprocesses=1,
+            subprocess_wall=end - start,
+            subprocess_spawn=spawned - start,
+        )
+        for timing in self._stack():
+            timing.add_subprocesses(process)
+        with self._lock:
+            self._subprocesses.add_subprocesses(process)
+
+    def finish(self) -> None:
+        wall, cpu, child_cpu = self._start
+        self.total = replace(
+            self._subprocesses,
+            wall=time.perf_counter() - wall,
+            cpu=time.process_time() - cpu,
+            subprocess_cpu=children_cpu() - child_cpu,
+        )
+
+    def to_dict(self) -> dict:
+        def timing_dict(timing: Timing) -> dict:
+            result = asdict(timing)
+            if not timing.functions:
+                del result["functions"]
+            return result
+
+        return {
+            "total": timing_dict(self.total),
+            "phases": {
+                name: timing_dict(self.phases[name])
+                for name in PHASES
+                if name in self.phases
+            },
+            "assemblies": [timing_dict(x) for x in self.assemblies],
+        }
+
+    def summary(self) -> str:
+        total = self.total
+        phases = ", ".join(
+            f"{name} {self.phases[name].wall:.3f}s"
+            for name in PHASES
+            if name in self.phases
+        )
+        return (
+            f"{total.wall:.3f}s (cpu {total.cpu:.3f}s, "
+            f"{total.subprocesses} subprocesses {total.subprocess_wall:.3f}s "
+            f"of which spawning {total.subprocess_spawn:.3f}s, "
+            f"cpu {total.subprocess_cpu:.3f}s): {phases}"
+        )
+
+    def write_trace(self, trace_file: Path) -> None:
+        """
+        Append the trace to `trace_file` in the JSON Array Format of the Trace Event
+        Format (as read by Perfetto and chrome://tracing). The format allows for the
+        closing bracket to be omitted, so every invocation of a build can append to
+        the same file, their timestamps being relative to the epoch.
+        """
+        # name the process after the translation unit
+        metadata = {
+            "name": "process_name",
+            "ph": "M",
+            "pid": os.getpid(),
+            "args": {"name": self.tu},
+        }
+        data = "".join(json.dumps(x) + ",\n" for x in [metadata, *self.events])
+
+        trace_file.parent.mkdir(exist_ok=True, parents=True)
+        if not trace_file.exists():
+            # create the file with its opening bracket atomically
+            fd, temp_name = tempfile.mkstemp(dir=trace_file.parent, prefix=".tmp")
+            try:
+                with os.fdopen(fd, "w") as f:
+                    f.write("[\n")
+                os.link(temp_name, trace_file)
+            except FileExistsError:
+                pass
+            finally:
+                os.unlink(temp_name)
+
+        # a single write where possible, so that concurrent invocations do not
+        # interleave, but os.write() may write fewer bytes than it is given
+        fd = os.open(trace_file, os.O_WRONLY | os.O_APPEND)
+        try:
+            view = memoryview(data.encode("utf-8"))
+            while view:
+                view = view[os.write(fd, view) :]
+        finally:
+            os.close(fd)
+
+
+def timed(timings: Optional[Timings], name: str):
+    """
+    Time phase `name` if `timings` is given
+    """
+    if timings is None:
+        return contextlib.nullcontext()
+    return timings.phase(name)
+
+
+def traced(timings: Optional[Timings], name: str, **args: Any):
+    """
+    Trace span `name` if `timings` is given
+    """
+    if timings is None:
+        return contextlib.nullcontext()
+    return timings.span(name, **args)
+
+
+def run_process(
+    cmd: list[str],
+    input: Optional[bytes] = None,
+    timings: Optional[Timings] = None,
+    pass_fds: tuple[int, ...] = (),
+) -> tuple[int, bytes, bytes]:
+    """
+    Run `cmd` to completion, returns its exit code, stdout and stderr
+    """
+    start = time.perf_counter()
+    with subprocess.Popen(
+        cmd,
+        stdout=subprocess.PIPE,
+        stdin=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        pass_fds=pass_fds,
+    ) as process:
+        # Popen returns once the command is exec'd
+        spawned = time.perf_counter()
+        stdout, stderr = process.communicate(input=input)
+
+    if timings is not None:
+        timings.record_subprocess(cmd, start, spawned, time.perf_counter())
+    return (process.returncode, stdout, stderr)
@@ -0,0 +1,232 @@
+import bisect
+import copy
+
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Optional
+
+from .constants import FUNCTION_PREFIX, IGNORED_RELOCATIONS
+from .elf import Elf, Relocation, RelocationRecord
+
+
+@dataclass
+class FunctionTransplant:
+    """
+    An assembled function (or .rodata symbol) and the sections of the compiled
+    object it replaces
+    """
+
+    function: str
+    assembled_elf: Elf
+    # None when the assembly only contains .rodata
+    text_section_index: Optional[int]
+    rodata_section_indices: list[int]
+    relocation_records: list[RelocationRecord]
+
+
+def plan_transplant(
+    compiled_elf: Elf,
+    c_file: Path,
+    asm_files: list[tuple[Path, int]],
+    asm_objects: list[bytes],
+    symbol_to_section_idx: dict[str, int],
+) -> list[FunctionTransplant]:
+    """
+    Match every assembled object of `asm_files` (and their number of .rodata
+    symbols) to the sections of `compiled_elf` it replaces, without modifying it
+    """
+    transplants = []
+    for (asm_file, num_rodata_symbols), asm_bytes in zip(asm_files, asm_objects):
+        function = asm_file.stem
+
+        assembled_elf = Elf(asm_bytes)
+
+        asm_functions = assembled_elf.get_functions()
+        assert (
+            len(asm_functions) == 1
+        ), f"Maximum of 1 function per ASM file (found {len(asm_functions)})"
+
+        asm_text = asm_functions[0].data
+        text_section_index: Optional[int] = None
+
+        if len(asm_text) > 0:
+            # identify the .text section for this function
+            text_section_index = compiled_elf.get_function_section_index(
+                f"{FUNCTION_PREFIX}{function}"
+            )
+            if text_section_index is None:
+                raise Exception(f"{function} not found in {c_file}")
+            text_section = compiled_elf.sections[text_section_index]
+
+            # assumption is that .rodata will immediately follow the .text section
+            rodata_section_indices = compiled_elf.get_rodata_section_indices(
+                text_section_index, num_rodata_symbols
+            )
+            assert num_rodata_symbols == len(
+                rodata_section_indices
+            ), ".rodata section count mismatch"
+
+            assert len(asm_text) >= len(
+                text_section.data
+            ), f"Not enough assembly to fill {function} in {c_file}"
+        else:
+            # this file only contains .rodata
+            assert (
+                num_rodata_symbols == 1
+            ), f"Maximum of 1 symbol per rodata ASM file (found {num_rodata_symbols})"
+            idx = symbol_to_section_idx.get(function)
+            assert (
+                idx is not None
+            ), f"Could not find .rodata section for symbol '{function}'"
+            rodata_section_indices = [idx]
+
+        if num_rodata_symbols > 0:
+            assert (
+                len(assembled_elf.rodata_sections) == 1
+            ), f"Expected ASM to contain 1 .rodata section, found {len(assembled_elf.rodata_sections)}"
+
+        relocation_records = [
+            record
+            for record in assembled_elf.get_relocations()
+            if record.name not in IGNORED_RELOCATIONS
+        ]
+        assert (
+            len(relocation_records) < 3
+        ), f"{asm_file} has too many relocation records!"
+
+        transplants.append(
+            FunctionTransplant(
+                function=function,
+                assembled_elf=assembled_elf,
+                text_section_index=text_section_index,
+                rodata_section_indices=rodata_section_indices,
+                relocation_records=relocation_records,
+            )
+        )
+
+    return transplants
+
+
+def split_relocations(
+    relocations: list[Relocation], section_ends: list[int]
+) -> list[list[Relocation]]:
+    """
+    Split `relocations` of consecutive sections ending at `section_ends`, making
+    their offsets relative to their section. Relocations past the last section
+    are dropped.
+    """
+    split: list[list[Relocation]] = [[] for _ in section_ends]
+    for relocation in relocations:
+        i = bisect.bisect_right(section_ends, relocation.r_offset)
+        if i < len(section_ends):
+            if i > 0:
+                relocation.r_offset -= section_ends[i - 1]
+            split[i].append(relocation)
+    return split
+
+
+def apply_transplant(compiled_elf: Elf, transplants: list[FunctionTransplant]) -> None:
+    """
+    Copy the text, rodata, relocations and symbols of every transplant into
+    `compiled_elf`. Symbols are staged and added in one go at the end, which
+    renumbers every relocation once.
+    """
+    rel_text_sh_name = compiled_elf.add_sh_symbol(".rel.text")
+    rel_rodata_sh_name: Optional[int] = None
+
+    for transplant in transplants:
+        assembled_elf = transplant.assembled_elf
+        text_section_index = transplant.text_section_index
+        rodata_section_indices = transplant.rodata_section_indices
+
+        if text_section_index is not None:
+            # transplant .text section data from assembled object
+            text_section = compiled_elf.sections[text_section_index]
+            text_section.data = assembled_elf.get_functions()[0].data[
+                : len(text_section.data)
+            ]
+
+        rodata_section_offsets = []
+        if len(rodata_section_indices) > 0:
+            asm_rodata = assembled_elf.rodata_sections[0]
+
+            offset = 0
+            for idx in rodata_section_indices:
+                # copy slices of rodata from ASM object into each .rodata section
+                data_len = len(compiled_elf.sections[idx].data)
+                compiled_elf.sections[idx].data = asm_rodata.data[
+                    offset : offset + data_len
+                ]
+                offset += data_len
+                rodata_section_offsets.append(offset)
+
+                # force 4-byte alignment for .rodata sections (defaults to 16-byte)
+                compiled_elf.sections[idx].sh_addralign = 2  # 1 << 2 = 4
+
+            if rel_rodata_sh_name is None:
+                rel_rodata_sh_name = compiled_elf.add_sh_symbol(".rel.rodata")
+
+        reloc_symbols = set()
+        rodata_relocation_record = None
+
+        # assumes .text relocations precede .rodata relocations
+        for i, relocation_record in enumerate(transplant.relocation_records):
+            relocation_record.sh_link = compiled_elf.symtab_index
+            if text_section_index is not None and i == 0:
+                relocation_record.sh_name = rel_text_sh_name
+                relocation_record.sh_info = text_section_index
+            else:
+                assert rel_rodata_sh_name is not None
+                relocation_record.sh_name = rel_rodata_sh_name
+                relocation_record.sh_info = rodata_section_indices[0]
+                rodata_relocation_record = relocation_record
+
+            for relocation in relocation_record.relocations:
+                symbol = assembled_elf.symtab.symbols[relocation.symbol_index]
+
+                if text_section_index is not None and i == 0:
+                    force = False
+                else:
+                    force = True
+
+                relocation.symbol_index = compiled_elf.stage_symbol(symbol, force=force)
+                reloc_symbols.add(symbol.name)
+
+                if text_section_index is not None and i == 1:
+                    # repoint .rodata reloc to .text section
+                    symbol.st_shndx = text_section_index
+
+            compiled_elf.add_section(relocation_record)
+
+        if rodata_relocation_record is not None and len(rodata_section_indices) > 1:
+            # split the rodata relocations across each .rodata section
+            for i, relocations in enumerate(
+                split_relocations(
+                    rodata_relocation_record.relocations, rodata_section_offsets
+                )
+            ):
+                if i == 0:
+                    # amend original in place
+                    new_rodata_reloc = rodata_relocation_record
+                else:
+                    # take a copy of the original
+                    new_rodata_reloc = copy.copy(rodata_relocation_record)
+
+                new_rodata_reloc.relocations = relocations
+                new_rodata_reloc.sh_info = rodata_section_indices[i]
+                if i > 0:
+                    compiled_elf.add_section(new_rodata_reloc)
+
+        for symbol in assembled_elf.symtab.symbols:
+            if symbol.st_name == 0:
+                continue
+
+            if symbol.bind == 0:
+                # ignore local symbols
+                continue
+
+            if text_section_index is not None and symbol.name not in reloc_symbols:
+                symbol.st_shndx = text_section_index
+                compiled_elf.stage_symbol(symbol)
+
+    compiled_elf.commit_symbols()
@@ -0,0 +1,207 @@
+import atexit
+import contextlib
+import os
+import shutil
+import tempfile
+import threading
+
+from pathlib import Path
+from typing import Callable, Iterator, Optional
+
+from .cache import Cache, make_key, package_digest
+from .memo import Memo
+
+# tools can be given a memfd to write to as /proc/self/fd/N
+MEMFD_AVAILABLE = hasattr(os, "memfd_create") and os.path.isdir("/proc/self/fd")
+
+
+class ToolOutput:
+    """
+    The output file of a tool at `path`: a memfd inherited by the tool as `fd`, or
+    a file that does not exist until the tool writes it
+    """
+
+    def __init__(self, path: str, fd: Optional[int] = None):
+        self.path = path
+        self.fd = fd
+
+    @property
+    def pass_fds(self) -> tuple[int, ...]:
+        return () if self.fd is None else (self.fd,)
+
+    def read(self) -> Optional[bytes]:
+        """
+        What the tool wrote, None if it did not write anything
+        """
+        if self.fd is None:
+            try:
+                return Path(self.path).read_bytes()
+            except FileNotFoundError:
+                return None
+
+        size = os.fstat(self.fd).st_size
+        return os.pread(self.fd, size, 0) if size > 0 else None
+
+
+class Workspace:
+    """
+    A directory for the scratch files of a process (C files, objects), created in
+    `root` (e.g. /dev/shm, the system's temporary directory by default) when first
+    used. Forked processes share it with their parent.
+    """
+
+    def __init__(self, root: Optional[Path] = None):
+        self.root = root
+
+        self._path: Optional[Path] = None
+        self._owner: Optional[int] = None
+        self._lock = threading.Lock()
+
+    @property
+    def path(self) -> Path:
+        with self._lock:
+            if self._path is None:
+                self._path = Path(tempfile.mkdtemp(prefix="mwccgap-", dir=self.root))
+                self._owner = os.getpid()
+            return self._path
+
+    @contextlib.contextmanager
+    def temp_file(
+        self,
+        suffix: str = "",
+        data: bytes = b"",
+        directory: Optional[Path] = None,
+    ) -> Iterator[Path]:
+        """
+        A new file containing `data` in the workspace (or in `directory`), removed
+        afterwards. Its name is the same as that of a tempfile.NamedTemporaryFile.
+        """
+        fd, name = tempfile.mkstemp(suffix=suffix, dir=directory or self.path)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            yield Path(name)
+        finally:
+            Path(name).unlink(missing_ok=True)
+
+    @contextlib.contextmanager
+    def output(self, suffix: str = "", in_memory: bool = True) -> Iterator[ToolOutput]:
+        """
+        A ToolOutput in memory if `in_memory` and memfds are available, in the
+        workspace otherwise
+        """
+        if in_memory and MEMFD_AVAILABLE:
+            fd = os.memfd_create("mwccgap" + suffix)
+            try:
+                yield ToolOutput(f"/proc/self/fd/{fd}", fd)
+            finally:
+                os.close(fd)
+            return
+
+        with self.temp_file(suffix) as path:
+            path.unlink()
+            yield ToolOutput(str(path))
+
+    def run_tool(
+        self,
+        key: tuple[str, ...],
+        run: Callable[[ToolOutput], tuple[int, bytes, bytes]],
+        suffix: str = "",
+        cache: Optional[Cache] = None,
+        in_memory: bool = True,
+    ) -> tuple[int, bytes, bytes, Optional[bytes]]:
+        """
+        Run a tool with `run`, which returns its exit code, stdout and stderr, and
+        returns those and what it wrote to the ToolOutput. The output is in memory
+        if `in_memory`, unless the tool (identified by `key`) turns out not to
+        support it: until that is known, when it fails or succeeds without writing
+        anything there, it is run again with a file and, if that succeeds, its output
+        is a file from then on. This is remembered by the process and, with a
+        `cache`, by later ones.
+
+        A tool known to support memory that fails is not run again. It cannot delete
+        its output in memory like it would a file, so that output is discarded.
+        """
+        supported = get_in_memory_support(key, cache) if in_memory else False
+        if supported is not False:
+            with self.output(suffix) as output:
+                returncode, stdout, stderr = run(output)
+                obj_bytes = output.read() if returncode == 0 else None
+            if obj_bytes is not None or supported:
+                if obj_bytes is not None and supported is None:
+                    set_in_memory_support(key, True, cache)
+                return (returncode, stdout, stderr, obj_bytes)
+
+        with self.output(suffix, in_memory=False) as output:
+            returncode, stdout, stderr = run(output)
+            obj_bytes = output.read()
+        if returncode == 0 and obj_bytes is not None and supported is None:
+            set_in_memory_support(key, False, cache)
+        return (returncode, stdout, stderr, obj_bytes)
+
+    def remove(self) -> None:
+        with self._lock:
+            if self._path is not None and self._owner == os.getpid():
+                shutil.rmtree(self._path, ignore_errors=True)
+            self._path = None
+            self._owner = None
+
+
+_workspaces: dict[Optional[Path], Workspace] = {}
+# whether each tool can write its output to memory, see Workspace.run_tool()
+_in_memory_tools = Memo("in-memory-tools")
+_workspaces_lock = threading.Lock()
+
+
+def in_memory_support_key(key: tuple[str, ...]) -> str:
+    return make_key("in-memory-output", package_digest(), *key)
+
+
+def get_in_memory_support(
+    key: tuple[str, ...],
+    cache: Optional[Cache] = None,
+) -> Optional[bool]:
+    """
+    Whether the tool identified by `key` can write its output to memory, None if
+    that is not known yet
+    """
+    if not MEMFD_AVAILABLE:
+        return False
+    if key not in _in_memory_tools and cache is not None:
+        if (data := cache.get(in_memory_support_key(key))) is not None:
+            _in_memory_tools[key] = data == b"1"
+    return _in_memory_tools.get(key)
+
+
+def set_in_memory_support(
+    key: tuple[str, ...],
+    supported: bool,
+    cache: Optional[Cache] = None,
+) -> None:
+    _in_memory_tools[key] = supported
+    if cache is not None:
+        cache.put(in_memory_support_key(key), b"1" if supported else b"0")
+
+
+def get_workspace(root: Optional[Path] = None) -> Workspace:
+    """
+    The workspace of this process in `root`
+    """
+    with _workspaces_lock:
+        if root not in _workspaces:
+            _workspaces[root] = Workspace(root)
+        return _workspaces[root]
+
+
+def remove_workspaces() -> None:
+    """
+    Remove the workspaces created by this process. This happens at exit, but not for
+    processes that exit with os._exit() (e.g. forked by the daemon or a pool).
+    """
+    with _workspaces_lock:
+        workspaces = list(_workspaces.values())
+    for workspace in workspaces:
+        workspace.remove()
+
+
+atexit.register(remove_workspaces)
@@ -0,0 +1,63 @@
+import json
+import os
+import socket
+import struct
+import sys
+
+from mwccgap.protocol import (
+    FRAME_EXIT,
+    FRAME_REQUEST,
+    FRAME_STDERR,
+    FRAME_STDOUT,
+    recv_frame,
+    send_frame,
+)
+
+
+def main() -> int:
+    """
+    Drop-in replacement for mwccgap.py that forwards the job to the daemon listening
+    on $MWCCGAP_SOCKET (see `python3 -m mwccgap.daemon`), or runs it in-process when
+    no daemon is available.
+    """
+    sock = None
+    if socket_path := os.environ.get("MWCCGAP_SOCKET"):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(socket_path)
+        except OSError:
+            sock.close()
+            sock = None
+
+    if sock is None:
+        from mwccgap.cli import main as cli_main
+
+        return cli_main()
+
+    with sock:
+        request = {
+            "prog": os.path.basename(sys.argv[0]),
+            "argv": sys.argv[1:],
+            "cwd": os.getcwd(),
+            "env": dict(os.environ),
+            "stdin": None if sys.stdin.isatty() else sys.stdin.read(),
+        }
+        send_frame(sock, FRAME_REQUEST, json.dumps(request).encode("utf-8"))
+
+        while (frame := recv_frame(sock)) is not None:
+            kind, payload = frame
+            if kind == FRAME_STDOUT:
+                sys.stdout.buffer.write(payload)
+                sys.stdout.flush()
+            elif kind == FRAME_STDERR:
+                sys.stderr.buffer.write(payload)
+                sys.stderr.flush()
+            elif kind == FRAME_EXIT:
+                return struct.unpack("<i", payload)[0]
+
+    sys.stderr.write("mwccgap daemon closed the connection\n")
+    return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,303 @@
+import stat
+import tempfile
+import unittest
+
+from pathlib import Path
+
+from mwccgap.assembler import Assembler
+from mwccgap.cache import Cache
+from mwccgap.elf import Elf
+
+STANDIN_AS = Path(__file__).resolve().parent.parent / "benchmarks" / "standin_as.py"
+
+SHT_PROGBITS = 1
+SHF_EXECINSTR = 0x4
+STT_SECTION = 3
+SHN_LORESERVE = 0xFF00
+
+# writes its stdin to the -o file and logs each invocation
+FAKE_AS = """#!/bin/sh
+while [ "$1" != "-o" ]; do shift; done
+cat > "$2"
+echo invoked >> "$(dirname "$0")/invocations"
+"""
+
+
+class AssemblerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.root = Path(self.temp_dir.name)
+
+        self.as_path = self.root / "as"
+        self.as_path.write_text(FAKE_AS)
+        self.as_path.chmod(self.as_path.stat().st_mode | stat.S_IEXEC)
+
+        self.macro_inc_path = self.root / "macro.inc"
+        self.macro_inc_path.write_text(".macro glabel label\n.endm\n")
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def invocations(self):
+        invocations = self.root / "invocations"
+        return len(invocations.read_text().splitlines()) if invocations.exists() else 0
+
+    def assembler(self, cache):
+        return Assembler(
+            as_path=str(self.as_path),
+            macro_inc_path=self.macro_inc_path,
+            cache=cache,
+        )
+
+    def write_asm_files(self, files: dict[str, str]) -> list[Path]:
+        asm_files = []
+        for name, contents in files.items():
+            asm_file = self.root / f"{name}.s"
+            asm_file.write_text(contents)
+            asm_files.append(asm_file)
+        return asm_files
+
+
+def describe_object(obj_bytes: bytes):
+    """
+    The contents, relocations and symbols of an object, independently of the order
+    of its sections and symbols
+    """
+    elf = Elf(obj_bytes)
+
+    def section_name(index: int) -> str:
+        if index == 0 or index >= SHN_LORESERVE:
+            return str(index)
+        section = elf.sections[index]
+        return ".text" if section.sh_flags & SHF_EXECINSTR else section.name or ""
+
+    symbols = elf.symtab.symbols
+
+    def symbol_name(index: int) -> str:
+        symbol = symbols[index]
+        if symbol.type == STT_SECTION:
+            return section_name(symbol.st_shndx)
+        return symbol.name
+
+    contents = {
+        section_name(i): section.data
+        for i, section in enumerate(elf.sections)
+        if section.sh_type == SHT_PROGBITS and section.data
+    }
+    relocations = {
+        section_name(record.sh_info): [
+            (x.r_offset, x.reloc_type, symbol_name(x.symbol_index))
+            for x in record.relocations
+        ]
+        for record in elf.get_relocations()
+    }
+    defined_symbols = sorted(
+        (x.name, x.bind, x.type, section_name(x.st_shndx), x.st_value)
+        for x in symbols[1:]
+        if x.type != STT_SECTION
+    )
+    return (contents, relocations, defined_symbols)
+
+
+class TestAssemblerCache(AssemblerTestCase):
+    def test_without_cache(self):
+        asm_file = self.root / "func.s"
+        asm_file.write_text("glabel func\n")
+
+        assembler = self.assembler(None)
+        self.assertEqual(
+            b".macro glabel label\n.endm\nglabel func\n",
+            assembler.assemble_file(asm_file),
+        )
+        assembler.assemble_file(asm_file)
+        self.assertEqual(2, self.invocations())
+
+    def test_shared_across_assemblers(self):
+        cache = Cache(self.root / "cache")
+        asm_file = self.root / "func.s"
+        asm_file.write_text("glabel func\n")
+
+        first = self.assembler(cache).assemble_file(asm_file)
+        second = self.assembler(cache).assemble_file(asm_file)
+
+        self.assertEqual(first, second)
+        self.assertEqual(1, self.invocations())
+
+    def test_contents_change(self):
+        cache = Cache(self.root / "cache")
+        asm_file = self.root / "func.s"
+
+        asm_file.write_text("glabel func\n")
+        self.assembler(cache).assemble_file(asm_file)
+        asm_file.write_text("glabel func2\n")
+        self.assembler(cache).assemble_file(asm_file)
+        self.assertEqual(2, self.invocations())
+
+        self.macro_inc_path.write_text(".macro dlabel label\n.endm\n")
+        self.assembler(cache).assemble_file(asm_file)
+        self.assertEqual(3, self.invocations())
+
+    def test_included_files(self):
+        cache = Cache(self.root / "cache")
+        (self.root / "data.bin").write_bytes(b"\x01")
+        (self.root / "extra.inc").write_text('.incbin "data.bin"\n')
+        asm_file = self.root / "func.s"
+        asm_file.write_text('.include "extra.inc"\nglabel func\n')
+
+        self.assembler(cache).assemble_file(asm_file)
+        self.assembler(cache).assemble_file(asm_file)
+        self.assertEqual(1, self.invocations())
+
+        # found next to macro.inc, and followed into the included file
+        (self.root / "data.bin").write_bytes(b"\x02")
+        self.assembler(cache).assemble_file(asm_file)
+        self.assertEqual(2, self.invocations())
+
+    def test_included_file_not_found(self):
+        cache = Cache(self.root / "cache")
+        asm_file = self.root / "func.s"
+        for include in ('.include "missing.inc"', ".include \\path"):
+            asm_file.write_text(f"{include}\nglabel func\n")
+
+            # never cached
+            self.assertIsNone(
+                self.assembler(cache).get_cache_key(asm_file.read_bytes())
+            )
+            self.assembler(cache).assemble_file(asm_file)
+        self.assembler(cache).assemble_file(asm_file)
+        self.assertEqual(3, self.invocations())
+
+
+class TestAssemblerBatch(AssemblerTestCase):
+    def standin_assembler(self):
+        return Assembler(as_path=str(STANDIN_AS))
+
+    def test_split_objects_match_individual_objects(self):
+        asm_files = self.write_asm_files(
+            {
+                "func_a": (
+                    "glabel func_a\n"
+                    "/* 0 0 3C040000 */ lui $a0, %hi(D_b)\n"
+                    "/* 4 4 24840000 */ addiu $a0, $a0, %lo(D_b)\n"
+                    "/* 8 8 0C000000 */ jal func_b\n"
+                    ".Lfunc_a_1:\n"
+                    "/* C C 03E00008 */ jr $ra\n"
+                    "/* 10 10 00000000 */ nop\n"
+                    ".section .rodata\n"
+                    ".align 3\n"
+                    "dlabel jtbl_a\n"
+                    ".word .Lfunc_a_1\n"
+                    ".word func_b\n"
+                ),
+                "func_b": (
+                    "glabel func_b\n"
+                    "/* 0 0 03E00008 */ jr $ra\n"
+                    "/* 4 4 00000000 */ nop\n"
+                    ".section .rodata\n"
+                    "dlabel D_b\n"
+                    ".word 0x1234\n"
+                ),
+                "func_c": "glabel func_c\n/* 0 0 03E00008 */ jr $ra\n",
+            }
+        )
+
+        assembler = self.standin_assembler()
+        self.assertIsNotNone(
+            assembler._assemble_batch([x.read_bytes() for x in asm_files])
+        )
+        batched = assembler.assemble_files(asm_files, batch=True)
+        individual = [assembler.assemble_file(x) for x in asm_files]
+
+        self.assertEqual(len(asm_files), len(batched))
+        for split_obj, obj in zip(batched, individual):
+            self.assertEqual(describe_object(obj), describe_object(split_obj))
+
+        contents, relocations, _ = describe_object(batched[0])
+        self.assertEqual({".text", ".rodata"}, set(contents))
+        self.assertIn((0, 2, ".text"), relocations[".rodata"])
+
+    def test_cross_file_local_label(self):
+        asm_files = self.write_asm_files(
+            {
+                "func_a": (
+                    "glabel func_a\n" ".Lshared:\n" "/* 0 0 03E00008 */ jr $ra\n"
+                ),
+                "func_b": (
+                    "glabel func_b\n"
+                    "/* 0 0 03E00008 */ jr $ra\n"
+                    ".section .rodata\n"
+                    "dlabel jtbl_b\n"
+                    ".word .Lshared\n"
+                ),
+            }
+        )
+
+        # the label would resolve to func_a's section, which func_b cannot refer to
+        assembler = self.standin_assembler()
+        self.assertIsNone(
+            assembler._assemble_batch([x.read_bytes() for x in asm_files])
+        )
+
+        batched = assembler.assemble_files(asm_files, batch=True)
+        individual = [assembler.assemble_file(x) for x in asm_files]
+        self.assertEqual(individual, batched)
+
+    def test_batch_falls_back_to_individual_files(self):
+        asm_files = []
+        for name in ("func_a", "func_b"):
+            asm_file = self.root / f"{name}.s"
+            asm_file.write_text(f"glabel {name}\n")
+            asm_files.append(asm_file)
+
+        # the fake assembler does not produce an ELF, so the batch cannot be split
+        objects = self.assembler(None).assemble_files(asm_files, batch=True)
+
+        self.assertEqual(
+            [
+                b".macro glabel label\n.endm\nglabel func_a\n",
+                b".macro glabel label\n.endm\nglabel func_b\n",
+            ],
+            objects,
+        )
+        self.assertEqual(3, self.invocations())
+
+    def test_unbatchable_file(self):
+        asm_files = []
+        for name in ("func_a", "func_b"):
+            asm_file = self.root / f"{name}.s"
+            asm_file.write_text(f".set FOO, 1\nglabel {name}\n")
+            asm_files.append(asm_file)
+
+        self.assembler(None).assemble_files(asm_files, batch=True)
+        self.assertEqual(2, self.invocations())
+
+
+class TestAssemblerJobs(AssemblerTestCase):
+    def test_objects_keep_their_order(self):
+        asm_files = []
+        for i in range(8):
+            asm_file = self.root / f"func_{i}.s"
+            asm_file.write_text(f"glabel func_{i}\n")
+            asm_files.append(asm_file)
+
+        objects = self.assembler(None).assemble_files(asm_files, batch=False, jobs=4)
+
+        self.assertEqual(
+            [
+                f".macro glabel label\n.endm\nglabel func_{i}\n".encode()
+                for i in range(8)
+            ],
+            objects,
+        )
+        self.assertEqual(8, self.invocations())
+
+    def test_batch_is_split_into_chunks(self):
+        asm_files = []
+        for i in range(4):
+            asm_file = self.root / f"func_{i}.s"
+            asm_file.write_text(f"glabel func_{i}\n")
+            asm_files.append(asm_file)
+
+        # 2 failed batches followed by 4 individual invocations
+        self.assembler(None).assemble_files(asm_files, batch=True, jobs=2)
+        self.assertEqual(6, self.invocations())
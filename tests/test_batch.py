@@ -0,0 +1,108 @@
+import contextlib
+import io
+import json
+import tempfile
+import unittest
+
+from pathlib import Path
+
+from mwccgap.batch import load_manifest, run_batch
+
+
+class TestLoadManifest(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.root = Path(self.temp_dir.name)
+        self.manifest = self.root / "manifest.json"
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_jobs(self):
+        self.manifest.write_text(
+            json.dumps(
+                [
+                    {"c_file": "a.c", "o_file": "a.o"},
+                    {
+                        "c_file": "b.c",
+                        "o_file": "b.o",
+                        "flags": ["-O4"],
+                        "directory": "src",
+                    },
+                ]
+            )
+        )
+
+        jobs = load_manifest(self.manifest, ["--as-march", "allegrex"])
+
+        self.assertEqual(["a.c", "a.o", "--as-march", "allegrex"], jobs[0].argv)
+        self.assertEqual(self.root, jobs[0].directory)
+        self.assertEqual(str(self.root / "a.o"), jobs[0].name)
+        self.assertEqual(["b.c", "b.o", "-O4", "--as-march", "allegrex"], jobs[1].argv)
+        self.assertEqual(self.root / "src", jobs[1].directory)
+
+    def test_compile_commands(self):
+        self.manifest.write_text(
+            json.dumps(
+                [
+                    {
+                        "directory": "/build",
+                        "arguments": ["python3", "tools/mwccgap.py", "a.c", "a.o"],
+                        "file": "a.c",
+                        "output": "a.o",
+                    },
+                    {
+                        "directory": "/build",
+                        "command": "tools/mwccgap.py 'b c.c' b.o -O4",
+                        "file": "b c.c",
+                    },
+                ]
+            )
+        )
+
+        jobs = load_manifest(self.manifest)
+
+        self.assertEqual(["a.c", "a.o"], jobs[0].argv)
+        self.assertEqual(Path("/build"), jobs[0].directory)
+        self.assertEqual("/build/a.o", jobs[0].name)
+        self.assertEqual(["b c.c", "b.o", "-O4"], jobs[1].argv)
+        self.assertEqual("/build/b c.c", jobs[1].name)
+
+    def test_not_mwccgap(self):
+        self.manifest.write_text(
+            json.dumps([{"directory": "/build", "arguments": ["gcc", "a.c"]}])
+        )
+        with self.assertRaises(ValueError):
+            load_manifest(self.manifest)
+
+
+class TestRunBatch(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.root = Path(self.temp_dir.name)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_failures_are_reported(self):
+        manifest = self.root / "manifest.json"
+        manifest.write_text(
+            json.dumps(
+                [
+                    {"c_file": "missing_a.c", "o_file": "a.o"},
+                    {"c_file": "missing_b.c", "o_file": "b.o"},
+                ]
+            )
+        )
+        durations = self.root / "durations.json"
+
+        stderr = io.StringIO()
+        with contextlib.redirect_stderr(stderr):
+            exit_code = run_batch(load_manifest(manifest), 2, durations)
+
+        self.assertEqual(1, exit_code)
+        self.assertIn("Exception processing missing_a.c", stderr.getvalue())
+        self.assertIn("Exception processing missing_b.c", stderr.getvalue())
+        self.assertIn("2 of 2 jobs failed", stderr.getvalue())
+        # only successful jobs are timed
+        self.assertEqual({}, json.loads(durations.read_text()))
@@ -0,0 +1,82 @@
+import os
+import tempfile
+import unittest
+
+from pathlib import Path
+
+from mwccgap.cache import Cache, SHARD_COUNT, make_key
+
+
+class TestMakeKey(unittest.TestCase):
+    def test_deterministic(self):
+        self.assertEqual(make_key("a", b"b", None), make_key("a", b"b", None))
+
+    def test_part_boundaries(self):
+        self.assertNotEqual(make_key("ab", "c"), make_key("a", "bc"))
+
+    def test_part_types(self):
+        self.assertNotEqual(make_key("a"), make_key(b"a"))
+        self.assertNotEqual(make_key(None), make_key(""))
+
+
+class TestCache(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.cache_dir = Path(self.temp_dir.name)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_miss(self):
+        cache = Cache(self.cache_dir)
+        self.assertIsNone(cache.get(make_key("missing")))
+
+    def test_roundtrip(self):
+        cache = Cache(self.cache_dir)
+        key = make_key("object")
+        cache.put(key, b"\x7fELF")
+        self.assertEqual(b"\x7fELF", cache.get(key))
+
+    def test_no_temp_files_left_behind(self):
+        cache = Cache(self.cache_dir)
+        key = make_key("object")
+        cache.put(key, b"\x7fELF")
+        self.assertEqual([key[2:]], os.listdir(self.cache_dir / key[:2]))
+
+    def test_evicts_least_recently_used(self):
+        cache = Cache(self.cache_dir, max_size=10)
+        # keys that land in different shards, the bound is for the whole cache
+        keys = [str(i) * 64 for i in range(3)]
+
+        cache.put(keys[0], bytes(4))
+        cache.put(keys[1], bytes(4))
+        # make keys[0] the most recently used entry
+        os.utime(self.cache_dir / "11" / keys[1][2:], ns=(0, 0))
+        cache.get(keys[0])
+
+        cache.put(keys[2], bytes(4))
+
+        self.assertIsNotNone(cache.get(keys[0]))
+        self.assertIsNone(cache.get(keys[1]))
+        self.assertIsNotNone(cache.get(keys[2]))
+
+    def test_large_entry(self):
+        cache = Cache(self.cache_dir, max_size=SHARD_COUNT * 1024)
+        # larger than max_size / SHARD_COUNT, in a shard with another entry
+        keys = ["00" + str(i) * 62 for i in range(2)]
+
+        cache.put(keys[0], bytes(16))
+        cache.put(keys[1], bytes(64 * 1024))
+
+        self.assertEqual(bytes(16), cache.get(keys[0]))
+        self.assertEqual(bytes(64 * 1024), cache.get(keys[1]))
+
+    def test_size_of_existing_entries(self):
+        Cache(self.cache_dir).put("0" * 64, bytes(8))
+        os.utime(self.cache_dir / "00" / ("0" * 62), ns=(0, 0))
+
+        # a new instance (e.g. a later invocation) counts what is already there
+        cache = Cache(self.cache_dir, max_size=12)
+        cache.put("1" * 64, bytes(8))
+        self.assertIsNone(cache.get("0" * 64))
+        self.assertIsNotNone(cache.get("1" * 64))
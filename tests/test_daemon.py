@@ -0,0 +1,111 @@
+import json
+import os
+import socket
+import struct
+import tempfile
+import threading
+import time
+import unittest
+
+from pathlib import Path
+
+from benchmarks.generate import generate
+from benchmarks.pipeline import STANDIN_AS, STANDIN_MWCC
+from mwccgap import memo
+from mwccgap.cache import _tool_digests
+from mwccgap.daemon import RequestHandler, Server
+from mwccgap.preprocessor import _s_file_scans
+from mwccgap.protocol import (
+    FRAME_EXIT,
+    FRAME_REQUEST,
+    FRAME_STDERR,
+    FRAME_STDOUT,
+    recv_frame,
+    send_frame,
+)
+
+
+class TestDaemon(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.root = Path(self.temp_dir.name)
+        self.socket_path = self.root / "mwccgap.sock"
+
+        self.server = Server(str(self.socket_path), RequestHandler)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+        self.temp_dir.cleanup()
+
+    def request(self, argv):
+        frames: dict[bytes, bytes] = {FRAME_STDOUT: b"", FRAME_STDERR: b""}
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.connect(str(self.socket_path))
+            request = {
+                "prog": "mwccgap.py",
+                "argv": argv,
+                "cwd": str(self.root),
+                "env": dict(os.environ),
+                "stdin": None,
+            }
+            send_frame(sock, FRAME_REQUEST, json.dumps(request).encode("utf-8"))
+            while (frame := recv_frame(sock)) is not None:
+                kind, payload = frame
+                frames[kind] = frames.get(kind, b"") + payload
+        return frames
+
+    def test_help(self):
+        frames = self.request(["--help"])
+        self.assertTrue(frames[FRAME_STDOUT].startswith(b"usage: mwccgap.py"))
+        self.assertEqual(0, struct.unpack("<i", frames[FRAME_EXIT])[0])
+
+    def test_failure_is_reported(self):
+        # relative to the forwarded working directory
+        (self.root / "missing.o").write_bytes(b"stale")
+
+        frames = self.request(["missing.c", "missing.o"])
+
+        self.assertIn(b"Exception processing missing.c", frames[FRAME_STDERR])
+        self.assertEqual(1, struct.unpack("<i", frames[FRAME_EXIT])[0])
+        self.assertFalse((self.root / "missing.o").exists())
+
+    def test_memos_are_kept(self):
+        c_file = generate(self.root / "tu", functions=2, rodata_files=0, instructions=8)
+        for name in memo._memos:
+            memo._memos[name].clear()
+
+        frames = self.request(
+            [
+                str(c_file),
+                str(self.root / "tu.o"),
+                "--mwcc-path",
+                str(STANDIN_MWCC),
+                "--as-path",
+                str(STANDIN_AS),
+                "--asm-dir-prefix",
+                str(c_file.parent),
+                "--cache-dir",
+                str(self.root / "cache"),
+            ]
+        )
+        self.assertEqual(0, struct.unpack("<i", frames[FRAME_EXIT])[0])
+
+        # merged by the server, here the test process, for the next jobs to inherit
+        deadline = time.monotonic() + 5
+        while not _s_file_scans and time.monotonic() < deadline:
+            time.sleep(0.05)
+        self.assertEqual(2, len(_s_file_scans))
+        self.assertIn(str(STANDIN_MWCC.resolve()), [x[0] for x in _tool_digests])
+
+    def test_max_jobs(self):
+        # not limited to ForkingMixIn's default of 40 jobs unless asked to
+        self.assertGreater(self.server.max_children, 40)
+
+        with Server(
+            str(self.root / "limited.sock"), RequestHandler, max_jobs=4
+        ) as server:
+            self.assertEqual(4, server.max_children)
@@ -0,0 +1,271 @@
+import struct
+import unittest
+
+from random import Random
+
+from mwccgap.elf import Elf, Relocation, Section, Strtab, Symbol
+
+SHSTRTAB = b"\x00.text\x00.rel.text\x00.symtab\x00.strtab\x00.shstrtab\x00"
+STRTAB = b"\x00func\x00ext\x00"
+
+
+def sh_name(name: str) -> int:
+    return SHSTRTAB.index(name.encode("utf-8") + b"\x00")
+
+
+def build_elf() -> bytes:
+    """
+    A relocatable object, laid out the way Elf.pack lays them out, defining `func`
+    (8 bytes of .text) with a R_MIPS_26 relocation against the undefined `ext`
+    """
+    symbols = [
+        (0, 0, 0, 0, 0, 0),
+        (0, 0, 0, 0x03, 0, 1),  # .text section symbol
+        (STRTAB.index(b"func"), 0, 8, 0x12, 0, 1),
+        (STRTAB.index(b"ext"), 0, 0, 0x10, 0, 0),
+    ]
+
+    # (sh_name, sh_type, sh_flags, sh_link, sh_info, sh_addralign, sh_entsize, data)
+    sections = [
+        (0, 0, 0, 0, 0, 0, 0, b""),
+        (sh_name(".text"), 1, 0x6, 0, 0, 2, 0, bytes(range(8))),
+        (sh_name(".rel.text"), 9, 0, 3, 1, 2, 8, struct.pack("<II", 0, 3 << 8 | 4)),
+        (
+            sh_name(".symtab"),
+            2,
+            0,
+            4,
+            2,
+            2,
+            16,
+            b"".join(struct.pack(Symbol.fmt, *x) for x in symbols),
+        ),
+        (sh_name(".strtab"), 3, 0, 0, 0, 0, 0, STRTAB),
+        (sh_name(".shstrtab"), 3, 0, 0, 0, 0, 0, SHSTRTAB),
+    ]
+
+    body = b""
+    headers = b""
+    offset = 0x40
+    for name, sh_type, flags, link, info, align, entsize, data in sections:
+        headers += struct.pack(
+            "<IIIIIIIIII",
+            name,
+            sh_type,
+            flags,
+            0,
+            offset,
+            len(data),
+            link,
+            info,
+            align,
+            entsize,
+        )
+        body += data
+        offset += len(data)
+        if offset % (1 << align):
+            padding = (1 << align) - offset % (1 << align)
+            body += bytes(padding)
+            offset += padding
+    if offset % 4:
+        body += bytes(4 - offset % 4)
+        offset += 4 - offset % 4
+
+    header = struct.pack(
+        Elf.fmt,
+        b"\x7fELF\x01\x01\x01".ljust(16, b"\x00"),
+        1,  # ET_REL
+        8,  # EM_MIPS
+        1,
+        0,
+        0,
+        offset,
+        0,
+        0x34,
+        0,
+        0,
+        0x28,
+        len(sections),
+        len(sections) - 1,
+    )
+    return header + bytes(0xC) + body + headers
+
+
+class TestElf(unittest.TestCase):
+    def test_roundtrip(self):
+        data = build_elf()
+        self.assertEqual(data, Elf(data).pack())
+
+    def test_contents(self):
+        elf = Elf(build_elf())
+
+        self.assertEqual(["func"], [x.function_name for x in elf.get_functions()])
+        self.assertEqual(bytes(range(8)), elf.get_functions()[0].data)
+        self.assertEqual(["", "", "func", "ext"], [x.name for x in elf.symtab.symbols])
+
+        relocations = elf.get_relocations()[0].relocations
+        self.assertEqual(
+            [(0, 3, 4)],
+            [(x.r_offset, x.symbol_index, x.reloc_type) for x in relocations],
+        )
+        self.assertEqual("ext", relocations[0].symbol)
+
+    def test_decoded_on_access(self):
+        elf = Elf(build_elf())
+        self.assertEqual(["func"], [x.function_name for x in elf.get_functions()])
+
+        self.assertIsNone(elf.symtab._symbols)
+        self.assertIsNone(elf.get_relocations()[0]._relocations)
+
+    def test_section_index(self):
+        elf = Elf(build_elf())
+
+        self.assertEqual(1, elf.get_function_section_index("func"))
+        self.assertIsNone(elf.get_function_section_index("ext"))
+        self.assertEqual([], elf.get_rodata_section_indices(1, 1))
+
+        rodata = Section(0, 1, 0x2, 0, 0, 0, 0, 0, 2, 0, b"")
+        rodata.name = ".rodata"
+        index = elf.add_section(rodata)
+
+        self.assertEqual([index], elf.get_rodata_section_indices(1, 2))
+        self.assertEqual([], elf.get_rodata_section_indices(index, 1))
+
+    def test_add_symbol_before_access(self):
+        elf = Elf(build_elf())
+
+        symbol = Symbol(0, 0, 0, 0x10, 0, 0)
+        symbol.name = "new"
+        index = elf.add_symbol(symbol)
+
+        repacked = Elf(elf.pack())
+        self.assertEqual(STRTAB + b"new\x00", repacked.strtab.data)
+        self.assertEqual("new", repacked.symtab.symbols[index].name)
+
+
+class TestCompactFields(unittest.TestCase):
+    def test_relocation(self):
+        relocation = Relocation(0x10, 3 << 8 | 4)
+        self.assertEqual((3, 4), (relocation.symbol_index, relocation.reloc_type))
+
+        relocation.symbol_index = 0x1234
+        self.assertEqual(0x1234 << 8 | 4, relocation.r_info)
+        self.assertEqual(struct.pack("<II", 0x10, 0x1234 << 8 | 4), relocation.pack())
+
+    def test_symbol(self):
+        symbol = Symbol(0, 0, 0, 0x12, 0, 1)
+        self.assertEqual((1, 2), (symbol.bind, symbol.type))
+
+        symbol.bind = 0
+        self.assertEqual(0x02, symbol.st_info)
+        with self.assertRaises(AttributeError):
+            symbol.unknown = 1  # type: ignore
+
+
+def make_symbol(name: str, bind: int) -> Symbol:
+    symbol = Symbol(0, 0, 0, bind << 4, 0, 1)
+    symbol.name = name
+    return symbol
+
+
+class TestSymtab(unittest.TestCase):
+    def test_get_symbol_by_name(self):
+        elf = Elf(build_elf())
+
+        self.assertEqual(3, elf.symtab.get_symbol_by_name("ext")[0])
+        self.assertEqual(0, elf.symtab.get_symbol_by_name("")[0])
+        self.assertEqual((None, None), elf.symtab.get_symbol_by_name("missing"))
+
+        # a local precedes every global of the same name
+        elf.add_symbol(make_symbol("ext", 0), force=True)
+        self.assertEqual(2, elf.symtab.get_symbol_by_name("ext")[0])
+        self.assertEqual(3, elf.symtab.get_symbol_by_name("func")[0])
+
+    def test_commit_matches_add(self):
+        symbols = [("a", 0, False), ("ext", 1, False), ("b", 1, False), ("a", 0, True)]
+        symbols += [("ext", 0, True), ("ext", 1, False), ("c", 0, False)]
+
+        added = Elf(build_elf())
+        indices = [
+            added.add_symbol(make_symbol(name, bind), force=force)
+            for name, bind, force in symbols
+        ]
+
+        staged = Elf(build_elf())
+        provisional = [
+            staged.stage_symbol(make_symbol(name, bind), force=force)
+            for name, bind, force in symbols
+        ]
+        # the staged symbols are found by name before being committed
+        self.assertEqual(provisional[0], staged.symtab.get_symbol_by_name("a")[0])
+        remap = staged.commit_symbols()
+
+        # names resolve as if the symbols had been added one at a time
+        self.assertEqual(
+            [added.symtab.get_symbol_by_name(name)[0] for name, _, _ in symbols],
+            [staged.symtab.get_symbol_by_name(name)[0] for name, _, _ in symbols],
+        )
+        self.assertEqual(added.symtab.sh_info, staged.symtab.sh_info)
+        self.assertEqual("c", staged.symtab.symbols[remap[provisional[-1]]].name)
+        self.assertEqual(indices[-1], remap[provisional[-1]])
+
+        # including the existing relocation against `ext`
+        self.assertEqual(
+            "ext",
+            staged.symtab.symbols[
+                staged.get_relocations()[0].relocations[0].symbol_index
+            ].name,
+        )
+        self.assertEqual(added.symtab.pack_data(), staged.symtab.pack_data())
+        self.assertEqual(added.strtab.pack_data(), staged.strtab.pack_data())
+
+
+class TestStrtab(unittest.TestCase):
+    def strtab(self, data: bytes) -> Strtab:
+        return Strtab(0, 3, 0, 0, 0, len(data), 0, 0, 0, 0, data)
+
+    def test_shares_tails(self):
+        strtab = self.strtab(b"\x00mwccgap_func_00000004\x00func_00000004\x00")
+
+        self.assertEqual(len("\x00mwccgap_"), strtab.add_symbol("func_00000004"))
+        self.assertEqual(len("\x00mwccgap_func_"), strtab.add_symbol("00000004"))
+        self.assertEqual(len("\x00mwccgap_func_0000000"), strtab.add_symbol("4"))
+        self.assertEqual(0, strtab.add_symbol(""))
+
+    def test_matches_search(self):
+        random = Random(0)
+        data = bytearray(b"\x00")
+        strtab = self.strtab(bytes(data))
+        for _ in range(2000):
+            name = "".join(random.choices("ab_", k=random.randint(0, 12)))
+
+            expected = data.find(name.encode("utf-8") + b"\x00")
+            if expected == -1:
+                expected = len(data)
+                data += name.encode("utf-8") + b"\x00"
+
+            self.assertEqual(expected, strtab.add_symbol(name))
+        self.assertEqual(bytes(data), strtab.pack_data())
+
+    def test_many_short_names(self):
+        strtab = self.strtab(
+            b"\x00" + b"".join(f"func_{i:08X}\x00".encode() for i in range(50000))
+        )
+
+        end = len(strtab.data)
+        offsets = [strtab.add_symbol(f"@{i}") for i in range(50000)]
+
+        expected = []
+        for i in range(50000):
+            expected.append(end)
+            end += len(f"@{i}") + 1
+        self.assertEqual(expected, offsets)
+        self.assertEqual(offsets, [strtab.add_symbol(f"@{i}") for i in range(50000)])
+        self.assertEqual(len("\x00func_0000000"), strtab.add_symbol("0"))
+
+    def test_trailing_bytes(self):
+        strtab = self.strtab(b"\x00foo\x00bar")
+
+        self.assertEqual(b"\x00foo\x00", strtab.pack_data())
+        # the header matches the packed data
+        self.assertEqual(5, Section.unpack_header(strtab.pack_header())[5])
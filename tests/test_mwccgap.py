@@ -1,7 +1,9 @@
+import tempfile
 import unittest
 
+from pathlib import Path
 
-from mwccgap.mwccgap import replace_sinit
+from mwccgap.mwccgap import replace_sinit, write_depfile
 
 
 class TestSinitSymbolNames(unittest.TestCase):
@@ -40,3 +42,26 @@ class TestSinitSymbolNames(unittest.TestCase):
 
         result = replace_sinit(symbol_name, temp_f_name, c_file_name)
         self.assertEqual(expect_name, result)
+
+
+class TestDepfile(unittest.TestCase):
+    def test_write_depfile(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            depfile = Path(temp_dir) / "build" / "foo.o.d"
+            write_depfile(
+                depfile,
+                "build/foo.o",
+                [
+                    Path("src/foo.c"),
+                    Path("asm/func $1.s"),
+                    Path("asm/#func.s"),
+                    Path("src/foo.c"),
+                ],
+            )
+            self.assertEqual(
+                "build/foo.o: \\\n"
+                "  src/foo.c \\\n"
+                "  asm/func\\ $$1.s \\\n"
+                "  asm/\\#func.s\n",
+                depfile.read_text(),
+            )
@@ -0,0 +1,231 @@
+import io
+import json
+import tempfile
+import unittest
+
+from pathlib import Path
+
+from benchmarks.generate import generate
+from benchmarks.pipeline import STANDIN_AS, STANDIN_MWCC, object_digest
+from mwccgap.cli import main
+from mwccgap.elf import Elf
+
+
+class TestPipeline(unittest.TestCase):
+    """
+    mwccgap end to end, with the stand-ins for MWCC and GNU as
+    """
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.root = Path(self.temp_dir.name)
+        self.c_file = generate(
+            self.root, functions=3, c_functions=1, rodata_files=1, instructions=16
+        )
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def run_mwccgap(self, o_file: Path, *args: str) -> Path:
+        argv = [
+            str(self.c_file),
+            str(o_file),
+            "--mwcc-path",
+            str(STANDIN_MWCC),
+            "--as-path",
+            str(STANDIN_AS),
+            "--asm-dir-prefix",
+            str(self.root),
+            "--macro-inc-path",
+            str(self.root / "include" / "macro.inc"),
+            *args,
+            f"-I{self.root / 'include'}",
+        ]
+        self.assertEqual(0, main(argv, io.StringIO(), prog="mwccgap.py"))
+        return o_file
+
+    def test_transplant(self):
+        elf = Elf(self.run_mwccgap(self.root / "tu.o").read_bytes())
+
+        functions = elf.get_functions()
+        self.assertEqual(
+            ["func_00000000", "c_func_0", "func_00000001", "func_00000002"],
+            [x.function_name for x in functions],
+        )
+        # the assembled code replaced the nops
+        self.assertTrue(
+            all(any(x.data) for x in functions if x.function_name[0] == "f")
+        )
+
+    def cached_phases(self, *args: str, stdin: str = "") -> list[str]:
+        """
+        Run mwccgap with a cache, returning its phases (none on a cache hit)
+        """
+        timings_file = self.root / "timings.json"
+        timings_file.unlink(missing_ok=True)
+        argv = [
+            *([] if stdin else [str(self.c_file)]),
+            str(self.root / "tu.o"),
+            "--mwcc-path",
+            str(STANDIN_MWCC),
+            "--as-path",
+            str(STANDIN_AS),
+            "--asm-dir-prefix",
+            str(self.root),
+            "--cache-dir",
+            str(self.root / "cache"),
+            "--timings-file",
+            str(timings_file),
+            *args,
+            f"-I{self.root / 'include'}",
+        ]
+        self.assertEqual(0, main(argv, io.StringIO(stdin), prog="mwccgap.py"))
+        return list(json.loads(timings_file.read_text())["phases"])
+
+    def test_cache(self):
+        self.assertIn("compile", self.cached_phases())
+        self.assertEqual([], self.cached_phases())
+
+        # keyed the same whatever the name of the copy of stdin
+        stdin = self.c_file.read_text()
+        self.assertIn("compile", self.cached_phases(stdin=stdin))
+        self.assertEqual([], self.cached_phases(stdin=stdin))
+
+    def test_cache_recursive_include_dir(self):
+        (self.root / "include" / "sub").mkdir()
+        header = self.root / "include" / "sub" / "x.h"
+        header.write_text("#define X 1\n")
+        with self.c_file.open("a") as f:
+            f.write('#include "x.h"\n')
+
+        args = ("-ir", str(self.root / "include"))
+        self.assertIn("compile", self.cached_phases(*args))
+        self.assertEqual([], self.cached_phases(*args))
+        header.write_text("#define X 2\n")
+        self.assertIn("compile", self.cached_phases(*args))
+
+    def test_cache_prefix_file(self):
+        prefix = self.root / "prefix.h"
+        prefix.write_text("#define X 1\n")
+
+        args = ("-prefix", str(prefix))
+        self.assertIn("compile", self.cached_phases(*args))
+        self.assertEqual([], self.cached_phases(*args))
+        prefix.write_text("#define X 2\n")
+        self.assertIn("compile", self.cached_phases(*args))
+
+    def test_cache_asm_include(self):
+        included = self.root / "include" / "extra.inc"
+        included.write_text("")
+        asm_file = next((self.root / "asm").glob("**/func_00000001.s"))
+        asm_file.write_text(f'.include "extra.inc"\n{asm_file.read_text()}')
+
+        args = ("--macro-inc-path", str(self.root / "include" / "macro.inc"))
+        self.assertIn("compile", self.cached_phases(*args))
+        self.assertEqual([], self.cached_phases(*args))
+        included.write_text("/* changed */\n")
+        self.assertIn("compile", self.cached_phases(*args))
+
+    def test_scan_macros(self):
+        with self.c_file.open("a") as f:
+            f.write("void foo(void) {}\n")
+        self.assertNotIn("discovery", self.cached_phases("--discovery", "scan"))
+
+        # foo is func_00000001 in disguise, so the scan cannot rule it out
+        define = "-Dfoo=func_00000001"
+        self.assertIn("discovery", self.cached_phases("--discovery", "scan", define))
+
+        prefix = self.root / "prefix.h"
+        prefix.write_text("#define foo func_00000001\n")
+        self.assertIn(
+            "discovery",
+            self.cached_phases("--discovery", "scan", "-prefix", str(prefix)),
+        )
+
+    def test_cache_unknown_headers(self):
+        for include in ('#include "missing.h"', "#include HEADER"):
+            self.c_file.write_text(f"{include}\n{self.c_file.read_text()}")
+
+            # the header could change without the cache knowing
+            self.assertIn("compile", self.cached_phases())
+            self.assertIn("compile", self.cached_phases())
+
+            self.c_file.write_text(self.c_file.read_text().split("\n", 1)[1])
+
+    def test_batch_assembly(self):
+        self.assertEqual(
+            object_digest(self.run_mwccgap(self.root / "a.o")),
+            object_digest(self.run_mwccgap(self.root / "b.o", "--batch-assembly")),
+        )
+
+    def test_timings(self):
+        timings_file = self.root / "timings.jsonl"
+        self.run_mwccgap(self.root / "tu.o", "--timings-file", str(timings_file))
+        self.run_mwccgap(self.root / "tu.o", "--timings-file", str(timings_file))
+
+        reports = [json.loads(x) for x in timings_file.read_text().splitlines()]
+        self.assertEqual(2, len(reports))
+
+        report = reports[0]
+        self.assertEqual(
+            ["preprocess", "discovery", "compile", "assemble", "transplant", "pack"],
+            list(report["phases"]),
+        )
+        # discovery, compile and one assembler per file (the .rodata file included)
+        self.assertEqual(6, report["total"]["subprocesses"])
+        self.assertEqual(4, report["phases"]["assemble"]["subprocesses"])
+        self.assertEqual(
+            ["D_rodata_00000000", "func_00000000", "func_00000001", "func_00000002"],
+            sorted(x["functions"][0] for x in report["assemblies"]),
+        )
+
+    def test_workspace(self):
+        workspace_root = self.root / "workspace"
+        workspace_root.mkdir()
+        self.assertEqual(
+            object_digest(self.run_mwccgap(self.root / "a.o")),
+            object_digest(
+                self.run_mwccgap(
+                    self.root / "b.o",
+                    "--workspace-dir",
+                    str(workspace_root),
+                    "--c-copies",
+                    "workspace",
+                )
+            ),
+        )
+
+        # every scratch file was in a single directory, and is gone
+        (workspace,) = workspace_root.iterdir()
+        self.assertEqual([], list(workspace.iterdir()))
+        self.assertEqual(
+            ["a.o", "asm", "b.o", "include", "tu.c", "workspace"],
+            sorted(x.name for x in self.root.iterdir()),
+        )
+
+    def test_speculative_discovery(self):
+        # not a header, so the scan cannot rule out definitions and the modified
+        # C file is compiled while the original is
+        with self.c_file.open("a") as f:
+            f.write('#include "extra.c"\n')
+
+        for args in ([], ["--jobs", "2"]):
+            self.assertEqual(
+                object_digest(self.run_mwccgap(self.root / "a.o", *args)),
+                object_digest(
+                    self.run_mwccgap(
+                        self.root / "b.o", "--discovery", "speculative", *args
+                    )
+                ),
+            )
+
+    def test_speculative_discovery_defined_in_c(self):
+        with self.c_file.open("a") as f:
+            f.write("void func_00000001(void) {}\n")
+
+        self.assertEqual(
+            object_digest(self.run_mwccgap(self.root / "a.o")),
+            object_digest(
+                self.run_mwccgap(self.root / "b.o", "--discovery", "speculative")
+            ),
+        )
@@ -1,6 +1,9 @@
+import tempfile
 import unittest
 
+from pathlib import Path
 
+from mwccgap.cache import Cache
 from mwccgap.preprocessor import Preprocessor
 
 
@@ -74,6 +77,10 @@ dlabel literal_515_00552620
         self.assertEqual(1, len(rodata_entries))
         self.assertIn("literal_515_00552620", rodata_entries)
         self.assertEqual(12 * 4, rodata_entries["literal_515_00552620"].size)
+        # zero-initialized without listing every element
+        self.assertEqual(
+            "const unsigned char literal_515_00552620[48] = {0};", c_lines[0]
+        )
 
     def test_rodata_asciz(self):
         asm_contents = """
@@ -214,3 +221,285 @@ glabel
 
         with self.assertRaises(ValueError):
             Preprocessor().preprocess_s_file("bad_label.s", asm_contents.splitlines())
+
+
+class TestMayDefineFunctions(unittest.TestCase):
+    def may_define(self, c_contents, function_names=("func_801",), macros=None):
+        return Preprocessor.may_define_functions(
+            c_contents.strip().splitlines(keepends=True), function_names, macros
+        )
+
+    def test_no_functions(self):
+        self.assertFalse(self.may_define("void func_801(void) {}", []))
+
+    def test_include_asm_only(self):
+        c_contents = """
+#include "common.h"
+
+INCLUDE_ASM("asm/nonmatchings/foo", func_801);
+"""
+        self.assertFalse(self.may_define(c_contents))
+
+    def test_prototype_and_call(self):
+        c_contents = """
+#include "common.h"
+
+void func_801(s32 arg0, void (*cb)(void));
+INCLUDE_ASM("asm/nonmatchings/foo", func_801);
+
+void func_802(void) {
+    // func_801() {
+    func_801(0, NULL);
+    if (D_803 != "func_801() {") {
+        func_801(1, NULL);
+    }
+}
+"""
+        self.assertFalse(self.may_define(c_contents))
+
+    def test_definition(self):
+        c_contents = """
+INCLUDE_ASM("asm/nonmatchings/foo", func_801);
+
+void func_801(void) {
+}
+"""
+        self.assertTrue(self.may_define(c_contents))
+
+    def test_definition_in_conditional(self):
+        c_contents = """
+#ifndef NON_MATCHING
+INCLUDE_ASM("asm/nonmatchings/foo", func_801);
+#else
+s32 func_801(s32 arg0)
+{
+    return arg0;
+}
+#endif
+"""
+        self.assertTrue(self.may_define(c_contents))
+
+    def test_function_pointer_table(self):
+        c_contents = """
+void (*D_803[])(void) = { func_801 };
+void* D_804 = func_801;
+"""
+        self.assertTrue(self.may_define(c_contents))
+
+    def test_directive_mentions_function(self):
+        c_contents = """
+#define func_alias func_801
+"""
+        self.assertTrue(self.may_define(c_contents))
+
+    def test_token_pasting(self):
+        c_contents = """
+#define DEFINE_FUNC(n) void func_##n(void) {}
+DEFINE_FUNC(801)
+"""
+        self.assertTrue(self.may_define(c_contents))
+
+    def test_include_source_file(self):
+        c_contents = """
+#include "common.h"
+#include "../shared.c"
+"""
+        self.assertTrue(self.may_define(c_contents))
+
+    def test_extern_c_block(self):
+        c_contents = """
+extern "C" {
+void func_801(void) {}
+}
+"""
+        self.assertTrue(self.may_define(c_contents))
+
+    def test_definition_named_by_macro_call(self):
+        c_contents = """
+#include "m.h"
+INCLUDE_ASM("asm/nonmatchings/foo", func_801);
+
+void GLUE(func_, 801)(void) {}
+"""
+        self.assertTrue(self.may_define(c_contents))
+        self.assertTrue(self.may_define(c_contents, macros={"GLUE": "(a, b) a##b"}))
+
+    def test_definition_named_by_header_macro(self):
+        c_contents = """
+#include "m.h"
+INCLUDE_ASM("asm/nonmatchings/foo", func_801);
+
+void foo(void) {}
+"""
+        self.assertTrue(self.may_define(c_contents, macros={"foo": " func_801"}))
+
+    def test_header_macro_expanding_to_definition(self):
+        c_contents = """
+#include "m.h"
+DEFINE_FUNC(801)
+"""
+        macros = {
+            "GLUE": "(a, b) a##b",
+            "DEFINE_FUNC": "(n) void GLUE(func_, n)(void) {}",
+        }
+        self.assertTrue(self.may_define(c_contents, macros=macros))
+
+    def test_harmless_header_macros(self):
+        c_contents = """
+#include "m.h"
+INCLUDE_ASM("asm/nonmatchings/foo", func_801);
+
+STATIC s32 func_802(void) {
+    return MAX(1, 2);
+}
+s32 D_803[] = { 1, 2 };
+"""
+        macros = {"STATIC": " static", "MAX": "(a, b) ((a) > (b) ? (a) : (b))"}
+        self.assertFalse(self.may_define(c_contents, macros=macros))
+
+
+class TestFindMacros(unittest.TestCase):
+    def test_find_macros(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            root = Path(temp_dir)
+            (root / "include").mkdir()
+            (root / "include" / "m.h").write_text(
+                '#include "n.h"\n#define GLUE(a, b) \\\n    a##b\n'
+            )
+            (root / "include" / "n.h").write_text("#define foo func_801\n")
+
+            macros = Preprocessor.find_macros(
+                root / "foo.c", ['#include "m.h"\n'], [root / "include"]
+            )
+            self.assertEqual({"GLUE": "(a, b) a##b", "foo": "func_801"}, macros)
+
+            # a header that cannot be found could define anything
+            self.assertIsNone(
+                Preprocessor.find_macros(
+                    root / "foo.c", ['#include "missing.h"\n'], [root / "include"]
+                )
+            )
+            self.assertEqual(
+                {},
+                Preprocessor.find_macros(
+                    root / "foo.c", ["#include <stdio.h>\n"], [root / "include"]
+                ),
+            )
+
+
+class TestFindIncludes(unittest.TestCase):
+    def test_nested_includes(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            root = Path(temp_dir)
+            (root / "src").mkdir()
+            (root / "include").mkdir()
+            (root / "include" / "common.h").write_text('#include "types.h"\n')
+            (root / "include" / "types.h").write_text("typedef int s32;\n")
+            (root / "src" / "local.h").write_text("#include <common.h>\n")
+
+            c_contents = """
+#include "local.h"
+#include <stdio.h>
+  #  include "common.h"
+"""
+            includes = Preprocessor.find_includes(
+                root / "src" / "foo.c",
+                c_contents.splitlines(),
+                [root / "include"],
+            )
+
+        self.assertEqual(
+            [
+                root / "src" / "local.h",
+                root / "include" / "common.h",
+                root / "include" / "types.h",
+            ],
+            includes,
+        )
+
+    def test_unresolved(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            root = Path(temp_dir)
+            (root / "include").mkdir()
+            (root / "include" / "common.h").write_text("#include HEADER\n")
+
+            c_contents = """
+#include "missing.h"
+#include <stdio.h>
+#include <common.h>
+"""
+            unresolved: list[str] = []
+            includes = Preprocessor.find_includes(
+                root / "foo.c", c_contents.splitlines(), [root / "include"], unresolved
+            )
+
+        self.assertEqual([root / "include" / "common.h"], includes)
+        # toolchain headers are not expected to be found
+        self.assertEqual(["missing.h", "#include HEADER"], unresolved)
+
+
+class TestFindAsmFiles(unittest.TestCase):
+    def test_prefix(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            root = Path(temp_dir)
+            (root / "asm").mkdir()
+            (root / "asm" / "func_801.s").write_text("")
+            (root / "asm" / "D_802.s").write_text("")
+
+            c_contents = """
+INCLUDE_ASM("asm", func_801);
+INCLUDE_RODATA("asm", D_802);
+void func_803(void) {}
+"""
+            asm_files = Preprocessor(root).find_asm_files(c_contents.splitlines())
+
+        self.assertEqual(
+            [root / "asm" / "func_801.s", root / "asm" / "D_802.s"], asm_files
+        )
+
+    def test_missing_file(self):
+        with self.assertRaises(ValueError):
+            Preprocessor().find_asm_files(['INCLUDE_ASM("asm", func_801);'])
+
+
+class TestScanAsmFile(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.root = Path(self.temp_dir.name)
+        self.asm_file = self.root / "func.s"
+        self.asm_file.write_text(
+            "\n".join(
+                [
+                    "glabel func",
+                    "/* 0 */ nop",
+                    ".section .rodata",
+                    "dlabel D_0",
+                    "/* 4 */ .word 0x0",
+                    '/* 8 */ .asciz "abc"',
+                    ".section .text",
+                ]
+            )
+        )
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_cached_result_matches(self):
+        preprocessor = Preprocessor(cache=Cache(self.root / "cache"))
+
+        expected = Preprocessor().scan_asm_file(self.asm_file)
+        self.assertEqual(1, expected[0])
+        self.assertEqual(8, expected[1]["D_0"].size)
+
+        self.assertEqual(expected, preprocessor.scan_asm_file(self.asm_file))
+        # served from the cache
+        self.assertEqual(expected, preprocessor.scan_asm_file(self.asm_file))
+
+    def test_modified_file(self):
+        preprocessor = Preprocessor(cache=Cache(self.root / "cache"))
+        preprocessor.scan_asm_file(self.asm_file)
+
+        with self.asm_file.open("a") as f:
+            f.write("\n/* C */ nop\n")
+
+        self.assertEqual(2, preprocessor.scan_asm_file(self.asm_file)[0])
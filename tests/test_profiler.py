@@ -0,0 +1,54 @@
+import pstats
+import tempfile
+import time
+import unittest
+
+from pathlib import Path
+
+from mwccgap.profiler import profiling
+
+
+def busy(seconds: float) -> None:
+    end = time.thread_time() + seconds
+    while time.thread_time() < end:
+        pass
+
+
+def idle(seconds: float) -> None:
+    time.sleep(seconds)
+
+
+class TestProfiling(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.root = Path(self.temp_dir.name)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_pstats(self):
+        profile_path = self.root / "profiles" / "tu.pstats"
+        with profiling(profile_path):
+            busy(0.02)
+            idle(0.1)
+
+        stats = pstats.Stats(str(profile_path)).stats
+        times = {key[2]: value[3] for key, value in stats.items()}
+        self.assertGreater(times["busy"], 0.01)
+        # waiting is not CPU time
+        self.assertLess(times["idle"], 0.01)
+
+    def test_collapsed(self):
+        profile_path = self.root / "tu.folded"
+        with profiling(profile_path):
+            busy(0.05)
+            idle(0.1)
+
+        weights = {}
+        for line in profile_path.read_text().splitlines():
+            stack, weight = line.rsplit(" ", 1)
+            weights[stack.split(";")[-1]] = int(weight)
+
+        # microseconds of CPU time
+        self.assertGreater(weights["test_profiler.py:busy"], 25000)
+        self.assertLess(weights.get("test_profiler.py:idle", 0), 10000)
@@ -0,0 +1,45 @@
+import struct
+import unittest
+
+from unittest import mock
+
+from mwccgap import tables
+from mwccgap.elf import Relocation, Symbol
+from mwccgap.tables import pack_relocations, pack_symbols, renumber_relocations
+
+
+class TestTables(unittest.TestCase):
+    def setUp(self):
+        self.relocations = [
+            Relocation(i * 4, (i % 7) << 8 | i % 3 + 4) for i in range(20)
+        ]
+        self.table = b"".join(x.pack() for x in self.relocations)
+        self.remap = [6, 5, 4, 3, 2, 1, 0]
+
+    def expected(self):
+        return b"".join(
+            struct.pack(
+                "<II", x.r_offset, self.remap[x.symbol_index] << 8 | x.reloc_type
+            )
+            for x in self.relocations
+        )
+
+    def test_renumber(self):
+        with mock.patch.object(tables, "numpy", None):
+            self.assertEqual(
+                [self.expected(), b""],
+                renumber_relocations([memoryview(self.table), b""], self.remap),
+            )
+
+    @unittest.skipIf(tables.numpy is None, "NumPy is not installed")
+    def test_renumber_numpy(self):
+        self.assertEqual(
+            [self.expected(), b""],
+            renumber_relocations([memoryview(self.table), b""], self.remap),
+        )
+
+    def test_pack(self):
+        self.assertEqual(self.table, pack_relocations(self.relocations))
+
+        symbols = [Symbol(i, i * 4, 4, 0x12, 0, i) for i in range(5)]
+        self.assertEqual(b"".join(x.pack() for x in symbols), pack_symbols(symbols))
@@ -0,0 +1,124 @@
+import json
+import os
+import sys
+import tempfile
+import threading
+import unittest
+
+from pathlib import Path
+from unittest import mock
+
+from mwccgap.timings import Timings, run_process
+
+
+class TestTimings(unittest.TestCase):
+    def test_phases(self):
+        timings = Timings()
+        with timings.phase("compile"):
+            run_process([sys.executable, "-c", "pass"], timings=timings)
+        with timings.phase("compile"):
+            pass
+        with timings.phase("preprocess"):
+            pass
+        timings.finish()
+
+        report = timings.to_dict()
+        # in the order they run
+        self.assertEqual(["preprocess", "compile"], list(report["phases"]))
+        compile_timing = timings.phases["compile"]
+        self.assertEqual(1, compile_timing.subprocesses)
+        self.assertGreater(compile_timing.subprocess_wall, 0)
+        self.assertLessEqual(
+            compile_timing.subprocess_spawn, compile_timing.subprocess_wall
+        )
+        self.assertGreaterEqual(compile_timing.wall, compile_timing.subprocess_wall)
+        self.assertEqual(1, timings.total.subprocesses)
+        self.assertGreaterEqual(timings.total.wall, compile_timing.wall)
+
+    def test_assemblies(self):
+        timings = Timings()
+
+        def assemble():
+            with timings.assembly(["func_a", "func_b"]):
+                run_process([sys.executable, "-c", "pass"], timings=timings)
+
+        with timings.phase("assemble"):
+            # assembler invocations run on threads of their own
+            thread = threading.Thread(target=assemble)
+            thread.start()
+            thread.join()
+        timings.finish()
+
+        self.assertEqual(1, len(timings.assemblies))
+        self.assertEqual(["func_a", "func_b"], timings.assemblies[0].functions)
+        self.assertEqual(1, timings.assemblies[0].subprocesses)
+        self.assertEqual(1, timings.phases["assemble"].subprocesses)
+        self.assertEqual(1, timings.total.subprocesses)
+        self.assertIn("1 subprocesses", timings.summary())
+
+    def test_run_process(self):
+        returncode, stdout, stderr = run_process(
+            [sys.executable, "-c", "import sys; print(sys.stdin.read()); sys.exit(3)"],
+            b"input",
+        )
+        self.assertEqual(3, returncode)
+        self.assertEqual(b"input", stdout.strip())
+        self.assertEqual(b"", stderr)
+
+    def test_short_writes(self):
+        write = os.write
+
+        # write at most 16 bytes at a time
+        def short_write(fd, data):
+            return write(fd, data[:16])
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            trace_file = Path(temp_dir) / "trace.json"
+            timings = Timings("a.c")
+            with timings.span("parse ELF"):
+                pass
+            with mock.patch("os.write", short_write):
+                timings.write_trace(trace_file)
+
+            data = trace_file.read_text()
+
+        events = json.loads(data.rstrip().rstrip(",") + "]")
+        self.assertEqual(["M", "X"], [x["ph"] for x in events])
+
+    def test_write_trace(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            trace_file = Path(temp_dir) / "traces" / "trace.json"
+            for tu in ("a.c", "b.c"):
+                timings = Timings(tu)
+                with timings.phase("compile"):
+                    run_process([sys.executable, "-c", "pass"], timings=timings)
+                with timings.span("parse ELF"):
+                    pass
+                timings.write_trace(trace_file)
+
+            data = trace_file.read_text()
+
+        # the closing bracket is omitted for invocations to append to the file
+        self.assertTrue(data.startswith("[\n"))
+        events = json.loads(data.rstrip().rstrip(",") + "]")
+
+        metadata = [x for x in events if x["ph"] == "M"]
+        self.assertEqual(["a.c", "b.c"], [x["args"]["name"] for x in metadata])
+
+        spans = [x for x in events if x["ph"] == "X"]
+        self.assertEqual(["a.c"] * 4 + ["b.c"] * 4, [x["args"]["tu"] for x in spans])
+
+        python = Path(sys.executable).name
+        by_name = {x["name"]: x for x in spans[:4]}
+        self.assertEqual(
+            {"compile", "parse ELF", python, f"spawn {python}"}, set(by_name)
+        )
+        compile_span = by_name["compile"]
+        process_span = by_name[python]
+        # nested within the phase, the timestamps being absolute
+        self.assertLessEqual(compile_span["ts"], process_span["ts"])
+        self.assertLessEqual(
+            process_span["ts"] + process_span["dur"],
+            compile_span["ts"] + compile_span["dur"],
+        )
+        self.assertLessEqual(by_name[f"spawn {python}"]["dur"], process_span["dur"])
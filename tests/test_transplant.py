@@ -0,0 +1,15 @@
+import unittest
+
+from mwccgap.elf import Relocation
+from mwccgap.transplant import split_relocations
+
+
+class TestSplitRelocations(unittest.TestCase):
+    def test_split(self):
+        relocations = [Relocation(offset, 2 << 8 | 2) for offset in (0, 4, 8, 12, 16)]
+
+        split = split_relocations(relocations, [8, 12, 16])
+
+        self.assertEqual([[0, 4], [0], [0]], [[x.r_offset for x in y] for y in split])
+        # past the end of the last section
+        self.assertNotIn(relocations[-1], [x for y in split for x in y])
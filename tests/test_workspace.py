@@ -0,0 +1,278 @@
+import json
+import os
+import sys
+import tempfile
+import unittest
+
+from pathlib import Path
+
+from mwccgap.cache import Cache
+from mwccgap.compiler import Compiler
+from mwccgap.mwccgap import scratch_c_file
+from mwccgap.workspace import (
+    MEMFD_AVAILABLE,
+    ToolOutput,
+    Workspace,
+    _in_memory_tools,
+    get_workspace,
+)
+
+
+class TestWorkspace(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.root = Path(self.temp_dir.name)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_temp_file(self):
+        workspace = Workspace(self.root)
+        with workspace.temp_file(".c", b"data") as path:
+            self.assertEqual(workspace.path, path.parent)
+            self.assertEqual(self.root, workspace.path.parent)
+            self.assertEqual(b"data", path.read_bytes())
+            # named like a NamedTemporaryFile, see replace_sinit()
+            self.assertRegex(path.name, r"^tmp\w{8}\.c$")
+        self.assertFalse(path.exists())
+
+        # the directory is reused
+        with workspace.temp_file(".o") as path:
+            self.assertEqual(workspace.path, path.parent)
+        self.assertEqual([workspace.path], list(self.root.iterdir()))
+
+        workspace.remove()
+        self.assertEqual([], list(self.root.iterdir()))
+
+    def test_temp_file_directory(self):
+        workspace = Workspace(self.root)
+        directory = self.root / "src"
+        directory.mkdir()
+        with workspace.temp_file(".c", directory=directory) as path:
+            self.assertEqual(directory, path.parent)
+        self.assertEqual([], list(directory.iterdir()))
+
+    def test_get_workspace(self):
+        self.assertIs(get_workspace(self.root), get_workspace(self.root))
+        self.assertIsNot(get_workspace(self.root), get_workspace())
+
+    def test_remove_by_owner_only(self):
+        workspace = Workspace(self.root)
+        path = workspace.path
+
+        pid = os.fork()
+        if pid == 0:
+            # e.g. a job forked by the daemon, sharing the workspace
+            workspace.remove()
+            os._exit(0)
+        os.waitpid(pid, 0)
+        self.assertTrue(path.is_dir())
+
+        workspace.remove()
+        self.assertFalse(path.exists())
+
+
+class TestRunTool(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.workspace = Workspace(Path(self.temp_dir.name))
+        self.outputs: list[ToolOutput] = []
+
+    def tearDown(self):
+        self.workspace.remove()
+        self.temp_dir.cleanup()
+
+    def tool(self, in_memory: bool = True, returncode: int = 0, fails_in_memory=False):
+        def run(output: ToolOutput) -> tuple[int, bytes, bytes]:
+            self.outputs.append(output)
+            if fails_in_memory and output.fd is not None:
+                # e.g. under a wibo that cannot open /proc/self/fd
+                return (1, b"out", b"err")
+            # a tool that cannot write to /proc/self/fd writes nothing there
+            if in_memory or output.fd is None:
+                with open(output.path, "wb") as f:
+                    f.write(b"object")
+            return (returncode, b"out", b"err")
+
+        return run
+
+    def test_read_nothing(self):
+        with self.workspace.output(".o", in_memory=False) as output:
+            self.assertIsNone(output.read())
+        with self.workspace.output(".o") as output:
+            self.assertIsNone(output.read())
+
+    @unittest.skipUnless(MEMFD_AVAILABLE, "memfds are not available")
+    def test_in_memory(self):
+        key = ("in memory", self.id())
+        for _ in range(2):
+            result = self.workspace.run_tool(key, self.tool(), ".o")
+            self.assertEqual((0, b"out", b"err", b"object"), result)
+        self.assertEqual(2, len(self.outputs))
+        self.assertTrue(all(x.fd is not None for x in self.outputs))
+        # nothing was written to the workspace
+        self.assertEqual([], list(self.workspace.path.iterdir()))
+
+    @unittest.skipUnless(MEMFD_AVAILABLE, "memfds are not available")
+    def test_file_fallback(self):
+        key = ("file", self.id())
+        result = self.workspace.run_tool(key, self.tool(in_memory=False), ".o")
+        self.assertEqual((0, b"out", b"err", b"object"), result)
+        self.assertEqual([False, True], [x.fd is None for x in self.outputs])
+
+        # the tool is not given a memfd again
+        self.outputs.clear()
+        self.workspace.run_tool(key, self.tool(in_memory=False), ".o")
+        self.assertEqual([True], [x.fd is None for x in self.outputs])
+
+    @unittest.skipUnless(MEMFD_AVAILABLE, "memfds are not available")
+    @unittest.skipUnless(MEMFD_AVAILABLE, "memfds are not available")
+    def test_first_run_fails(self):
+        key = ("first run fails", self.id())
+        result = self.workspace.run_tool(key, self.tool(returncode=3), ".o")
+
+        # run again with a file, which fails too, so nothing is known about the tool
+        self.assertEqual((3, b"out", b"err", b"object"), result)
+        self.assertEqual([False, True], [x.fd is None for x in self.outputs])
+        self.assertNotIn(key, _in_memory_tools)
+
+    @unittest.skipUnless(MEMFD_AVAILABLE, "memfds are not available")
+    def test_fails_in_memory(self):
+        key = ("fails in memory", self.id())
+        for _ in range(2):
+            result = self.workspace.run_tool(key, self.tool(fails_in_memory=True), ".o")
+            self.assertEqual((0, b"out", b"err", b"object"), result)
+
+        # given a file from the second run on
+        self.assertEqual([False, True, True], [x.fd is None for x in self.outputs])
+        self.assertFalse(_in_memory_tools[key])
+
+    @unittest.skipUnless(MEMFD_AVAILABLE, "memfds are not available")
+    def test_cached_support(self):
+        cache = Cache(Path(self.temp_dir.name) / "cache")
+        key = ("cached", self.id())
+        self.workspace.run_tool(key, self.tool(in_memory=False), ".o", cache=cache)
+
+        # a later process does not try memory again
+        del _in_memory_tools[key]
+        self.outputs.clear()
+        self.workspace.run_tool(key, self.tool(in_memory=False), ".o", cache=cache)
+        self.assertEqual([True], [x.fd is None for x in self.outputs])
+
+    def test_file_output(self):
+        key = ("file output", self.id())
+        result = self.workspace.run_tool(key, self.tool(), ".o", in_memory=False)
+        self.assertEqual((0, b"out", b"err", b"object"), result)
+        self.assertEqual([True], [x.fd is None for x in self.outputs])
+        self.assertNotIn(key, _in_memory_tools)
+
+    @unittest.skipUnless(MEMFD_AVAILABLE, "memfds are not available")
+    def test_failure(self):
+        key = ("failure", self.id())
+        self.workspace.run_tool(key, self.tool(), ".o")
+
+        # a failing tool leaves its output behind in memory
+        result = self.workspace.run_tool(key, self.tool(returncode=1), ".o")
+        self.assertEqual((1, b"out", b"err", None), result)
+        self.assertEqual(2, len(self.outputs))
+
+
+class TestImplicitIncludeDir(unittest.TestCase):
+    def has_implicit_include_dir(self, *c_flags: str) -> bool:
+        compiler = Compiler(list(c_flags), Path("mwccpsp.exe"), False, Path("wibo"))
+        return compiler.has_implicit_include_dir()
+
+    def test_default(self):
+        self.assertTrue(self.has_implicit_include_dir("-O4,p", "-Iinclude"))
+        self.assertTrue(self.has_implicit_include_dir("-cwd", "source"))
+
+    def test_explicit(self):
+        self.assertFalse(self.has_implicit_include_dir("-cwd", "explicit"))
+        self.assertFalse(self.has_implicit_include_dir("-cwd", "proj"))
+        self.assertFalse(self.has_implicit_include_dir("-Iinclude", "-I-"))
+        self.assertFalse(self.has_implicit_include_dir("-i-"))
+
+
+class TestCompilerFlags(unittest.TestCase):
+    def compiler(self, *c_flags: str) -> Compiler:
+        return Compiler(list(c_flags), Path("mwccpsp.exe"), False, Path("wibo"))
+
+    def test_defines(self):
+        compiler = self.compiler(
+            "-Dfoo=func_801", "-D", "BAR", "-d", "F(x)=x", "-DEMPTY=", "-O4,p"
+        )
+        self.assertEqual(
+            {"foo": "func_801", "BAR": "1", "F": "(x) x", "EMPTY": "1"},
+            compiler.get_defines(),
+        )
+
+    def test_prefix_files(self):
+        compiler = self.compiler("-prefix", "prefix.h", "-include", "other.h")
+        self.assertEqual(["prefix.h", "other.h"], compiler.get_prefix_files())
+
+    def test_recursive_include_dir(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            root = Path(temp_dir)
+            (root / "b" / "c").mkdir(parents=True)
+            (root / "a").mkdir()
+
+            compiler = self.compiler("-Iinclude", "-ir", str(root))
+            self.assertEqual(
+                [Path("include"), root, root / "a", root / "b", root / "b" / "c"],
+                compiler.get_include_dirs(),
+            )
+
+
+class TestCompileCopy(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.root = Path(self.temp_dir.name)
+
+        # writes its arguments to the object
+        self.mwcc_path = self.root / "mwcc.py"
+        self.mwcc_path.write_text(
+            f"#!{sys.executable}\n"
+            "import json, sys\n"
+            "argv = sys.argv[1:]\n"
+            "with open(argv[argv.index('-o') + 1], 'w') as f:\n"
+            "    json.dump(argv, f)\n"
+        )
+        self.mwcc_path.chmod(0o755)
+        self.compiler = Compiler(
+            ["-Iinclude"],
+            self.mwcc_path,
+            False,
+            Path("wibo"),
+            workspace=Workspace(self.root),
+        )
+
+    def tearDown(self):
+        self.compiler.workspace.remove()
+        self.temp_dir.cleanup()
+
+    def test_source_dir(self):
+        source_dir = self.root / "src"
+        with self.compiler.workspace.temp_file(".c") as c_file:
+            argv = json.loads(self.compiler.compile_file(c_file, source_dir))
+        # quoted #includes are found relative to the original C file first
+        self.assertEqual(["-c", f"-I{source_dir}", "-Iinclude"], argv[:3])
+        self.assertEqual(str(c_file), argv[-1])
+
+    def test_same_dir(self):
+        with self.compiler.workspace.temp_file(".c") as c_file:
+            argv = json.loads(self.compiler.compile_file(c_file, c_file.parent))
+        self.assertEqual(["-c", "-Iinclude"], argv[:2])
+
+    def test_copy_location(self):
+        c_file = self.root / "src" / "tu.c"
+        c_file.parent.mkdir()
+
+        # next to the C file unless asked otherwise
+        with scratch_c_file(self.compiler, c_file, b"") as path:
+            self.assertEqual(c_file.parent, path.parent)
+        with scratch_c_file(self.compiler, c_file, b"", in_workspace=True) as path:
+            self.assertEqual(self.compiler.workspace.path, path.parent)
+
+        self.compiler.c_flags.append("-I-")
+        with scratch_c_file(self.compiler, c_file, b"", in_workspace=True) as path:
+            self.assertEqual(c_file.parent, path.parent)